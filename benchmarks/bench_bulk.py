@@ -0,0 +1,73 @@
+'''
+Bulk ingestion from a local register dump: BRREGapi.get_companies_bulk on a gzipped json and csv fixture from
+`payloads.write_bulk`, so no download is needed. Reports rows/s and peak traced memory for each format, checks
+that every company came through, and that the columns match what get_companies gives for the same companies from
+the stub server (the csv dump has no `_links` columns).
+
+    python -m benchmarks.bench_bulk --companies 100000 --save-interval 50000
+'''
+import argparse
+import asyncio
+import os
+import shutil
+import tempfile
+import time
+import tracemalloc
+
+from benchmarks import payloads, stub_server
+from benchmarks.common import point_brreg_at
+
+
+async def main(companies: int, save_interval: int, sample: int):
+    from src.modules import BRREGapi
+
+    root = tempfile.mkdtemp(prefix='bulk_')
+    runner, base_url = await stub_server.start(stub_server.make_app(companies))
+    try:
+        api = point_brreg_at(BRREGapi(), base_url)
+        api.logger.set_level('WARNING')
+        reference = await api.get_companies([payloads.org_nr(i) for i in range(min(sample, companies))])
+        expected = set(reference.columns)
+
+        failed = []
+        for fmt in ['json', 'csv']:
+            start = time.perf_counter()
+            path = payloads.write_bulk(os.path.join(root, f'enheter.{fmt}.gz'), companies, fmt)
+            written = time.perf_counter() - start
+
+            start = time.perf_counter()
+            df = await api.get_companies_bulk(source=path, fmt=fmt, save_interval=save_interval)
+            elapsed = time.perf_counter() - start
+            # Minnet måles i en egen kjøring, siden tracemalloc gjør pandas mange ganger tregere
+            del df
+            tracemalloc.start()
+            df = await api.get_companies_bulk(source=path, fmt=fmt, save_interval=save_interval)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+            columns = set(df.columns)
+            missing = sorted(expected - columns)
+            extra = sorted(columns - expected)
+            print(f"{fmt:<5} {os.path.getsize(path) / 1e6:6.1f} MB gz (written in {written:5.2f}s) | {len(df)} rows in "
+                  f"{elapsed:6.2f}s, {len(df) / elapsed:8.0f} rows/s | peak {peak / 1e6:7.1f} MB | "
+                  f"{df['organisasjonsnummer'].nunique()} org numbers")
+            print(f"      columns vs get_companies: {len(columns & expected)} shared, missing {missing}, extra {extra}")
+            if len(df) != companies or df['organisasjonsnummer'].nunique() != companies:
+                failed.append(f'{fmt}: {len(df)} rows for {companies} companies')
+            if extra or (fmt == 'json' and missing) or any('_links' not in c for c in missing):
+                failed.append(f'{fmt}: columns differ from get_companies')
+        await api.close()
+        if failed:
+            raise SystemExit('; '.join(failed))
+    finally:
+        await runner.cleanup()
+        shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--companies', type=int, default=100000)
+    parser.add_argument('--save-interval', type=int, default=50000)
+    parser.add_argument('--sample', type=int, default=200, help='Companies fetched with get_companies for the columns')
+    args = parser.parse_args()
+    asyncio.run(main(args.companies, args.save_interval, args.sample))
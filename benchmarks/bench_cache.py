@@ -0,0 +1,52 @@
+'''
+Requests, bytes and wall time of BRREGapi.get_financial_data with the response cache: a cold run, a rerun within the
+TTL (served from disk, e.g. after a crash) and a rerun after the TTL (revalidated with If-None-Match, answered by 304).
+
+    python -m benchmarks.bench_cache --requests 5000 --latency 0.02
+'''
+import argparse
+import asyncio
+import os
+import shutil
+import tempfile
+import time
+
+from benchmarks import payloads, stub_server
+from benchmarks.common import point_brreg_at
+
+
+async def main(n: int, latency: float):
+    from src.httpcache import ResponseCache
+    from src.modules import BRREGapi
+    from src.ratelimit import AdaptiveRateLimiter
+
+    app = stub_server.make_app(n, latency)
+    runner, base_url = await stub_server.start(app)
+    root = tempfile.mkdtemp(prefix='cache_')
+    org_nums = [payloads.org_nr(i) for i in range(n)]
+    try:
+        cache = ResponseCache(os.path.join(root, 'responses.sqlite'))
+        for run, ttl in [('cold', 3600), ('within ttl', 3600), ('after ttl', 0)]:
+            cache.ttl = ttl
+            cache.counters = dict.fromkeys(cache.counters, 0)
+            limiter = AdaptiveRateLimiter(rate=1e6, max_rate=1e6, concurrency=200, max_concurrency=200)
+            api = point_brreg_at(BRREGapi(limiter=limiter, cache=cache), base_url)
+            api.logger.set_level('WARNING')
+            before = app['requests']
+            start = time.perf_counter()
+            df = await api.get_financial_data(org_nums)
+            elapsed = time.perf_counter() - start
+            await api.close()
+            print(f"{run:<11} {app['requests'] - before:6d} requests {elapsed:6.2f}s  rows {len(df)} | {cache}")
+        cache.close()
+    finally:
+        await runner.cleanup()
+        shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--latency', type=float, default=0.02)
+    args = parser.parse_args()
+    asyncio.run(main(args.requests, args.latency))
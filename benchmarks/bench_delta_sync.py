@@ -0,0 +1,100 @@
+'''
+Requests and wall time of BRREGapi.sync_updates against the stub update feed, compared with what a full refresh
+(one enhet and one roller request per company) would cost. A second sync from the stored mark shows that a refresh
+with no new updates costs a single feed request. A third sync from scratch with a SeenSet that already holds every
+company must fetch the same organisations as the first, since changed organisations are not skipped. Last, a sync
+against a stub answering `--error-rate` of the requests with 503 (one retry per request) keeps the organisations it
+gave up on in the state file, and the next sync, with the errors turned off, fetches them before anything else.
+Writes go to a LocalSink in a temporary folder.
+
+    python -m benchmarks.bench_delta_sync --companies 100000 --updates 2000
+'''
+import argparse
+import asyncio
+import os
+import shutil
+import tempfile
+import time
+
+from benchmarks import payloads, stub_server
+from benchmarks.common import point_brreg_at
+
+
+async def main(companies: int, updates: int, latency: float, error_rate: float):
+    from src.modules import BRREGapi
+    from src.ratelimit import AdaptiveRateLimiter
+    from src.seen import SeenSet
+    from src.sinks import LocalSink
+
+    app = stub_server.make_app(companies, latency, n_updates=updates)
+    runner, base_url = await stub_server.start(app)
+    root = tempfile.mkdtemp(prefix='delta_')
+    state_path = os.path.join(root, 'updates.json')
+    try:
+        sink = LocalSink(os.path.join(root, 'data'))
+        limiter = AdaptiveRateLimiter(rate=1e6, max_rate=1e6, concurrency=200, max_concurrency=200)
+        api = point_brreg_at(BRREGapi(limiter=limiter, sink=sink), base_url)
+        api.logger.set_level('WARNING')
+
+        requests = {}
+        for run in ['first sync', 'no changes']:
+            before = app['requests']
+            start = time.perf_counter()
+            summary = await api.sync_updates(state_path, since='2024-01-01T00:00:00.000Z')
+            elapsed = time.perf_counter() - start
+            requests[run] = app['requests'] - before
+            print(f"{run:<11} {requests[run]:7d} requests in {elapsed:6.2f}s | {summary}")
+        await api.close()
+
+        seen = SeenSet(os.path.join(root, 'seen.sqlite'))
+        all_orgs = [payloads.org_nr(i) for i in range(companies)]
+        for job in ('brreg.company_data', 'brreg.roles'):
+            seen.add(job, all_orgs)
+        api = point_brreg_at(BRREGapi(limiter=limiter, sink=sink, seen=seen), base_url)
+        api.logger.set_level('WARNING')
+        before = app['requests']
+        start = time.perf_counter()
+        summary = await api.sync_updates(os.path.join(root, 'updates_seen.json'), since='2024-01-01T00:00:00.000Z')
+        elapsed = time.perf_counter() - start
+        await api.close()
+        seen.close()
+        print(f"{'with seen':<11} {app['requests'] - before:7d} requests in {elapsed:6.2f}s | {summary}")
+        if app['requests'] - before != requests['first sync']:
+            raise SystemExit(f"Sync with a full SeenSet made {app['requests'] - before} requests, "
+                             f"expected {requests['first sync']}")
+
+        flaky_state = os.path.join(root, 'updates_flaky.json')
+        for run, rate in [('flaky', error_rate), ('recovered', 0.0)]:
+            flaky_runner, flaky_url = await stub_server.start(
+                stub_server.make_app(companies, latency, n_updates=updates, error_rate=rate))
+            # Grensene låst, så 503-ene ikke senker farten, og bare ett nytt forsøk per kall
+            flaky = AdaptiveRateLimiter(rate=1e6, min_rate=1e6, max_rate=1e6, concurrency=200, min_concurrency=200,
+                                        max_concurrency=200, max_retries=1, base_backoff=0.01)
+            api = point_brreg_at(BRREGapi(limiter=flaky, sink=sink), flaky_url)
+            api.logger.set_level('CRITICAL')
+            try:
+                summary = await api.sync_updates(flaky_state, since='2024-01-01T00:00:00.000Z')
+            finally:
+                await api.close()
+                await flaky_runner.cleanup()
+            print(f"{run:<11} retried {summary['retried']:5d} | still to retry {summary['to_retry']:5d} | {summary}")
+        if summary['to_retry']:
+            raise SystemExit(f"{summary['to_retry']} organisations were still not fetched after the errors stopped")
+
+        df = sink.read('company_data', 'brreg')
+        print(f"company_data: {len(df)} rows, {df['slettedato'].notna().sum()} deleted | "
+              f"roles: {len(sink.read('roles', 'brreg'))} rows")
+        print(f"full refresh would be {2 * companies} requests")
+    finally:
+        await runner.cleanup()
+        shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--companies', type=int, default=100000)
+    parser.add_argument('--updates', type=int, default=2000)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.2)
+    args = parser.parse_args()
+    asyncio.run(main(args.companies, args.updates, args.latency, args.error_rate))
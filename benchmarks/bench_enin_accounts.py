@@ -0,0 +1,74 @@
+'''
+EninApi.fetch_accounts against the old `get_items_with_ids(get_item)` path, both saving to a LocalSink.
+Each run is made in its own process, so the peak memory (max RSS) of the two can be compared.
+
+    python -m benchmarks.bench_enin_accounts --companies 40000
+'''
+import argparse
+import asyncio
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks import payloads, stub_server
+from benchmarks.common import offline
+
+
+async def run(mode: str, companies: int, latency: float, concurrency: int):
+    offline()
+    from src.modules import EninApi
+    from src.sinks import LocalSink
+
+    runner, base_url = await stub_server.start(stub_server.make_app(companies, latency))
+    root = tempfile.mkdtemp(prefix='enin_accounts_')
+    try:
+        api = EninApi(sink=LocalSink(root))
+        api.logger.set_level('WARNING')
+        api.analysis_url = f'{base_url}/analysis/v1'
+        org_nums = [payloads.org_nr(i) for i in range(companies)]
+        start = time.perf_counter()
+        if mode == 'stream':
+            await api.fetch_accounts(org_nums, concurrency=concurrency)
+        else:
+            await api.get_items_with_ids(org_nums, api.get_item, save=True, save_interval=5000,
+                                         concurrent_requests=concurrency)
+        await api.close()
+        elapsed = time.perf_counter() - start
+        rows = len(LocalSink(root).read('accounts', 'enin'))
+        print(json.dumps({'mode': mode, 'seconds': round(elapsed, 2), 'accounts_rows': rows,
+                          'max_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024)}))
+    finally:
+        await runner.cleanup()
+        shutil.rmtree(root)
+
+
+def main(companies: int, latency: float, concurrency: int):
+    for mode in ['items', 'stream']:
+        out = subprocess.run([sys.executable, '-m', 'benchmarks.bench_enin_accounts', '--mode', mode,
+                              '--companies', str(companies), '--latency', str(latency),
+                              '--concurrency', str(concurrency)],
+                             capture_output=True, text=True, cwd=os.getcwd())
+        if out.returncode:
+            print(out.stderr[-2000:])
+            continue
+        result = json.loads(out.stdout.strip().splitlines()[-1])
+        print(f"{mode:<7} {result['seconds']:7.2f}s  {companies / result['seconds'] * 60:9.0f} companies/min  "
+              f"max RSS {result['max_rss_mb']:5d} MB | {result['accounts_rows']} accounts rows")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--companies', type=int, default=40000)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--mode', choices=['items', 'stream'])
+    args = parser.parse_args()
+    if args.mode:
+        asyncio.run(run(args.mode, args.companies, args.latency, args.concurrency))
+    else:
+        main(args.companies, args.latency, args.concurrency)
@@ -0,0 +1,58 @@
+'''
+Pages/second of EninApi.get_companies against the stub server, and a resume after an interrupted crawl.
+
+    python -m benchmarks.bench_enin_paging --companies 20000 --latency 0.05
+'''
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+from benchmarks import stub_server
+from benchmarks.common import offline
+
+
+async def main(companies: int, latency: float):
+    offline()
+    from src.modules import EninApi
+
+    runner, base_url = await stub_server.start(stub_server.make_app(companies, latency))
+    try:
+        for concurrency in [1, 4, 8, 16]:
+            api = EninApi()
+            api.base_url = base_url
+            start = time.perf_counter()
+            df = await api.get_companies(concurrency=concurrency)
+            elapsed = time.perf_counter() - start
+            await api.close()
+            pages = -(-companies // api.PAGE_SIZE)
+            print(f'concurrency={concurrency:<3} companies={len(df):<7} {pages / elapsed:8.1f} pages/s')
+
+        checkpoint_path = os.path.join(tempfile.mkdtemp(), 'checkpoint.json')
+        api = EninApi()
+        api.base_url = base_url
+        try:
+            await asyncio.wait_for(api.get_companies(save=True, concurrency=4, checkpoint_path=checkpoint_path),
+                                   timeout=latency * companies / api.PAGE_SIZE / 8 + 0.05)
+        except asyncio.TimeoutError:
+            pass
+        await api.close()
+        with open(checkpoint_path) as f:
+            print(f'interrupted, checkpoint: {f.read()}')
+
+        api = EninApi()
+        api.base_url = base_url
+        df = await api.get_companies(concurrency=4, checkpoint_path=checkpoint_path)
+        await api.close()
+        print(f'resumed and fetched the remaining {len(df)} companies')
+    finally:
+        await runner.cleanup()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--companies', type=int, default=20000)
+    parser.add_argument('--latency', type=float, default=0.05)
+    args = parser.parse_args()
+    asyncio.run(main(args.companies, args.latency))
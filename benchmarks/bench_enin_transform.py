@@ -0,0 +1,95 @@
+'''
+EninApi.transform_data against the per-key transform it replaced, on recorded accounts-composite payloads.
+Checks that both give the same six tables (values, dtypes and column order) and compares the time.
+
+Payloads are read from a jsonl file with one `[org_nr, response]` per line. Without `--payloads` a file is recorded
+from the stub payloads first.
+
+    python -m benchmarks.bench_enin_transform --companies 100000
+    python -m benchmarks.bench_enin_transform --payloads recorded.jsonl
+'''
+import argparse
+import copy
+import json
+import os
+import tempfile
+import time
+
+import pandas as pd
+
+from benchmarks import payloads
+from benchmarks.common import offline
+
+
+def legacy_transform_data(items, logger) -> dict:
+    # Den gamle transform_data/transform_single, med debug-loggingen men uten tellerne
+    data = {key: [] for key in ('accounts', 'accounts_highlights', 'accounts_income_statement',
+                                'accounts_balance_sheet', 'company', 'accounts_type')}
+    for orgnr, res in (item for item in items if item is not None):
+        if res and len(res) > 0:
+            for year in res:
+                for key in data:
+                    if key not in ["company", 'accounts_type']:
+                        logger.debug(f'Adding data {key}')
+                        sub_data = year.get(key)
+                        sub_data["org_nr"] = int(orgnr)
+                        data.get(key).append(sub_data)
+            for key in ["company", 'accounts_type']:
+                logger.debug(f'Adding data {key}')
+                sub_data = res[0].get(key)
+                sub_data["org_nr"] = int(orgnr)
+                data.get(key).append(sub_data)
+    return {key: pd.DataFrame(value) for key, value in data.items()}
+
+
+def record(path: str, companies: int):
+    with open(path, 'w') as f:
+        for i in range(companies):
+            # Hvert tiende selskap har ingen regnskap, som i stubben
+            response = [] if i % 10 == 0 else payloads.enin_accounts_composite(i, years=1 + i % 5)
+            f.write(json.dumps([payloads.org_nr(i), response]) + '\n')
+
+
+def load(path: str) -> list:
+    with open(path) as f:
+        return [tuple(json.loads(line)) for line in f if line.strip()]
+
+
+def main(payload_path: str, companies: int, batch_size: int):
+    offline()
+    from src.modules import EninApi
+
+    if payload_path is None:
+        payload_path = os.path.join(tempfile.mkdtemp(), 'accounts_composite.jsonl')
+        record(payload_path, companies)
+    items = load(payload_path)
+    batches = [items[i:i + batch_size] for i in range(0, len(items), batch_size)]
+    api = EninApi()
+    api.logger.set_level('WARNING')
+
+    # Den gamle endrer svarene, så den får en kopi
+    copies = copy.deepcopy(batches)
+    start = time.perf_counter()
+    legacy = [legacy_transform_data(batch, api.logger) for batch in copies]
+    legacy_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    new = [api.transform_data(batch) for batch in batches]
+    new_s = time.perf_counter() - start
+
+    for old_tables, new_tables in zip(legacy, new):
+        for key in old_tables:
+            pd.testing.assert_frame_equal(old_tables[key], new_tables[key])
+    rows = sum(len(df) for tables in new for df in tables.values())
+    print(f"{len(items)} responses in {len(batches)} batches, {rows} rows | output identical")
+    print(f"legacy      {legacy_s:6.2f}s  {len(items) / legacy_s:9.0f} companies/s")
+    print(f"vectorised  {new_s:6.2f}s  {len(items) / new_s:9.0f} companies/s  ({legacy_s / new_s:.1f}x)")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--payloads', help='jsonl file with one [org_nr, response] per line')
+    parser.add_argument('--companies', type=int, default=100000, help='Companies to record without --payloads')
+    parser.add_argument('--batch-size', type=int, default=5000)
+    args = parser.parse_args()
+    main(args.payloads, args.companies, args.batch_size)
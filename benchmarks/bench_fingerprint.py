@@ -0,0 +1,65 @@
+'''
+Rows written by a weekly-style refresh of company_data with and without the fingerprint index: the same companies
+are saved twice, with a share of them changed the second time. Also reports the time spent hashing and looking up.
+
+    python -m benchmarks.bench_fingerprint --records 50000 --changed 0.05
+'''
+import argparse
+import asyncio
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from benchmarks import payloads
+
+
+async def main(n: int, changed: float, batch: int):
+    from src.fingerprint import FingerprintIndex
+    from src.modules import BRREGapi
+    from src.sinks import Sink
+
+    class CountingSink(Sink):
+        def __init__(self):
+            self.rows = 0
+
+        def write(self, df, table, dataset, if_exists='append', merge_on=None, explicit_schema=None):
+            self.rows += len(df)
+
+    first = [payloads.enhet(i) for i in range(n)]
+    second = [dict(record) for record in first]
+    for i in random.Random(0).sample(range(n), int(n * changed)):
+        second[i]['antallAnsatte'] += 1
+
+    root = tempfile.mkdtemp(prefix='fingerprint_')
+    try:
+        for name, fingerprints in [('full merge', None),
+                                   ('fingerprints', FingerprintIndex(os.path.join(root, 'fp.sqlite')))]:
+            sink = CountingSink()
+            api = BRREGapi(sink=sink, fingerprints=fingerprints)
+            api.logger.set_level('WARNING')
+            for run, records in [('initial', first), ('refresh', second)]:
+                sink.rows = 0
+                start = time.perf_counter()
+                for i in range(0, n, batch):
+                    df = api._prep_company_data(api._flatten(records[i:i + batch]))
+                    await api.save_bq(df, 'organisasjonsnummer', table='company_data', dataset='brreg', if_exists='merge')
+                await api.writer.wait()
+                elapsed = time.perf_counter() - start
+                print(f'{name:<13} {run:<8} {sink.rows:8d} rows written  {elapsed:6.2f}s')
+            if fingerprints:
+                print(f'              {fingerprints}')
+                fingerprints.close()
+            await api.close()
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--records', type=int, default=50000)
+    parser.add_argument('--changed', type=float, default=0.05)
+    parser.add_argument('--batch', type=int, default=5000)
+    args = parser.parse_args()
+    asyncio.run(main(args.records, args.changed, args.batch))
@@ -0,0 +1,87 @@
+'''
+CPU time and peak RSS of flattening BRREG payloads one record at a time (json_normalize per record and pd.concat,
+the old fetcher path) against one json_normalize per save batch. Each variant runs in its own process so the
+peak RSS figures do not mix.
+
+    python -m benchmarks.bench_flatten --records 50000
+'''
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import time
+
+import pandas as pd
+
+from benchmarks import payloads
+
+
+def load(endpoint: str, n: int) -> list:
+    # Runder via json for å få samme objekter som fra en ekte respons
+    if endpoint == 'enheter':
+        return json.loads(json.dumps([payloads.enhet(i) for i in range(n)]))
+    if endpoint == 'regnskap':
+        return json.loads(json.dumps([payloads.regnskap(i)[0] for i in range(n)]))
+    return json.loads(json.dumps([payloads.roller(i) for i in range(n)]))
+
+
+def per_record(endpoint: str, items: list) -> pd.DataFrame:
+    frames = []
+    for i, item in enumerate(items):
+        if endpoint == 'roller':
+            df = pd.DataFrame()
+            for group in item['rollegrupper']:
+                df1 = pd.json_normalize(group['roller'])
+                df1['organisasjonsnummer'] = payloads.org_nr(i)
+                df = pd.concat([df, df1], ignore_index=True)
+            frames.append(df)
+        else:
+            frames.append(pd.json_normalize(item))
+    df = pd.concat(frames, ignore_index=True)
+    df.columns = [col.replace('.', '_') for col in df.columns]
+    return df
+
+
+def batched(endpoint: str, items: list) -> pd.DataFrame:
+    if endpoint == 'roller':
+        items = [{**role, 'organisasjonsnummer': payloads.org_nr(i)}
+                 for i, item in enumerate(items) for group in item['rollegrupper'] for role in group['roller']]
+    return pd.json_normalize(items, sep='_')
+
+
+def run(mode: str, endpoint: str, n: int):
+    items = load(endpoint, n)
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.process_time()
+    df = per_record(endpoint, items) if mode == 'per_record' else batched(endpoint, items)
+    cpu = time.process_time() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(json.dumps({'cpu': cpu, 'peak_mb': peak / 1024, 'delta_mb': (peak - baseline) / 1024, 'shape': df.shape}))
+
+
+def main(n: int):
+    for endpoint in ['enheter', 'regnskap', 'roller']:
+        results = {}
+        for mode in ['per_record', 'batched']:
+            out = subprocess.run([sys.executable, '-m', 'benchmarks.bench_flatten', '--records', str(n),
+                                  '--run', mode, '--endpoint', endpoint],
+                                 capture_output=True, text=True, check=True).stdout
+            results[mode] = json.loads(out.strip().splitlines()[-1])
+        old, new = results['per_record'], results['batched']
+        assert old['shape'] == new['shape'], (old['shape'], new['shape'])
+        print(f"{endpoint:<9} per record: {old['cpu']:6.2f}s cpu, peak {old['peak_mb']:7.1f} MB (+{old['delta_mb']:.1f}) | "
+              f"batched: {new['cpu']:6.2f}s cpu, peak {new['peak_mb']:7.1f} MB (+{new['delta_mb']:.1f}) | "
+              f"{old['cpu'] / max(new['cpu'], 1e-9):.1f}x faster")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--records', type=int, default=50000)
+    parser.add_argument('--run', choices=['per_record', 'batched'])
+    parser.add_argument('--endpoint', choices=['enheter', 'regnskap', 'roller'], default='enheter')
+    args = parser.parse_args()
+    if args.run:
+        run(args.run, args.endpoint, args.records)
+    else:
+        main(args.records)
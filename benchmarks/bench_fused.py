@@ -0,0 +1,52 @@
+'''
+fill_companies with the fused single pass (get_all) against the three passes one after the other, both saving to a
+LocalSink. Slow responses (`--slow-ratio`) give each pass a tail, which the sequential run pays three times.
+
+    python -m benchmarks.bench_fused --companies 20000 --latency 0.05 --slow-ratio 0.01
+'''
+import argparse
+import asyncio
+import shutil
+import tempfile
+import time
+
+from benchmarks import payloads, stub_server
+from benchmarks.common import point_brreg_at
+
+
+async def main(companies: int, latency: float, slow_ratio: float, concurrency: int):
+    from src.modules import BRREGapi
+    from src.ratelimit import AdaptiveRateLimiter
+    from src.sinks import LocalSink
+
+    # Stubben i egen prosess, så den ikke konkurrerer med klienten om event-loopen
+    servers, base_url = stub_server.start_processes(n_companies=companies, latency=latency, slow_ratio=slow_ratio)
+    org_nums = [payloads.org_nr(i) for i in range(companies)]
+    try:
+        for fused in [False, True]:
+            root = tempfile.mkdtemp(prefix='fused_')
+            limiter = AdaptiveRateLimiter(rate=1e6, max_rate=1e6, concurrency=concurrency, max_concurrency=concurrency)
+            api = point_brreg_at(BRREGapi(limiter=limiter, sink=LocalSink(root)), base_url)
+            api.logger.set_level('WARNING')
+            start = time.perf_counter()
+            await api.fill_companies(org_nums, fused=fused)
+            await api.close()
+            elapsed = time.perf_counter() - start
+            sink = LocalSink(root)
+            rows = {table: len(sink.read(table, 'brreg')) for table in ('company_data', 'financial', 'roles')}
+            print(f"{'fused' if fused else 'sequential':<11} {elapsed:7.2f}s  {companies / elapsed:8.0f} companies/s  "
+                  f"{sum(r['requests'] for r in api.metrics.summary()['requests'].values()):7d} requests | rows {rows}")
+            shutil.rmtree(root)
+    finally:
+        for server in servers:
+            server.terminate()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--companies', type=int, default=20000)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--slow-ratio', type=float, default=0.01)
+    parser.add_argument('--concurrency', type=int, default=200)
+    args = parser.parse_args()
+    asyncio.run(main(args.companies, args.latency, args.slow_ratio, args.concurrency))
@@ -0,0 +1,61 @@
+'''
+Start-up cost of the CLI and the package: each snippet runs in a fresh interpreter `--repeat` times and the median
+wall time is reported, followed by the slowest imports of `src.modules` from `python -X importtime`.
+
+    python -m benchmarks.bench_import --repeat 5
+'''
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+SNIPPETS = [
+    ('interpreter', ['-c', 'pass']),
+    ('main.py --help', ['main.py', '--help']),
+    ('import src.orgnr', ['-c', 'import src.orgnr']),
+    ('import src.sinks', ['-c', 'import src.sinks']),
+    ('import src.modules', ['-c', 'import src.modules']),
+    ('BRREGapi() + EninApi()', ['-c', 'from src.modules import BRREGapi, EninApi; BRREGapi(); EninApi()']),
+]
+
+
+def wall_ms(args: list, repeat: int, env: dict) -> float:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, *args], capture_output=True, check=True, cwd=os.getcwd(), env=env)
+        times.append((time.perf_counter() - start) * 1000)
+    return statistics.median(times)
+
+
+def slowest_imports(module: str, n: int) -> list[tuple[int, str]]:
+    out = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                         capture_output=True, text=True, cwd=os.getcwd())
+    rows = []
+    for line in out.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line.split('|')
+        # Bare de øverste nivåene, så summene ikke telles flere ganger
+        if len(name) - len(name.lstrip()) <= 3:
+            rows.append((int(cumulative), name.strip()))
+    return sorted(rows, reverse=True)[:n]
+
+
+def main(repeat: int):
+    # Uten Enin-nøkler: konstruksjonen skal ikke lese dem
+    env = {k: v for k, v in os.environ.items() if k != 'ENIN_CREDENTIALS_PATH'}
+    for name, args in SNIPPETS:
+        print(f"{name:<24} {wall_ms(args, repeat, env):8.1f} ms")
+    print("\nslowest imports of src.modules (cumulative):")
+    for us, name in slowest_imports('src.modules', 10):
+        print(f"  {us / 1000:8.1f} ms  {name}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    main(args.repeat)
@@ -0,0 +1,70 @@
+'''
+Crash and resume of a queued fill_companies run against the stub server. The first run is cancelled part way
+(like a crash), and the second run continues from the queue. Reports how many requests the resume repeats compared
+with starting over, and what ended up in the LocalSink.
+
+    python -m benchmarks.bench_jobqueue --companies 20000 --crash-after 8
+'''
+import argparse
+import asyncio
+import os
+import shutil
+import tempfile
+import time
+
+from benchmarks import payloads, stub_server
+from benchmarks.common import point_brreg_at
+
+
+async def main(companies: int, crash_after: float, chunk_size: int):
+    from src.jobqueue import JobQueue
+    from src.modules import BRREGapi
+    from src.ratelimit import AdaptiveRateLimiter
+    from src.sinks import LocalSink
+
+    app = stub_server.make_app(companies, latency=0.01)
+    runner, base_url = await stub_server.start(app)
+    root = tempfile.mkdtemp(prefix='jobqueue_')
+    org_nums = [payloads.org_nr(i) for i in range(companies)]
+    try:
+        sink = LocalSink(os.path.join(root, 'data'))
+
+        def new_api():
+            limiter = AdaptiveRateLimiter(rate=1e6, max_rate=1e6, concurrency=200, max_concurrency=200)
+            api = point_brreg_at(BRREGapi(limiter=limiter, sink=sink), base_url)
+            api.logger.set_level('WARNING')
+            return api
+
+        queue = JobQueue(os.path.join(root, 'jobs.sqlite'), 'fill_companies')
+        api = new_api()
+        start = time.perf_counter()
+        task = asyncio.create_task(api.fill_companies(org_nums, queue=queue, chunk_size=chunk_size))
+        await asyncio.sleep(crash_after)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        await api.close()
+        first = app['requests']
+        print(f"crashed after {time.perf_counter() - start:5.2f}s  {first:6d} requests | {queue}")
+
+        api = new_api()
+        start = time.perf_counter()
+        counts = await api.fill_companies(org_nums, queue=queue, chunk_size=chunk_size)
+        await api.close()
+        resumed = app['requests'] - first
+        print(f"resumed in    {time.perf_counter() - start:5.2f}s  {resumed:6d} requests | {counts}")
+        print(f"repeated requests: {first + resumed - 3 * companies} (a restart from scratch repeats {first})")
+        print(f"company_data {len(sink.read('company_data', 'brreg'))} rows | "
+              f"financial {len(sink.read('financial', 'brreg'))} rows")
+        queue.close()
+    finally:
+        await runner.cleanup()
+        shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--companies', type=int, default=20000)
+    parser.add_argument('--crash-after', type=float, default=8.0)
+    parser.add_argument('--chunk-size', type=int, default=1000)
+    args = parser.parse_args()
+    asyncio.run(main(args.companies, args.crash_after, args.chunk_size))
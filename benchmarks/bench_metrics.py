@@ -0,0 +1,60 @@
+'''
+Runs fill_companies against the stub server with the metrics on, and prints the run summary and part of the
+Prometheus export. Also measures what recording one request costs.
+
+    python -m benchmarks.bench_metrics --companies 10000 --latency 0.02
+'''
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import tempfile
+import time
+
+from benchmarks import stub_server
+from benchmarks.common import point_brreg_at
+from benchmarks import payloads
+
+
+async def main(companies: int, latency: float):
+    from src.metrics import Metrics
+    from src.modules import BRREGapi
+    from src.ratelimit import AdaptiveRateLimiter
+    from src.sinks import LocalSink
+
+    metrics = Metrics()
+    n = 100000
+    urls = [f'http://x/enhetsregisteret/api/enheter/{payloads.org_nr(i)}' for i in range(n)]
+    start = time.perf_counter()
+    for url in urls:
+        metrics.request(url, 200, 0.05, 1500)
+    print(f"Metrics.request: {(time.perf_counter() - start) / n * 1e6:.1f} µs per call")
+
+    runner, base_url = await stub_server.start(stub_server.make_app(companies, latency))
+    root = tempfile.mkdtemp(prefix='metrics_')
+    try:
+        limiter = AdaptiveRateLimiter(rate=1e6, max_rate=1e6, concurrency=200, max_concurrency=200)
+        api = point_brreg_at(BRREGapi(limiter=limiter, sink=LocalSink(root)), base_url)
+        api.logger.set_level('WARNING')
+        await api.fill_companies([payloads.org_nr(i) for i in range(companies)])
+        await api.close()
+
+        print(json.dumps(api.metrics.summary(), indent=2))
+        path = os.path.join(root, 'crawler.prom')
+        api.metrics.write_prometheus(path)
+        with open(path) as f:
+            lines = f.read().splitlines()
+        print(f"{path}: {len(lines)} lines")
+        print('\n'.join(line for line in lines if 'http_request_seconds' in line and 'roller' in line)[:2000])
+    finally:
+        await runner.cleanup()
+        shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--companies', type=int, default=10000)
+    parser.add_argument('--latency', type=float, default=0.02)
+    args = parser.parse_args()
+    asyncio.run(main(args.companies, args.latency))
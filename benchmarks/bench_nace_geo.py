@@ -0,0 +1,76 @@
+'''
+Wall time and completeness of get_by_nace_geo against the stub search, compared with paging every combination
+serially until an empty page (the old approach). Half of the fake companies are in Oslo (0301), far over the
+search paging cap, so the serial crawl stops at the cap while the planner splits the slice by registration date.
+
+    python -m benchmarks.bench_nace_geo --companies 60000 --latency 0.2
+'''
+import argparse
+import asyncio
+import time
+
+from benchmarks import payloads, stub_server
+from benchmarks.common import point_brreg_at
+
+
+async def main(companies: int, latency: float, concurrency: int):
+    from src.modules import BRREGapi
+    from src.pool import imap_bounded
+    from src.ratelimit import AdaptiveRateLimiter
+
+    app = stub_server.make_app(companies, latency)
+    runner, base_url = await stub_server.start(app)
+    kommuner = [nr for nr, _ in payloads.KOMMUNER]
+
+    def new_api():
+        limiter = AdaptiveRateLimiter(rate=1e6, max_rate=1e6, concurrency=concurrency, max_concurrency=concurrency)
+        api = point_brreg_at(BRREGapi(limiter=limiter), base_url)
+        api.logger.set_level('WARNING')
+        return api
+
+    async def serial(api, geo):
+        companies, side = [], 0
+        while True:
+            response = await api._request(api._base_url, {'page': side, 'size': 100, 'forretningsadresse.kommunenummer': geo})
+            if response is None or response.status != 200:
+                break
+            selskaper = (await response.json()).get('_embedded', {}).get('enheter', [])
+            if not selskaper:
+                break
+            companies.extend(selskaper)
+            side += 1
+        return companies
+
+    try:
+        api = new_api()
+        await api.get_by_nace_geo(geo_value=kommuner, batch_size=concurrency)  # varmer opp stubben
+        await api.close()
+
+        api = new_api()
+        before = app['requests']
+        start = time.perf_counter()
+        found = 0
+        async for _, res in imap_bounded(lambda geo: serial(api, geo), kommuner, concurrency):
+            found += len(res)
+        print(f"serial pages  {time.perf_counter() - start:6.2f}s  {app['requests'] - before:6d} requests  "
+              f"{found:7d} of {companies} companies")
+        await api.close()
+
+        api = new_api()
+        before = app['requests']
+        start = time.perf_counter()
+        df = await api.get_by_nace_geo(geo_value=kommuner, batch_size=concurrency)
+        print(f"planner       {time.perf_counter() - start:6.2f}s  {app['requests'] - before:6d} requests  "
+              f"{len(df):7d} of {companies} companies")
+        await api.close()
+    finally:
+        await runner.cleanup()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--companies', type=int, default=60000)
+    parser.add_argument('--latency', type=float, default=0.2)
+    parser.add_argument('--concurrency', type=int, default=100)
+    args = parser.parse_args()
+    asyncio.run(main(args.companies, args.latency, args.concurrency))
@@ -0,0 +1,92 @@
+'''
+OrgNumbers against a plain list of org number strings: memory and parse time of a large to-do list, and the
+requests saved by dropping duplicates and numbers with a wrong check digit before get_companies runs against the
+stub server.
+
+    python -m benchmarks.bench_orgnr --size 3000000 --companies 10000 --duplicates 0.1 --invalid 0.05
+'''
+import argparse
+import asyncio
+import random
+import shutil
+import tempfile
+import time
+import tracemalloc
+
+from benchmarks import payloads, stub_server
+from benchmarks.common import point_brreg_at
+
+
+def todo_list(n: int, duplicates: float, invalid: float, seed: int = 0) -> list[str]:
+    # Som en arbeidsliste fra BigQuery: noen nummer flere ganger, og noen med feil kontrollsiffer
+    rnd = random.Random(seed)
+    out = []
+    for i in range(n):
+        if out and rnd.random() < duplicates:
+            out.append(out[rnd.randrange(len(out))])
+        elif rnd.random() < invalid:
+            nr = payloads.org_nr(i % 10 ** 6)
+            out.append(nr[:-1] + str((int(nr[-1]) + 1) % 10))
+        else:
+            out.append(payloads.org_nr(i % 10 ** 6))
+    return out
+
+
+def measure(make):
+    # Tiden uten tracemalloc (som gjør pandas-strengoperasjoner mange ganger tregere), så minnet til resultatet
+    start = time.perf_counter()
+    make()
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    value = make()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return value, elapsed, size
+
+
+async def main(size: int, companies: int, duplicates: float, invalid: float, concurrency: int):
+    from src.modules import BRREGapi
+    from src.orgnr import OrgNumbers
+    from src.ratelimit import AdaptiveRateLimiter
+    from src.sinks import LocalSink
+
+    raw = todo_list(size, duplicates, invalid)
+    as_list, list_s, list_bytes = measure(lambda: [str(int(v)) for v in raw])
+    as_array, array_s, array_bytes = measure(lambda: OrgNumbers(raw))
+    with_prefix = [f'NO{v}' for v in raw[:size // 10]]
+    _, prefix_s, _ = measure(lambda: OrgNumbers(with_prefix))
+    print(f"{size} org numbers")
+    print(f"list[str]   {list_s:6.2f}s  {list_bytes / 1e6:8.1f} MB  {len(as_list)} items")
+    print(f"OrgNumbers  {array_s:6.2f}s  {array_bytes / 1e6:8.1f} MB  {as_array}")
+    print(f"OrgNumbers from {len(with_prefix)} NO-prefixed strings {prefix_s:6.2f}s")
+    del as_list, as_array
+
+    app = stub_server.make_app(companies)
+    runner, base_url = await stub_server.start(app)
+    root = tempfile.mkdtemp(prefix='orgnr_')
+    try:
+        raw = todo_list(companies, duplicates, invalid, seed=1)
+        for name, org_nums in [('list', raw), ('OrgNumbers', OrgNumbers(raw))]:
+            limiter = AdaptiveRateLimiter(rate=1e6, max_rate=1e6, concurrency=concurrency, max_concurrency=concurrency)
+            api = point_brreg_at(BRREGapi(limiter=limiter, sink=LocalSink(root)), base_url)
+            api.logger.set_level('CRITICAL')  # de ugyldige gir 404 som logges som feil
+            before = app['requests']
+            start = time.perf_counter()
+            await api.get_companies(org_nums, concurrency=concurrency)
+            await api.close()
+            print(f"get_companies from {name:<10} {time.perf_counter() - start:6.2f}s  "
+                  f"{app['requests'] - before:6d} requests for {len(raw)} input numbers")
+    finally:
+        await runner.cleanup()
+        shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size', type=int, default=3000000)
+    parser.add_argument('--companies', type=int, default=10000)
+    parser.add_argument('--duplicates', type=float, default=0.1)
+    parser.add_argument('--invalid', type=float, default=0.05)
+    parser.add_argument('--concurrency', type=int, default=200)
+    args = parser.parse_args()
+    asyncio.run(main(args.size, args.companies, args.duplicates, args.invalid, args.concurrency))
@@ -0,0 +1,67 @@
+'''
+Requests/second for the old batch-and-gather loop against the sliding-window pool, with a latency-injecting stub.
+A share of slow responses shows the tail each gathered block used to wait for.
+
+    python -m benchmarks.bench_pool --requests 4000 --latency 0.02 --slow-ratio 0.02
+'''
+import argparse
+import asyncio
+import time
+
+from benchmarks import payloads, stub_server
+from benchmarks.common import offline, point_brreg_at
+
+
+async def main(n: int, latency: float, slow_ratio: float, concurrency: int):
+    offline()
+    from src.modules import BRREGapi
+    from src.pool import imap_bounded
+    from src.ratelimit import AdaptiveRateLimiter
+
+    runner, base_url = await stub_server.start(stub_server.make_app(n, latency, slow_ratio))
+    org_nums = [payloads.org_nr(i) for i in range(n)]
+
+    def new_api():
+        limiter = AdaptiveRateLimiter(rate=1e6, max_rate=1e6, concurrency=concurrency, max_concurrency=concurrency)
+        return point_brreg_at(BRREGapi(limiter=limiter), base_url)
+
+    async def fetch(api, orgnr):
+        response = await api._request(f'{api._base_url}/{orgnr}')
+        return await response.json()
+
+    try:
+        api = new_api()
+        start = time.perf_counter()
+        for i in range(0, n, concurrency):
+            await asyncio.gather(*[fetch(api, orgnr) for orgnr in org_nums[i:i + concurrency]], return_exceptions=True)
+        before = n / (time.perf_counter() - start)
+        await api.close()
+
+        api = new_api()
+        start = time.perf_counter()
+        async for _ in imap_bounded(lambda orgnr: fetch(api, orgnr), org_nums, concurrency):
+            pass
+        after = n / (time.perf_counter() - start)
+        await api.close()
+
+        api = new_api()
+        start = time.perf_counter()
+        await api.get_companies(org_nums, concurrency=concurrency)
+        end_to_end = n / (time.perf_counter() - start)
+        await api.close()
+
+        print(f'batch-and-gather     {before:8.1f} req/s')
+        print(f'sliding window       {after:8.1f} req/s ({after / before:.2f}x)')
+        print(f'get_companies        {end_to_end:8.1f} req/s (incl. json_normalize)')
+    finally:
+        await runner.cleanup()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=4000)
+    parser.add_argument('--latency', type=float, default=0.02)
+    parser.add_argument('--slow-ratio', type=float, default=0.02)
+    parser.add_argument('--concurrency', type=int, default=200)
+    args = parser.parse_args()
+    asyncio.run(main(args.requests, args.latency, args.slow_ratio, args.concurrency))
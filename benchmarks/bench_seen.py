@@ -0,0 +1,78 @@
+'''
+Requests saved by coalescing identical in-flight requests and by a SeenSet, against the stub server.
+
+1. get_roles on a list where every org number appears `--repeats` times in a row: the repeats share one request.
+2. get_by_nace_geo with overlapping NACE prefixes: companies found twice are dropped before flattening.
+3. get_all twice with a SeenSet: the second run fetches nothing it saved in the first.
+
+    python -m benchmarks.bench_seen --companies 10000 --latency 0.02
+'''
+import argparse
+import asyncio
+import os
+import shutil
+import tempfile
+import time
+
+from benchmarks import payloads, stub_server
+from benchmarks.common import point_brreg_at
+
+
+async def main(companies: int, latency: float, repeats: int, concurrency: int):
+    from src.modules import BRREGapi
+    from src.ratelimit import AdaptiveRateLimiter
+    from src.seen import SeenSet
+    from src.sinks import LocalSink
+
+    app = stub_server.make_app(companies, latency)
+    runner, base_url = await stub_server.start(app)
+    root = tempfile.mkdtemp(prefix='seen_')
+    org_nums = [payloads.org_nr(i) for i in range(companies)]
+
+    def new_api(**kwargs):
+        limiter = AdaptiveRateLimiter(rate=1e6, max_rate=1e6, concurrency=concurrency, max_concurrency=concurrency)
+        api = point_brreg_at(BRREGapi(limiter=limiter, sink=LocalSink(root), **kwargs), base_url)
+        api.logger.set_level('WARNING')
+        return api
+
+    async def timed(name, run):
+        before = app['requests']
+        start = time.perf_counter()
+        result = await run()
+        print(f"{name:<34} {time.perf_counter() - start:6.2f}s  {app['requests'] - before:7d} requests")
+        return result
+
+    try:
+        api = new_api()
+        repeated = [nr for nr in org_nums for _ in range(repeats)]
+        await timed(f'get_roles, {len(repeated)} numbers', lambda: api.get_roles(repeated, concurrency=concurrency))
+        print(f"{'':<34} coalesced {sum(v for (n, _), v in api.metrics._counters.items() if n == 'http_coalesced_total'):.0f}")
+        await api.close()
+
+        api = new_api()
+        df = await timed("get_by_nace_geo, overlapping codes",
+                         lambda: api.get_by_nace_geo(nace_codes=['1', '10', '11', '2', '20'], batch_size=concurrency))
+        print(f"{'':<34} {len(df)} companies")
+        await api.close()
+
+        seen = SeenSet(os.path.join(root, 'seen.sqlite'))
+        for run in (1, 2):
+            api = new_api(seen=seen)
+            summary = await timed(f'get_all with SeenSet, run {run}', lambda: api.get_all(org_nums, concurrency=concurrency))
+            print(f"{'':<34} " + ' | '.join(f"{t} ok {summary[t]['ok']} skipped {summary[t]['skipped']}"
+                                              for t in ('company_data', 'financial', 'roles')))
+            await api.close()
+        seen.close()
+    finally:
+        await runner.cleanup()
+        shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--companies', type=int, default=10000)
+    parser.add_argument('--latency', type=float, default=0.02)
+    parser.add_argument('--repeats', type=int, default=2)
+    parser.add_argument('--concurrency', type=int, default=200)
+    args = parser.parse_args()
+    asyncio.run(main(args.companies, args.latency, args.repeats, args.concurrency))
@@ -0,0 +1,57 @@
+'''
+Scaling of crawl_sharded with 1, 2, 4 and 8 worker processes against the stub server, which runs in its own
+processes. Every run fetches the same org numbers with the same global request budget and saves to a LocalSink.
+Speedup is bounded by the number of cores: with fewer cores than workers the extra processes only add overhead.
+
+    python -m benchmarks.bench_sharded --companies 20000 --job fill_companies
+'''
+import argparse
+import os
+import shutil
+import tempfile
+import time
+from functools import partial
+
+from benchmarks import payloads, stub_server
+from benchmarks.common import brreg_at
+
+
+def main(companies: int, job: str, workers: list[int], latency: float, server_processes: int, rate: float):
+    from src.ratelimit import SharedRateLimiter
+    from src.sharding import crawl_sharded
+    from src.sinks import LocalSink
+
+    servers, base_url = stub_server.start_processes(server_processes, n_companies=companies, latency=latency)
+    org_nums = [payloads.org_nr(i) for i in range(companies)]
+    print(f"{os.cpu_count()} cores | {companies} companies | job {job} | latency {latency}s | rate {rate}/s")
+    baseline = None
+    try:
+        for n in workers:
+            root = tempfile.mkdtemp(prefix='sharded_')
+            try:
+                limiter = SharedRateLimiter(rate=rate, max_rate=rate, concurrency=200, max_concurrency=200)
+                start = time.perf_counter()
+                summary = crawl_sharded(job, org_nums, workers=n, sink=LocalSink(root), limiter=limiter,
+                                        api_factory=partial(brreg_at, base_url))
+                elapsed = time.perf_counter() - start
+                baseline = baseline or elapsed
+                print(f"{n} workers: {elapsed:6.2f}s  {summary['requests'] / elapsed:7.0f} req/s  "
+                      f"speedup {baseline / elapsed:4.2f}x | {summary['rows']} rows in {summary['writes']} writes "
+                      f"({summary['write_s']}s writing) | throttled {summary['throttled']}")
+            finally:
+                shutil.rmtree(root)
+    finally:
+        for server in servers:
+            server.terminate()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--companies', type=int, default=20000)
+    parser.add_argument('--job', default='fill_companies')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--latency', type=float, default=0.01)
+    parser.add_argument('--server-processes', type=int, default=4)
+    parser.add_argument('--rate', type=float, default=1e6, help='Global requests per second for all workers')
+    args = parser.parse_args()
+    main(args.companies, args.job, args.workers, args.latency, args.server_processes, args.rate)
@@ -0,0 +1,54 @@
+'''
+Write throughput of LocalSink: rows/s for schema cast plus Parquet write of company_data batches, and the time it
+takes DuckDB to read back the latest version of every key after several overlapping merge batches.
+
+    python -m benchmarks.bench_sink --records 50000 --batch 5000
+'''
+import argparse
+import asyncio
+import shutil
+import tempfile
+import time
+
+from benchmarks import payloads
+
+
+async def main(n: int, batch: int, rounds: int):
+    from src.modules import BRREGapi
+    from src.sinks import LocalSink
+
+    root = tempfile.mkdtemp(prefix='sink_')
+    try:
+        sink = LocalSink(root)
+        api = BRREGapi(sink=sink)
+        api.logger.set_level('WARNING')
+        records = [payloads.enhet(i) for i in range(n)]
+
+        start = time.perf_counter()
+        written = 0
+        for _ in range(rounds):
+            for i in range(0, n, batch):
+                df = api._prep_company_data(api._flatten(records[i:i + batch]))
+                await api.save_bq(df, 'organisasjonsnummer', table='company_data', dataset='brreg', if_exists='merge')
+                written += len(df)
+        await api.writer.wait()
+        write_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        df = sink.read('company_data', 'brreg')
+        read_time = time.perf_counter() - start
+        assert len(df) == n and df['organisasjonsnummer'].is_unique
+
+        print(f'write   {written:8d} rows in {write_time:6.2f}s  {written / write_time:10.0f} rows/s')
+        print(f'read    {len(df):8d} rows in {read_time:6.2f}s  (latest of {rounds} versions per key)')
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--records', type=int, default=50000)
+    parser.add_argument('--batch', type=int, default=5000)
+    parser.add_argument('--rounds', type=int, default=3)
+    args = parser.parse_args()
+    asyncio.run(main(args.records, args.batch, args.rounds))
@@ -0,0 +1,95 @@
+'''
+Peak memory of a run that returns its result instead of saving it, against the stub server:
+
+memory  the result gathered in RAM and returned as one DataFrame (the old behaviour, a SpillFrame with no limit)
+spill   the result returned as a SpillFrame with `--limit` MB in memory, read back one batch at a time
+iter    the batches of `iter_financial_data`/`iter_accounts` consumed as they come
+
+Each run is made in its own process, with the stub server in another, so the max RSS of the modes can be compared.
+
+    python -m benchmarks.bench_spill --job financials --companies 100000 --limit 32
+'''
+import argparse
+import asyncio
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+from benchmarks import payloads, stub_server
+from benchmarks.common import offline, point_brreg_at
+
+MODES = ['memory', 'spill', 'iter']
+
+
+async def run(job: str, mode: str, base_url: str, companies: int, limit_mb: int, concurrency: int):
+    offline()
+    from src.modules import BRREGapi, EninApi
+    from src.ratelimit import AdaptiveRateLimiter
+
+    memory_limit = 2 ** 62 if mode == 'memory' else limit_mb * 2 ** 20
+    org_nums = [payloads.org_nr(i) for i in range(companies)]
+    rows = 0
+    start = time.perf_counter()
+    if job == 'financials':
+        limiter = AdaptiveRateLimiter(rate=1e6, max_rate=1e6, concurrency=concurrency, max_concurrency=concurrency)
+        api = point_brreg_at(BRREGapi(limiter=limiter, memory_limit=memory_limit), base_url)
+        api.logger.set_level('WARNING')
+        if mode == 'iter':
+            async for df in api.iter_financial_data(org_nums, concurrency=concurrency):
+                rows += len(df)
+        else:
+            result = await api.get_financial_data(org_nums, concurrency=concurrency, as_frame=mode == 'memory')
+            rows = len(result) if mode == 'memory' else sum(len(df) for df in result)
+    else:
+        api = EninApi(memory_limit=memory_limit)
+        api.logger.set_level('WARNING')
+        api.analysis_url = f'{base_url}/analysis/v1'
+        if mode == 'iter':
+            async for chunk in api.iter_accounts(org_nums, concurrency=concurrency):
+                rows += len(chunk['accounts'])
+        else:
+            summary = await api.fetch_accounts(org_nums, save=False, concurrency=concurrency,
+                                               as_frame=mode == 'memory')
+            accounts = summary['data']['accounts']
+            rows = len(accounts) if mode == 'memory' else sum(len(df) for df in accounts)
+    elapsed = time.perf_counter() - start
+    await api.close()
+    print(json.dumps({'seconds': round(elapsed, 2), 'rows': rows,
+                      'max_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024)}))
+
+
+def main(job: str, companies: int, limit_mb: int, concurrency: int):
+    print(f"{job}: {companies} companies, {limit_mb} MB in memory before spilling")
+    servers, base_url = stub_server.start_processes(1, n_companies=companies)
+    try:
+        for mode in MODES:
+            out = subprocess.run([sys.executable, '-m', 'benchmarks.bench_spill', '--job', job, '--mode', mode,
+                                  '--base-url', base_url, '--companies', str(companies), '--limit', str(limit_mb),
+                                  '--concurrency', str(concurrency)],
+                                 capture_output=True, text=True, cwd=os.getcwd())
+            if out.returncode:
+                print(out.stderr[-2000:])
+                continue
+            result = json.loads(out.stdout.strip().splitlines()[-1])
+            print(f"{mode:<7} {result['seconds']:7.2f}s  max RSS {result['max_rss_mb']:5d} MB | {result['rows']} rows")
+    finally:
+        for server in servers:
+            server.terminate()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--job', choices=['financials', 'accounts'], default='financials')
+    parser.add_argument('--companies', type=int, default=100000)
+    parser.add_argument('--limit', type=int, default=32, help='MB kept in memory before spilling')
+    parser.add_argument('--concurrency', type=int, default=200)
+    parser.add_argument('--mode', choices=MODES)
+    parser.add_argument('--base-url')
+    args = parser.parse_args()
+    if args.mode:
+        asyncio.run(run(args.job, args.mode, args.base_url, args.companies, args.limit, args.concurrency))
+    else:
+        main(args.job, args.companies, args.limit, args.concurrency)
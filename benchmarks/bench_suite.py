@@ -0,0 +1,151 @@
+'''
+Throughput, request latency and peak memory of every public entry point, offline against the stub server.
+Each entry point runs in its own process (so max RSS is its own) and saves to a LocalSink. The stub can add
+latency, 503s and 429s with Retry-After, and replay responses recorded with `benchmarks.record`.
+
+    python -m benchmarks.bench_suite --companies 20000 --latency 0.02
+    python -m benchmarks.bench_suite --throttle-rate 0.02 --error-rate 0.01 --entry brreg.roles enin.accounts
+    python -m benchmarks.bench_suite --recorded recorded.jsonl
+
+Enin stops a crawl at the first 429 (RateLimitError), so with --throttle-rate the Enin rows show how far it got.
+'''
+import argparse
+import asyncio
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks import payloads, stub_server
+from benchmarks.common import offline, point_brreg_at
+
+ENTRIES = ('brreg.companies', 'brreg.financials', 'brreg.roles', 'brreg.nace_geo', 'enin.companies', 'enin.accounts')
+
+
+def recorded_org_nums(path: str) -> list[str]:
+    '''
+    Organisation numbers with a recorded enhet, so the per-organisation entry points hit the replayed responses.
+    '''
+    org_nums = []
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                parts = json.loads(line)['path'].split('/')
+                if parts[-2] == 'enheter' and parts[-1].isdigit():
+                    org_nums.append(parts[-1])
+    return list(dict.fromkeys(org_nums))
+
+
+async def run(entry: str, base_url: str, companies: int, concurrency: int, recorded: str = None):
+    offline()
+    from src.modules import BRREGapi, EninApi
+    from src.ratelimit import AdaptiveRateLimiter
+    from src.sinks import LocalSink
+
+    org_nums = [payloads.org_nr(i) for i in range(companies)]
+    if recorded:
+        org_nums = (recorded_org_nums(recorded) + org_nums)[:companies]
+    root = tempfile.mkdtemp(prefix='suite_')
+    extra = {}
+    try:
+        start = time.perf_counter()
+        if entry.startswith('brreg.'):
+            limiter = AdaptiveRateLimiter(rate=1e6, max_rate=1e6, concurrency=concurrency, max_concurrency=concurrency)
+            api = point_brreg_at(BRREGapi(limiter=limiter, sink=LocalSink(root)), base_url)
+            api.logger.set_level('WARNING')
+            if entry == 'brreg.companies':
+                await api.get_companies(org_nums, save_bq=True, concurrency=concurrency)
+            elif entry == 'brreg.financials':
+                await api.get_financial_data(org_nums, save_bq=True, concurrency=concurrency)
+            elif entry == 'brreg.roles':
+                await api.get_roles(org_nums, save_bq=True, concurrency=concurrency)
+            else:
+                await api.get_by_nace_geo(geo_value=[nr for nr, _ in payloads.KOMMUNER], batch_size=concurrency,
+                                          save_bq=True)
+            extra['give_ups'] = api.limiter.counters['give_ups']
+        else:
+            api = EninApi(sink=LocalSink(root))
+            api.logger.set_level('ERROR')
+            api.base_url = base_url
+            api.analysis_url = f'{base_url}/analysis/v1'
+            if entry == 'enin.companies':
+                await api.get_companies(n=companies, save=True, concurrency=concurrency)
+            else:
+                summary = await api.fetch_accounts(org_nums, concurrency=concurrency)
+                extra['rate_limited'] = summary['rate_limited']
+        await api.close()
+        elapsed = time.perf_counter() - start
+
+        summary = api.metrics.summary()
+        latency = api.metrics.histogram('http_request_seconds')
+        statuses = {}
+        for endpoint in summary['requests'].values():
+            for status, n in endpoint['statuses'].items():
+                statuses[status] = statuses.get(status, 0) + n
+        saved = sum(summary['saved_rows'].values())
+        items = saved if entry in ('brreg.nace_geo', 'enin.companies') else len(org_nums)
+        print(json.dumps({'entry': entry,
+                          'seconds': round(elapsed, 2),
+                          'items': items,
+                          'items_per_s': round(items / elapsed, 1),
+                          'requests_per_s': round(latency.count / elapsed, 1),
+                          'p50_ms': round(latency.quantile(0.5) * 1000, 1),
+                          'p99_ms': round(latency.quantile(0.99) * 1000, 1),
+                          'retries': summary['retries'],
+                          'statuses': statuses,
+                          'saved_rows': saved,
+                          'max_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024),
+                          **extra}))
+    finally:
+        shutil.rmtree(root)
+
+
+def main(entries: list, companies: int, concurrency: int, server_processes: int, stub: dict):
+    servers, base_url = stub_server.start_processes(server_processes, n_companies=companies, **stub)
+    print(f"stub: {companies} companies | {stub}")
+    try:
+        for entry in entries:
+            cmd = [sys.executable, '-m', 'benchmarks.bench_suite', '--run', entry, '--base-url', base_url,
+                   '--companies', str(companies), '--concurrency', str(concurrency)]
+            if stub.get('recorded'):
+                cmd += ['--recorded', stub['recorded']]
+            out = subprocess.run(cmd, capture_output=True, text=True, cwd=os.getcwd())
+            if out.returncode:
+                print(f"{entry:<17} failed:\n{out.stderr[-2000:]}")
+                continue
+            r = json.loads(out.stdout.strip().splitlines()[-1])
+            flags = ' | '.join(f'{k} {r[k]}' for k in ('give_ups', 'rate_limited') if r.get(k))
+            print(f"{entry:<17} {r['seconds']:7.2f}s  {r['items_per_s']:9.1f} items/s  {r['requests_per_s']:8.1f} req/s  "
+                  f"p50 {r['p50_ms']:6.1f} ms  p99 {r['p99_ms']:7.1f} ms  retries {r['retries']:5.0f}  "
+                  f"max RSS {r['max_rss_mb']:5d} MB | {r['saved_rows']} rows | {r['statuses']}"
+                  + (f' | {flags}' if flags else ''))
+    finally:
+        for server in servers:
+            server.terminate()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--entry', nargs='*', choices=ENTRIES, default=list(ENTRIES))
+    parser.add_argument('--companies', type=int, default=10000)
+    parser.add_argument('--concurrency', type=int, default=100)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--slow-ratio', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--throttle-rate', type=float, default=0.0)
+    parser.add_argument('--retry-after', type=float, default=1.0)
+    parser.add_argument('--recorded', help='jsonl file from benchmarks.record to replay')
+    parser.add_argument('--server-processes', type=int, default=1)
+    parser.add_argument('--run', choices=ENTRIES, help=argparse.SUPPRESS)
+    parser.add_argument('--base-url', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.run:
+        asyncio.run(run(args.run, args.base_url, args.companies, args.concurrency, args.recorded))
+    else:
+        main(args.entry, args.companies, args.concurrency, args.server_processes,
+             {'latency': args.latency, 'slow_ratio': args.slow_ratio, 'error_rate': args.error_rate,
+              'throttle_rate': args.throttle_rate, 'retry_after': args.retry_after, 'recorded': args.recorded})
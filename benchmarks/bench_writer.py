@@ -0,0 +1,66 @@
+'''
+Wall time of BRREGapi.get_companies(save_bq=True) with a sink that takes `--upload` seconds per write, with the
+write done inline on the event loop (the old behaviour) against the background writer. With the writer the uploads
+overlap with fetching, so the run takes roughly max(fetch, uploads) instead of fetch + uploads.
+
+    python -m benchmarks.bench_writer --requests 20000 --upload 1.0
+'''
+import argparse
+import asyncio
+import time
+
+from benchmarks import payloads, stub_server
+from benchmarks.common import point_brreg_at
+
+
+async def main(n: int, latency: float, upload: float, concurrency: int):
+    from src.modules import BRREGapi
+    from src.ratelimit import AdaptiveRateLimiter
+    from src.sinks import Sink
+
+    class SlowSink(Sink):
+        def write(self, df, table, dataset, if_exists='append', merge_on=None, explicit_schema=None):
+            time.sleep(upload)
+
+    class InlineWriter:
+        '''Writes on the event loop, like save_bq did before the background writer.'''
+        def __init__(self, sink):
+            self.sink = sink
+
+        async def submit(self, df, *args, **kwargs):
+            self.sink.write(df, *args, **kwargs)
+
+        async def wait(self):
+            pass
+
+        def close(self):
+            pass
+
+    runner, base_url = await stub_server.start(stub_server.make_app(n, latency))
+    org_nums = [payloads.org_nr(i) for i in range(n)]
+    try:
+        for name in ['inline', 'background']:
+            limiter = AdaptiveRateLimiter(rate=1e6, max_rate=1e6, concurrency=concurrency, max_concurrency=concurrency)
+            api = point_brreg_at(BRREGapi(limiter=limiter, sink=SlowSink()), base_url)
+            api.logger.set_level('WARNING')
+            if name == 'inline':
+                api.writer = InlineWriter(api.sink)
+            start = time.perf_counter()
+            await api.get_companies(org_nums, save_bq=True, concurrency=concurrency)
+            elapsed = time.perf_counter() - start
+            print(f'{name:<11} {elapsed:6.2f}s  {n / elapsed:8.1f} companies/s')
+            if name == 'background':
+                print(f'            {api.writer}')
+            await api.close()
+    finally:
+        await runner.cleanup()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=20000)
+    parser.add_argument('--latency', type=float, default=0.02)
+    parser.add_argument('--upload', type=float, default=1.0)
+    parser.add_argument('--concurrency', type=int, default=200)
+    args = parser.parse_args()
+    asyncio.run(main(args.requests, args.latency, args.upload, args.concurrency))
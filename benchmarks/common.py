@@ -0,0 +1,38 @@
+import json
+import os
+import tempfile
+
+
+
+def offline():
+    '''
+    Lets EninApi be constructed without real Enin credentials. BigQuery is only connected to on the first save,
+    so benchmarks that do not save (or save to a LocalSink) need no warehouse.
+    '''
+    if not os.getenv('ENIN_CREDENTIALS_PATH'):
+        path = os.path.join(tempfile.mkdtemp(), 'enin.json')
+        with open(path, 'w') as f:
+            json.dump({'client_id': 'bench', 'client_secret': 'bench'}, f)
+        os.environ['ENIN_CREDENTIALS_PATH'] = path
+
+
+def point_brreg_at(api, base_url: str):
+    '''
+    Points a BRREGapi instance at the stub server.
+    '''
+    api._base_url = f'{base_url}/enhetsregisteret/api/enheter'
+    api._bulk_url = f'{base_url}/enhetsregisteret/api/enheter/lastned'
+    api._regnskap_url = f'{base_url}/regnskapsregisteret/regnskap'
+    api._updates_url = f'{base_url}/enhetsregisteret/api/oppdateringer/enheter'
+    return api
+
+
+def brreg_at(base_url: str, **kwargs):
+    '''
+    Creates a BRREGapi pointed at the stub server, logging warnings only. Top level so it can be sent to worker
+    processes with `functools.partial`.
+    '''
+    from src.modules import BRREGapi
+    api = point_brreg_at(BRREGapi(**kwargs), base_url)
+    api.logger.set_level('WARNING')
+    return api
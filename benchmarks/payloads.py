@@ -0,0 +1,239 @@
+'''
+Generators for payloads shaped like the BRREG and Enin responses, used by the stub server and the benchmarks.
+'''
+import csv
+import gzip
+import json
+import random
+from functools import lru_cache
+
+from src.orgnr import check_digit
+
+
+KOMMUNER = [('0301', 'OSLO'), ('4601', 'BERGEN'), ('5001', 'TRONDHEIM'), ('1103', 'STAVANGER'),
+            ('3201', 'BÆRUM'), ('3205', 'LILLESTRØM'), ('4204', 'KRISTIANSAND'), ('3107', 'FREDRIKSTAD')]
+
+
+def kommune(i: int) -> tuple[str, str]:
+    '''
+    Kommunenummer and name of company i. Half of the companies are in Oslo, so one kommune is far over the search cap.
+    '''
+    return KOMMUNER[0] if i % 2 == 0 else KOMMUNER[1 + i // 2 % (len(KOMMUNER) - 1)]
+
+
+@lru_cache(maxsize=None)
+def org_nr(i: int) -> str:
+    '''
+    A valid (mod-11) organisation number for company i < 1 000 000: 9, i in six digits, a digit that makes the check
+    digit possible, and the check digit.
+    '''
+    first8 = (9000000 + i) * 10
+    check = check_digit(first8)
+    if check is None:
+        first8 += 1
+        check = check_digit(first8)
+    return str(first8 * 10 + check)
+
+
+def index_of(orgnr) -> int | None:
+    '''
+    The company index of an organisation number made by `org_nr`, or None for any other number.
+    '''
+    try:
+        i = int(str(orgnr).removeprefix('NO')) // 100 - 9000000
+    except ValueError:
+        return None
+    return i if 0 <= i < 10 ** 6 and org_nr(i) == str(orgnr).removeprefix('NO') else None
+
+
+def enhet(i: int) -> dict:
+    rnd = random.Random(i)
+    nace = f'{rnd.randint(1, 99):02d}.{rnd.randint(100, 999)}'
+    return {
+        'organisasjonsnummer': org_nr(i),
+        'navn': f'SELSKAP {i} AS',
+        'organisasjonsform': {'kode': 'AS', 'beskrivelse': 'Aksjeselskap',
+                              '_links': {'self': {'href': 'https://data.brreg.no/enhetsregisteret/api/organisasjonsformer/AS'}}},
+        'hjemmeside': f'www.selskap{i}.no' if rnd.random() < 0.3 else None,
+        'postadresse': {'land': 'Norge', 'landkode': 'NO', 'postnummer': f'{rnd.randint(1, 9999):04d}',
+                        'poststed': 'OSLO', 'adresse': [f'Postboks {rnd.randint(1, 999)}'],
+                        'kommune': 'OSLO', 'kommunenummer': '0301'},
+        'registreringsdatoEnhetsregisteret': f'{rnd.randint(1995, 2024)}-{rnd.randint(1, 12):02d}-{rnd.randint(1, 28):02d}',
+        'registrertIMvaregisteret': rnd.random() < 0.6,
+        'naeringskode1': {'kode': nace, 'beskrivelse': 'Utleie av egen eller leid fast eiendom ellers'},
+        'antallAnsatte': rnd.randint(0, 500),
+        'harRegistrertAntallAnsatte': True,
+        'forretningsadresse': {'land': 'Norge', 'landkode': 'NO', 'postnummer': f'{rnd.randint(1, 9999):04d}',
+                               'poststed': 'OSLO', 'adresse': [f'Gate {rnd.randint(1, 200)}'],
+                               'kommune': kommune(i)[1], 'kommunenummer': kommune(i)[0]},
+        'stiftelsesdato': f'{rnd.randint(1990, 2024)}-01-01',
+        'institusjonellSektorkode': {'kode': '2100', 'beskrivelse': 'Private aksjeselskaper mv.'},
+        'registrertIForetaksregisteret': True,
+        'registrertIStiftelsesregisteret': False,
+        'registrertIFrivillighetsregisteret': False,
+        'sisteInnsendteAarsregnskap': str(rnd.randint(2018, 2024)),
+        'konkurs': False,
+        'underAvvikling': False,
+        'underTvangsavviklingEllerTvangsopplosning': False,
+        'maalform': 'Bokmål',
+        'vedtektsfestetFormaal': ['Drift av virksomhet', 'og alt som står i forbindelse med dette'],
+        'aktivitet': ['Eiendomsutleie'],
+        'paategninger': [{'infotype': 'FRI', 'tekst': 'Påtegning'}] if rnd.random() < 0.05 else [],
+        '_links': {'self': {'href': f'https://data.brreg.no/enhetsregisteret/api/enheter/{org_nr(i)}'}},
+    }
+
+
+def roller(i: int) -> dict:
+    rnd = random.Random(i)
+    groups = []
+    for kode, beskrivelse in [('DAGL', 'Daglig leder'), ('STYR', 'Styre'), ('REVI', 'Revisor')][:rnd.randint(1, 3)]:
+        roles = []
+        for j in range(rnd.randint(1, 4)):
+            role = {'type': {'kode': kode, 'beskrivelse': beskrivelse},
+                    'fratraadt': False,
+                    'rekkefolge': j}
+            if kode == 'REVI':
+                role['enhet'] = {'organisasjonsnummer': org_nr(rnd.randint(0, 10 ** 6 - 1)),
+                                 'organisasjonsform': {'kode': 'AS', 'beskrivelse': 'Aksjeselskap'},
+                                 'navn': ['REVISJON AS'], 'erSlettet': False}
+            else:
+                role['person'] = {'fodselsdato': f'19{rnd.randint(40, 99)}-01-01',
+                                  'navn': {'fornavn': 'Ola', 'etternavn': f'Nordmann{j}'},
+                                  'erDoed': False}
+            roles.append(role)
+        groups.append({'type': {'kode': kode, 'beskrivelse': beskrivelse}, 'sistEndret': '2024-01-01', 'roller': roles})
+    return {'rollegrupper': groups}
+
+
+def regnskap(i: int, year: int = 2024) -> list[dict]:
+    rnd = random.Random(i)
+    sum_eiendeler = rnd.randint(0, 10 ** 8)
+    return [{
+        'id': i,
+        'journalnr': f'{year}{i}',
+        'regnskapstype': 'SELSKAP',
+        'virksomhet': {'organisasjonsnummer': org_nr(i), 'organisasjonsform': 'AS', 'morselskap': False},
+        'regnskapsperiode': {'fraDato': f'{year}-01-01', 'tilDato': f'{year}-12-31'},
+        'valuta': 'NOK',
+        'avviklingsregnskap': False,
+        'oppstillingsplan': 'store',
+        'revisjon': {'ikkeRevidertAarsregnskap': False, 'fravalgRevisjon': False},
+        'regnkapsprinsipper': {'smaaForetak': True, 'regnskapsregler': 'regnskapslovenAlminneligRegler'},
+        'egenkapitalGjeld': {'sumEgenkapitalGjeld': sum_eiendeler,
+                             'egenkapital': {'sumEgenkapital': sum_eiendeler // 2,
+                                             'opptjentEgenkapital': {'sumOpptjentEgenkapital': sum_eiendeler // 4},
+                                             'innskuttEgenkapital': {'sumInnskuttEgenkaptial': sum_eiendeler // 4}},
+                             'gjeldOversikt': {'sumGjeld': sum_eiendeler // 2,
+                                               'kortsiktigGjeld': {'sumKortsiktigGjeld': sum_eiendeler // 4},
+                                               'langsiktigGjeld': {'sumLangsiktigGjeld': sum_eiendeler // 4}}},
+        'eiendeler': {'sumEiendeler': sum_eiendeler,
+                      'omloepsmidler': {'sumOmloepsmidler': sum_eiendeler // 3},
+                      'anleggsmidler': {'sumAnleggsmidler': sum_eiendeler - sum_eiendeler // 3}},
+        'resultatregnskapResultat': {'ordinaertResultatFoerSkattekostnad': rnd.randint(-10 ** 6, 10 ** 7),
+                                     'aarsresultat': rnd.randint(-10 ** 6, 10 ** 7),
+                                     'totalresultat': rnd.randint(-10 ** 6, 10 ** 7),
+                                     'finansresultat': {'nettoFinans': rnd.randint(-10 ** 5, 10 ** 5),
+                                                        'finansinntekt': {'sumFinansinntekter': rnd.randint(0, 10 ** 5)},
+                                                        'finanskostnad': {'sumFinanskostnad': rnd.randint(0, 10 ** 5)}},
+                                     'driftsresultat': {'driftsresultat': rnd.randint(-10 ** 6, 10 ** 7),
+                                                        'driftsinntekter': {'sumDriftsinntekter': rnd.randint(0, 10 ** 8)},
+                                                        'driftskostnad': {'sumDriftskostnad': rnd.randint(0, 10 ** 8)}}},
+    }]
+
+
+def enin_company(i: int) -> dict:
+    return {'company': {'uuid': f'uuid-{i}',
+                        'org_nr': org_nr(i),
+                        'org_nr_schema': 'NO',
+                        'name': f'Company {i}',
+                        'insert_timestamp': f'2020-01-01T00:00:{i % 60:02d}.{i:06d}'}}
+
+
+def enin_accounts_composite(i: int, years: int = 3) -> list[dict]:
+    '''
+    The accounts-composite document of company i: one entry per accounting year, newest first.
+    '''
+    rnd = random.Random(i)
+    company = {'uuid': f'uuid-{i}', 'name': f'Company {i}', 'org_nr_schema': 'NO'}
+    accounts_type = {'uuid': 'type-annual', 'accounts_type_identifier': 'annual_company_accounts'}
+    composite = []
+    for year in range(2023, 2023 - years, -1):
+        revenue = rnd.randint(0, 10 ** 8)
+        assets = rnd.randint(10 ** 4, 10 ** 8)
+        meta = {'accounting_year': year,
+                'accounts_uuid': f'acc-{i}-{year}',
+                'company_uuid': company['uuid'],
+                'currency_code': 'NOK'}
+        composite.append({
+            'company': dict(company),
+            'accounts_type': dict(accounts_type),
+            'accounts': {**meta, 'uuid': meta['accounts_uuid'],
+                         'accounting_from_date': f'{year}-01-01', 'accounting_to_date': f'{year}-12-31',
+                         'accounting_announcement_date': f'{year + 1}-05-31',
+                         'corporate_group_accounts_flag': False, 'estimated_accounting_period_flag': False,
+                         'accounting_schema': 'NGAAP'},
+            'accounts_highlights': {**meta, 'revenue': revenue, 'ebitda': revenue // 5, 'net_income': revenue // 10,
+                                    'equity': assets // 3, 'total_assets': assets},
+            'accounts_income_statement': {**meta, 'total_operating_income': revenue,
+                                          'total_operating_expenses': revenue - revenue // 5,
+                                          'operating_profit': revenue // 5, 'net_financial_items': -rnd.randint(0, 10 ** 5),
+                                          'profit_before_tax': revenue // 7, 'tax_expense': revenue // 30,
+                                          'annual_result': revenue // 10},
+            'accounts_balance_sheet': {**meta, 'total_assets': assets, 'fixed_assets': assets // 2,
+                                       'current_assets': assets - assets // 2, 'equity': assets // 3,
+                                       'long_term_liabilities': assets // 3,
+                                       'short_term_liabilities': assets - 2 * (assets // 3)},
+        })
+    return composite
+
+
+def oppdatering(i: int, n_companies: int) -> dict:
+    '''
+    Update number i in the fake update feed (oppdateringsid i + 1). Every 50th update is a deletion.
+    '''
+    orgnr = org_nr(i * 7 % n_companies)
+    seconds = i * 37
+    return {'oppdateringsid': i + 1,
+            'dato': f'2024-01-{1 + seconds // 86400:02d}T{seconds // 3600 % 24:02d}:{seconds // 60 % 60:02d}:{seconds % 60:02d}.000Z',
+            'organisasjonsnummer': orgnr,
+            'endringstype': 'Sletting' if i % 50 == 49 else 'Ny' if i < n_companies // 100 else 'Endring',
+            '_links': {'enhet': {'href': f'https://data.brreg.no/enhetsregisteret/api/enheter/{orgnr}'}}}
+
+
+def _dotted(record: dict, prefix: str = '') -> dict:
+    # Som kolonnene i BRREG sin csv-dump: nestede felt med punktum, lister som én tekst
+    flat = {}
+    for key, value in record.items():
+        if key == '_links':
+            continue
+        if isinstance(value, dict):
+            flat.update(_dotted(value, f'{prefix}{key}.'))
+        elif isinstance(value, list):
+            flat[f'{prefix}{key}'] = ', '.join(v if isinstance(v, str) else json.dumps(v, ensure_ascii=False)
+                                               for v in value)
+        else:
+            flat[f'{prefix}{key}'] = '' if value is None else str(value).lower() if isinstance(value, bool) else value
+    return flat
+
+
+def write_bulk(path: str, n_companies: int, fmt: str = 'json') -> str:
+    '''
+    Writes a gzipped register dump of `enhet(0)` .. `enhet(n_companies - 1)` with the layout of `/enheter/lastned`
+    ("json": one JSON array, "csv": one row per company with dotted column names). Written one company at a time.
+    :return: The path
+    '''
+    with gzip.open(path, 'wt', encoding='utf-8', newline='') as f:
+        if fmt == 'json':
+            f.write('[')
+            for i in range(n_companies):
+                f.write((',\n' if i else '\n') + json.dumps(enhet(i), ensure_ascii=False))
+            f.write('\n]\n')
+        else:
+            writer = None
+            for i in range(n_companies):
+                row = _dotted(enhet(i))
+                if writer is None:
+                    writer = csv.DictWriter(f, fieldnames=list(row), extrasaction='ignore')
+                    writer.writeheader()
+                writer.writerow(row)
+    return path
@@ -0,0 +1,85 @@
+'''
+Records live BRREG and Enin responses to a jsonl file the stub server can replay (`--recorded`), so the benchmarks
+can run on real payloads without hitting the registries. Each line holds the path as served by the stub, the query
+parameters, the status, the content type and the body.
+
+Enin is only recorded when ENIN_CREDENTIALS_PATH is set.
+
+    python -m benchmarks.record --out recorded.jsonl --kommune 0301 --pages 5
+    python -m benchmarks.record --out recorded.jsonl --orgnr 923609016 914778271 --enin-pages 2
+'''
+import argparse
+import asyncio
+import json
+import os
+from urllib.parse import urlsplit
+
+import aiohttp
+
+BRREG = 'https://data.brreg.no'
+ENIN_DATASETS = 'https://api.enin.ai/datasets/v1'
+ENIN_ANALYSIS = 'https://api.enin.ai/analysis/v1'
+
+
+def _stub_path(url: str) -> str:
+    # Enin-datasettene ligger rett under roten i stubben (EninApi.base_url peker dit)
+    path = urlsplit(url).path
+    return path.removeprefix('/datasets/v1')
+
+
+async def _record(session, f, url: str, params: dict = None, auth=None) -> dict | list | None:
+    async with session.get(url, params=params, auth=auth) as resp:
+        body = await resp.read()
+        f.write(json.dumps({'path': _stub_path(url),
+                            'params': {k: str(v) for k, v in (params or {}).items()},
+                            'status': resp.status,
+                            'content_type': resp.content_type,
+                            'body': body.decode('utf-8', errors='replace')}) + '\n')
+        print(f"{resp.status} {url} {params or ''} ({len(body)} bytes)")
+        if resp.status == 200 and resp.content_type == 'application/json':
+            return json.loads(body)
+        return None
+
+
+async def main(out: str, org_nums: list, kommuner: list, pages: int, page_size: int, enin_pages: int):
+    auth = None
+    if os.getenv('ENIN_CREDENTIALS_PATH'):
+        with open(os.getenv('ENIN_CREDENTIALS_PATH')) as c:
+            credentials = json.load(c)
+        auth = aiohttp.BasicAuth(credentials['client_id'], credentials['client_secret'])
+
+    org_nums = list(org_nums)
+    async with aiohttp.ClientSession(headers={'accept': 'application/json'}) as session:
+        with open(out, 'w') as f:
+            # Søkesidene gir også org.nr. å hente enheter, roller og regnskap for
+            for kommune in kommuner:
+                for page in range(pages):
+                    params = {'forretningsadresse.kommunenummer': kommune, 'page': page, 'size': page_size}
+                    data = await _record(session, f, f'{BRREG}/enhetsregisteret/api/enheter', params)
+                    for enhet in (data or {}).get('_embedded', {}).get('enheter', []):
+                        org_nums.append(enhet['organisasjonsnummer'])
+            for orgnr in dict.fromkeys(org_nums):
+                await _record(session, f, f'{BRREG}/enhetsregisteret/api/enheter/{orgnr}')
+                await _record(session, f, f'{BRREG}/enhetsregisteret/api/enheter/{orgnr}/roller')
+                await _record(session, f, f'{BRREG}/regnskapsregisteret/regnskap/{orgnr}')
+                if auth is not None:
+                    await _record(session, f, f'{ENIN_ANALYSIS}/company/NO{orgnr}/accounts-composite',
+                                  {'accounts_type_identifier': 'annual_company_accounts'}, auth)
+            if auth is not None:
+                for page in range(enin_pages):
+                    params = {'response_file_type': 'jsonl', 'company.org_nr_schema': 'NO', 'limit': 500,
+                              'offset': page * 500, 'order_by_fields': 'company.insert_timestamp'}
+                    await _record(session, f, f'{ENIN_DATASETS}/dataset/company', params, auth)
+    print(f"Recorded to {out}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--out', default='recorded.jsonl')
+    parser.add_argument('--orgnr', nargs='*', default=[], help='Organisation numbers to record')
+    parser.add_argument('--kommune', nargs='*', default=['0301'], help='Kommunenummer to record search pages for')
+    parser.add_argument('--pages', type=int, default=2, help='Search pages per kommune')
+    parser.add_argument('--page-size', type=int, default=100)
+    parser.add_argument('--enin-pages', type=int, default=1, help='Pages of the Enin company dataset')
+    args = parser.parse_args()
+    asyncio.run(main(args.out, args.orgnr, args.kommune, args.pages, args.page_size, args.enin_pages))
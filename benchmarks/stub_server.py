@@ -0,0 +1,287 @@
+import argparse
+import asyncio
+import json
+import multiprocessing
+import random
+import socket
+import time
+import zlib
+
+from aiohttp import web
+
+from benchmarks import payloads
+
+
+def make_app(n_companies: int = 10000,
+             latency: float = 0.0,
+             slow_ratio: float = 0.0,
+             n_updates: int = None,
+             error_rate: float = 0.0,
+             throttle_rate: float = 0.0,
+             retry_after: float = 1.0,
+             recorded: str = None) -> web.Application:
+    '''
+    A local stand-in for the external APIs, used by the benchmarks.
+    Organisation numbers are `payloads.org_nr(i)` for i in range(n_companies). Responses recorded with
+    `benchmarks.record` are replayed for the URLs they were recorded for, and everything else is generated.
+    :param n_companies: Number of companies in the fake register
+    :param latency: Seconds of delay added to every response
+    :param slow_ratio: Share of responses that take ten times `latency`
+    :param n_updates: Number of entries in the update feed. Defaults to a tenth of the companies
+    :param error_rate: Share of requests answered with a 503
+    :param throttle_rate: Share of requests answered with a 429 and a `Retry-After` header
+    :param retry_after: Seconds given in `Retry-After`
+    :param recorded: Optional jsonl file of recorded responses
+    '''
+    app = web.Application()
+    app['n_companies'] = n_companies
+    app['latency'] = latency
+    app['slow_ratio'] = slow_ratio
+    app['n_updates'] = n_companies // 10 if n_updates is None else n_updates
+    app['error_rate'] = error_rate
+    app['throttle_rate'] = throttle_rate
+    app['retry_after'] = retry_after
+    app['recorded'] = load_recorded(recorded) if recorded else {}
+    app['requests'] = 0
+    app['faults'] = {429: 0, 503: 0}
+
+    @web.middleware
+    async def delay(request, handler):
+        request.app['requests'] += 1
+        latency = request.app['latency']
+        if latency:
+            if random.random() < request.app['slow_ratio']:
+                latency *= 10
+            await asyncio.sleep(latency * random.uniform(0.5, 1.5))
+        return await handler(request)
+
+    @web.middleware
+    async def faults(request, handler):
+        draw = random.random()
+        if draw < request.app['throttle_rate']:
+            request.app['faults'][429] += 1
+            return web.json_response({'feilmelding': 'For mange forespørsler'}, status=429,
+                                     headers={'Retry-After': f"{request.app['retry_after']:g}"})
+        if draw < request.app['throttle_rate'] + request.app['error_rate']:
+            request.app['faults'][503] += 1
+            return web.json_response({'feilmelding': 'Tjenesten er utilgjengelig'}, status=503)
+        return await handler(request)
+
+    @web.middleware
+    async def replay(request, handler):
+        recorded = request.app['recorded'].get(_recorded_key(request.path, request.query))
+        if recorded is None:
+            return await handler(request)
+        return web.Response(status=recorded['status'], text=recorded['body'], content_type=recorded['content_type'])
+
+    @web.middleware
+    async def etag(request, handler):
+        # Som en server med ETag: uendrede svar blir 304 uten body
+        response = await handler(request)
+        if response.status == 200 and isinstance(response, web.Response) and response.body is not None:
+            tag = f'"{zlib.crc32(response.body):08x}"'
+            if request.headers.get('If-None-Match') == tag:
+                return web.Response(status=304, headers={'ETag': tag})
+            response.headers['ETag'] = tag
+        return response
+
+    app.middlewares.append(delay)
+    app.middlewares.append(faults)
+    app.middlewares.append(etag)
+    app.middlewares.append(replay)
+    app.router.add_get('/dataset/company', enin_company_page)
+    app.router.add_get('/analysis/v1/company/{company}/accounts-composite', enin_accounts_composite)
+    app.router.add_get('/enhetsregisteret/api/oppdateringer/enheter', brreg_oppdateringer)
+    app.router.add_get('/enhetsregisteret/api/enheter', brreg_search)
+    app.router.add_get('/enhetsregisteret/api/enheter/{orgnr}', brreg_enhet)
+    app.router.add_get('/enhetsregisteret/api/enheter/{orgnr}/roller', brreg_roller)
+    app.router.add_get('/regnskapsregisteret/regnskap/{orgnr}', brreg_regnskap)
+    return app
+
+
+def _recorded_key(path: str, query) -> str:
+    return f"{path}?{'&'.join(f'{k}={v}' for k, v in sorted(query.items()))}"
+
+
+def load_recorded(path: str) -> dict:
+    '''
+    Reads a jsonl file of recorded responses ({path, params, status, content_type, body} per line).
+    '''
+    recorded = {}
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                entry = json.loads(line)
+                recorded[_recorded_key(entry['path'], {k: str(v) for k, v in entry.get('params', {}).items()})] = entry
+    return recorded
+
+
+def _index(request) -> int | None:
+    i = payloads.index_of(request.match_info['orgnr'])
+    return i if i is not None and i < request.app['n_companies'] else None
+
+
+async def brreg_enhet(request):
+    i = _index(request)
+    if i is None:
+        return web.json_response({'feilmelding': 'Ingen enhet funnet'}, status=404)
+    return web.json_response(payloads.enhet(i))
+
+
+async def brreg_roller(request):
+    i = _index(request)
+    if i is None:
+        return web.json_response({'feilmelding': 'Ingen roller funnet'}, status=404)
+    return web.json_response(payloads.roller(i))
+
+
+async def brreg_regnskap(request):
+    i = _index(request)
+    if i is None or i % 10 == 0:
+        return web.json_response({'feilmelding': 'Ingen regnskap funnet'}, status=404)
+    return web.json_response(payloads.regnskap(i))
+
+
+SEARCH_CAP = 10000
+_SEARCH_FIELDS = {'naeringskode': 'naeringskode1.kode',
+                  'forretningsadresse.kommunenummer': 'forretningsadresse.kommunenummer',
+                  'forretningsadresse.kommune': 'forretningsadresse.kommune',
+                  'forretningsadresse.postnummer': 'forretningsadresse.postnummer',
+                  'forretningsadresse.poststed': 'forretningsadresse.poststed'}
+
+
+def _search_index(app) -> list[dict]:
+    if 'search_index' not in app:
+        index = []
+        for i in range(app['n_companies']):
+            enhet = payloads.enhet(i)
+            index.append({'i': i,
+                          'naeringskode1.kode': enhet['naeringskode1']['kode'],
+                          **{f'forretningsadresse.{k}': v for k, v in enhet['forretningsadresse'].items()},
+                          'registreringsdato': enhet['registreringsdatoEnhetsregisteret']})
+        app['search_index'] = index
+    return app['search_index']
+
+
+async def brreg_search(request):
+    # Som søket i Enhetsregisteret: næringskode matcher på prefiks, og (page + 1) * size kan ikke gå over SEARCH_CAP
+    query = request.query
+    page, size = int(query.get('page', 0)), int(query.get('size', 20))
+    if (page + 1) * size > SEARCH_CAP:
+        return web.json_response({'feilmelding': f'page * size kan ikke overstige {SEARCH_CAP}'}, status=400)
+    key = tuple(sorted((k, v) for k, v in query.items() if k not in ('page', 'size')))
+    cache = request.app.setdefault('search_cache', {})
+    if key not in cache:
+        hits = _search_index(request.app)
+        for param, field in _SEARCH_FIELDS.items():
+            if param in query:
+                value = query[param]
+                hits = [h for h in hits if (h[field].startswith(value) if param == 'naeringskode' else h[field] == value)]
+        if 'fraRegistreringsdatoEnhetsregisteret' in query:
+            hits = [h for h in hits if h['registreringsdato'] >= query['fraRegistreringsdatoEnhetsregisteret']]
+        if 'tilRegistreringsdatoEnhetsregisteret' in query:
+            hits = [h for h in hits if h['registreringsdato'] <= query['tilRegistreringsdatoEnhetsregisteret']]
+        cache[key] = hits
+    hits = cache[key]
+
+    # Ferdig serialiserte enheter, så stubben ikke blir flaskehalsen når mange sider hentes i parallell
+    encoded = request.app.setdefault('enhet_json', {})
+    enheter = []
+    for h in hits[page * size:(page + 1) * size]:
+        if h['i'] not in encoded:
+            encoded[h['i']] = json.dumps(payloads.enhet(h['i']))
+        enheter.append(encoded[h['i']])
+    body = json.dumps({'page': {'size': size, 'totalElements': len(hits), 'totalPages': -(-len(hits) // size), 'number': page}})
+    if enheter:
+        body = f'{body[:-1]}, "_embedded": {{"enheter": [{",".join(enheter)}]}}}}'
+    return web.Response(text=body, content_type='application/json')
+
+
+async def brreg_oppdateringer(request):
+    n, n_updates = request.app['n_companies'], request.app['n_updates']
+    size = int(request.query.get('size', 20))
+    if 'oppdateringsid' in request.query:
+        start = max(0, int(request.query['oppdateringsid']) - 1)
+    else:
+        dato = request.query['dato']
+        start = next((i for i in range(n_updates) if payloads.oppdatering(i, n)['dato'] >= dato), n_updates)
+    updates = [payloads.oppdatering(i, n) for i in range(start, min(start + size, n_updates))]
+    body = {'page': {'size': size, 'totalElements': n_updates - start}}
+    if updates:
+        body['_embedded'] = {'oppdaterteEnheter': updates}
+    return web.json_response(body)
+
+
+async def enin_company_page(request):
+    n = request.app['n_companies']
+    offset = int(request.query.get('offset', 0))
+    limit = int(request.query.get('limit', 500))
+    lines = [json.dumps(payloads.enin_company(i)) for i in range(offset, min(offset + limit, n))]
+    return web.Response(text='\n'.join(lines) + '\n', content_type='application/x-ndjson')
+
+
+async def enin_accounts_composite(request):
+    # Hvert tiende selskap har ingen regnskap
+    i = payloads.index_of(request.match_info['company'])
+    if i is None or i >= request.app['n_companies'] or i % 10 == 0:
+        return web.json_response({'detail': 'Not found'}, status=404)
+    return web.json_response(payloads.enin_accounts_composite(i))
+
+
+async def start(app: web.Application, port: int = 0) -> tuple[web.AppRunner, str]:
+    '''
+    Starts the app on localhost and returns the runner and its base url.
+    '''
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', port)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f'http://127.0.0.1:{port}'
+
+
+def _serve(port: int, kwargs: dict):
+    web.run_app(make_app(**kwargs), host='127.0.0.1', port=port, reuse_port=True, print=None)
+
+
+def start_processes(processes: int = 1, **kwargs) -> tuple[list, str]:
+    '''
+    Runs the app in separate processes sharing one port, so the stub is neither the bottleneck nor competing with
+    the event loop of the client when the client itself runs in several processes.
+    :param processes: Number of server processes
+    :param kwargs: Passed to make_app
+    :return: The processes (terminate them when done) and the base url
+    '''
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+    ctx = multiprocessing.get_context('spawn')
+    servers = [ctx.Process(target=_serve, args=(port, kwargs), daemon=True) for _ in range(processes)]
+    for server in servers:
+        server.start()
+    deadline = time.monotonic() + 30
+    while True:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            break
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.1)
+    return servers, f'http://127.0.0.1:{port}'
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run the stub server')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--companies', type=int, default=10000)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--slow-ratio', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--throttle-rate', type=float, default=0.0)
+    parser.add_argument('--retry-after', type=float, default=1.0)
+    parser.add_argument('--recorded', help='jsonl file of recorded responses to replay')
+    args = parser.parse_args()
+    web.run_app(make_app(args.companies, args.latency, args.slow_ratio, error_rate=args.error_rate,
+                         throttle_rate=args.throttle_rate, retry_after=args.retry_after, recorded=args.recorded),
+                host='127.0.0.1', port=args.port)
@@ -1 +1,245 @@
-from src.modules import EninApi,BRREGapi
\ No newline at end of file
+'''
+Command-line entry point for the crawlers. Only argparse is imported up front, so `--help` and argument errors
+return at once. The clients, pandas and the BigQuery and Enin credentials are loaded by the command that needs them.
+
+    python main.py fill-financials --year 2024 --queue jobs.sqlite
+    python main.py fill-companies --orgnr-file orgnr.txt --local data/
+    python main.py nace-geo --geo-type kommunenummer --geo 0301 4601
+    python main.py sync-updates --state state/updates.json
+    python main.py enin-accounts --orgnr-file orgnr.txt --concurrency 20
+    python main.py sharded fill_companies --orgnr-file orgnr.txt --workers 4
+'''
+import argparse
+import asyncio
+import sys
+
+
+def _read_org_nums(args):
+    from src.orgnr import OrgNumbers
+
+    values = list(args.orgnr or [])
+    if args.orgnr_file:
+        with open(args.orgnr_file) as f:
+            values.extend(line.split(',')[0].strip() for line in f if line.strip())
+    org_nums = OrgNumbers(values)
+    if not len(org_nums):
+        raise SystemExit('No valid organisation numbers given (--orgnr or --orgnr-file)')
+    return org_nums
+
+
+def _sink(args):
+    if args.local:
+        from src.sinks import LocalSink
+        return LocalSink(args.local)
+    return None
+
+
+def _seconds(days: float | None) -> float | None:
+    return days * 86400 if days is not None else None
+
+
+def _brreg(args):
+    from src.modules import BRREGapi
+    from src.ratelimit import AdaptiveRateLimiter
+
+    kwargs = {}
+    if args.cache:
+        from src.httpcache import ResponseCache
+        kwargs['cache'] = ResponseCache(args.cache)
+    if args.seen:
+        from src.seen import SeenSet
+        kwargs['seen'] = SeenSet(args.seen, max_age=_seconds(args.seen_max_age))
+    if args.fingerprints:
+        from src.fingerprint import FingerprintIndex
+        kwargs['fingerprints'] = FingerprintIndex(args.fingerprints)
+    limiter = AdaptiveRateLimiter(concurrency=min(20, args.concurrency), max_concurrency=args.concurrency)
+    api = BRREGapi(limiter=limiter, sink=_sink(args), **kwargs)
+    api.logger.set_level(args.log_level)
+    return api
+
+
+def _enin(args):
+    from src.modules import EninApi
+
+    api = EninApi(sink=_sink(args))
+    api.logger.set_level(args.log_level)
+    return api
+
+
+def _queue(args, job: str):
+    if not args.queue:
+        return None
+    from src.jobqueue import JobQueue
+    return JobQueue(args.queue, job)
+
+
+async def _run(api, args, call):
+    try:
+        return await call(api)
+    finally:
+        await api.close()
+        if args.metrics:
+            api.metrics.write_prometheus(args.metrics)
+
+
+def fill_financials(args):
+    return _run(_brreg(args), args, lambda api: api.fill_financials(head=args.head, year=args.year,
+                                                                    queue=_queue(args, 'fill_financials'),
+                                                                    chunk_size=args.chunk_size))
+
+
+def fill_roles(args):
+    return _run(_brreg(args), args, lambda api: api.fill_roles(queue=_queue(args, 'fill_roles'),
+                                                               chunk_size=args.chunk_size))
+
+
+def fill_companies(args):
+    org_nums = _read_org_nums(args)
+    return _run(_brreg(args), args, lambda api: api.fill_companies(org_nums, queue=_queue(args, 'fill_companies'),
+                                                                   chunk_size=args.chunk_size,
+                                                                   fused=not args.sequential))
+
+
+def companies(args):
+    org_nums = _read_org_nums(args)
+    return _run(_brreg(args), args, lambda api: api.get_companies(org_nums, save_bq=True,
+                                                                  concurrency=args.concurrency, if_exists='merge'))
+
+
+def roles(args):
+    org_nums = _read_org_nums(args)
+    return _run(_brreg(args), args, lambda api: api.get_roles(org_nums, save_bq=True, concurrency=args.concurrency))
+
+
+def financials(args):
+    org_nums = _read_org_nums(args)
+    return _run(_brreg(args), args, lambda api: api.get_financial_data(org_nums, save_bq=True,
+                                                                       concurrency=args.concurrency))
+
+
+def nace_geo(args):
+    return _run(_brreg(args), args, lambda api: api.get_by_nace_geo(nace_codes=args.nace, geo_type=args.geo_type,
+                                                                    geo_value=args.geo, batch_size=args.concurrency,
+                                                                    save_bq=True))
+
+
+def bulk(args):
+    return _run(_brreg(args), args, lambda api: api.get_companies_bulk(source=args.source, fmt=args.format,
+                                                                       save_bq=True))
+
+
+def sync_updates(args):
+    return _run(_brreg(args), args, lambda api: api.sync_updates(args.state, since=args.since, roles=not args.no_roles,
+                                                                 concurrency=args.concurrency))
+
+
+def enin_companies(args):
+    return _run(_enin(args), args, lambda api: api.get_companies(n=args.n, save=True, concurrency=args.concurrency,
+                                                                 checkpoint_path=args.checkpoint))
+
+
+def enin_accounts(args):
+    org_nums = _read_org_nums(args)
+    return _run(_enin(args), args, lambda api: api.fetch_accounts(org_nums, concurrency=args.concurrency))
+
+
+async def sharded(args):
+    from functools import partial
+    from src.ratelimit import SharedRateLimiter
+    from src.sharding import brreg_client, crawl_sharded
+
+    org_nums = _read_org_nums(args) if args.orgnr or args.orgnr_file else None
+    # Grensen for samtidige forespørsler gjelder per prosess, så --concurrency deles på arbeiderne
+    per_worker = max(1, args.concurrency // args.workers)
+    limiter = SharedRateLimiter(concurrency=min(20, per_worker), max_concurrency=per_worker)
+    api_factory = partial(brreg_client, cache=args.cache, seen=args.seen, seen_max_age=_seconds(args.seen_max_age),
+                          fingerprints=args.fingerprints, log_level=args.log_level)
+    return await asyncio.to_thread(crawl_sharded, args.job, org_nums=org_nums, queue=_queue(args, args.job),
+                                   workers=args.workers, sink=_sink(args), limiter=limiter, api_factory=api_factory,
+                                   chunk_size=args.chunk_size)
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description='BRREG and Enin crawlers')
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--local', metavar='DIR', help='Save to a LocalSink in DIR instead of BigQuery')
+    common.add_argument('--concurrency', type=int, default=200, help='Max requests in flight')
+    common.add_argument('--metrics', metavar='PATH', help='Write the metrics in Prometheus format to PATH when done')
+    common.add_argument('--log-level', default='INFO')
+    brreg = argparse.ArgumentParser(add_help=False, parents=[common])
+    brreg.add_argument('--cache', metavar='PATH', help='ResponseCache file')
+    brreg.add_argument('--seen', metavar='PATH', help='SeenSet file. Org numbers saved before are skipped')
+    brreg.add_argument('--seen-max-age', type=float, metavar='DAYS',
+                       help='Days an org number in the SeenSet counts as saved. Kept until cleared if not given')
+    brreg.add_argument('--fingerprints', metavar='PATH', help='FingerprintIndex file. Unchanged rows are skipped')
+    orgs = argparse.ArgumentParser(add_help=False)
+    orgs.add_argument('--orgnr', nargs='*', help='Organisation numbers')
+    orgs.add_argument('--orgnr-file', help='File with one organisation number per line (first csv column)')
+    queued = argparse.ArgumentParser(add_help=False)
+    queued.add_argument('--queue', metavar='PATH', help='JobQueue file. A rerun resumes where the last one stopped')
+    queued.add_argument('--chunk-size', type=int, default=5000)
+
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    p = commands.add_parser('fill-financials', parents=[brreg, queued], help='Accounts for companies in brreg.company_data without them')
+    p.add_argument('--year', type=int, default=2024)
+    p.add_argument('--head', type=int)
+    p.set_defaults(func=fill_financials)
+
+    p = commands.add_parser('fill-roles', parents=[brreg, queued], help='Roles for companies in brreg.company_data without them')
+    p.set_defaults(func=fill_roles)
+
+    p = commands.add_parser('fill-companies', parents=[brreg, orgs, queued], help='Company data, accounts and roles')
+    p.add_argument('--sequential', action='store_true', help='Three passes instead of one fused pass')
+    p.set_defaults(func=fill_companies)
+
+    for name, func, text in [('companies', companies, 'Company data from /enheter'),
+                             ('roles', roles, 'Roles from /enheter/{orgnr}/roller'),
+                             ('financials', financials, 'Accounts from the Regnskapsregisteret')]:
+        p = commands.add_parser(name, parents=[brreg, orgs], help=text)
+        p.set_defaults(func=func)
+
+    p = commands.add_parser('nace-geo', parents=[brreg], help='Companies by NACE code and/or location')
+    p.add_argument('--nace', nargs='*')
+    p.add_argument('--geo-type', default='kommunenummer', choices=['kommune', 'kommunenummer', 'postnummer', 'poststed'])
+    p.add_argument('--geo', nargs='*')
+    p.set_defaults(func=nace_geo)
+
+    p = commands.add_parser('bulk', parents=[brreg], help='The whole register from the bulk dump')
+    p.add_argument('--source', help='Local dump. The latest is downloaded if not given')
+    p.add_argument('--format', default='json', choices=['json', 'csv'])
+    p.set_defaults(func=bulk)
+
+    p = commands.add_parser('sync-updates', parents=[brreg], help='Changes since the last sync from the update feed')
+    p.add_argument('--state', required=True, help='Json file with the high-water mark')
+    p.add_argument('--since', help='ISO timestamp to start from without a stored mark')
+    p.add_argument('--no-roles', action='store_true')
+    p.set_defaults(func=sync_updates)
+
+    p = commands.add_parser('enin-companies', parents=[common], help='The Enin company dataset')
+    p.add_argument('--n', type=int, help='Stop at this offset')
+    p.add_argument('--checkpoint', help='Json checkpoint file to resume from')
+    p.set_defaults(func=enin_companies, concurrency=4)
+
+    p = commands.add_parser('enin-accounts', parents=[common, orgs], help='Enin accounts-composite per company')
+    p.set_defaults(func=enin_accounts, concurrency=20)
+
+    p = commands.add_parser('sharded', parents=[brreg, orgs, queued],
+                            help='A BRREG job in several processes. --concurrency is split between the workers')
+    p.add_argument('job', choices=['companies', 'roles', 'financials', 'fill_companies'])
+    p.add_argument('--workers', type=int, default=4)
+    p.set_defaults(func=sharded)
+    return parser
+
+
+def main(argv: list = None):
+    args = build_parser().parse_args(argv)
+    from src.env import load_env
+    load_env()
+    result = asyncio.run(args.func(args))
+    if isinstance(result, dict):
+        print(result)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,107 @@
+import csv
+import gzip
+import io
+import json
+import re
+from typing import Iterator, Literal
+
+_SKIP = re.compile(r'[\s,]*')
+
+
+def _open_text(path: str) -> io.TextIOBase:
+    '''
+    Opens a dump file as text. Gzip is detected on the magic bytes, so both the
+    compressed files from `/lastned` and plain fixture files can be read.
+    '''
+    with open(path, 'rb') as f:
+        magic = f.read(2)
+    if magic == b'\x1f\x8b':
+        return gzip.open(path, 'rt', encoding='utf-8', newline='')
+    return open(path, 'r', encoding='utf-8', newline='')
+
+
+def iter_json_array(fileobj, chunk_size: int = 1 << 20) -> Iterator[dict]:
+    '''
+    Yields the elements of a top level JSON array one by one, reading `fileobj` in chunks.
+    Only one chunk plus the element being decoded is held in memory at any time.
+    :param fileobj: A text file object positioned at the start of the array
+    :param chunk_size: Number of characters to read per chunk
+    :return: Iterator over the decoded elements
+    '''
+    decoder = json.JSONDecoder()
+    buffer = ''
+    started = False
+    eof = False
+    while not eof:
+        chunk = fileobj.read(chunk_size)
+        eof = not chunk
+        buffer += chunk
+        pos = 0
+        if not started:
+            start = buffer.find('[')
+            if start == -1:
+                if eof and buffer.strip():
+                    raise ValueError('Expected a JSON array')
+                buffer = ''
+                continue
+            started = True
+            pos = start + 1
+
+        while True:
+            pos = _SKIP.match(buffer, pos).end()
+            if pos < len(buffer) and buffer[pos] == ']':
+                return
+            try:
+                obj, pos_end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                # Elementet er ikke ferdig lest, hent neste chunk
+                break
+            yield obj
+            pos = pos_end
+        buffer = buffer[pos:]
+
+    if not started:
+        return
+    raise ValueError(f'Truncated JSON array, {len(buffer)} characters left unparsed')
+
+
+def iter_csv_records(fileobj) -> Iterator[dict]:
+    '''
+    Yields the rows of a BRREG csv dump as flat dicts with dotted keys (e.g. `forretningsadresse.postnummer`),
+    which is the same naming `pd.json_normalize` gives the json dump. Empty values become None.
+    '''
+    reader = csv.DictReader(fileobj)
+    for row in reader:
+        yield {k: (v if v != '' else None) for k, v in row.items()}
+
+
+def iter_bulk_records(path: str, fmt: Literal["json", "csv"] = "json", chunk_size: int = 1 << 20) -> Iterator[dict]:
+    '''
+    Streams the records of a full register dump from `https://data.brreg.no/enhetsregisteret/api/enheter/lastned`
+    (or a local fixture with the same layout).
+    :param path: Path to the (optionally gzipped) dump
+    :param fmt: "json" for the json dump, "csv" for the csv dump
+    :param chunk_size: Number of characters read per chunk for the json parser
+    :return: Iterator over the records
+    '''
+    if fmt not in ["json", "csv"]:
+        raise ValueError(f"Invalid fmt: {fmt}. Choose between 'json' and 'csv'.")
+    with _open_text(path) as f:
+        if fmt == "json":
+            yield from iter_json_array(f, chunk_size=chunk_size)
+        else:
+            yield from iter_csv_records(f)
+
+
+def iter_batches(records: Iterator[dict], batch_size: int) -> Iterator[list[dict]]:
+    '''
+    Groups an iterator of records into lists of at most `batch_size` records.
+    '''
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
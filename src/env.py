@@ -0,0 +1,10 @@
+from functools import cache
+
+
+@cache
+def load_env():
+    '''
+    Loads `.env` into the environment the first time a client or credential needs it, instead of on import.
+    '''
+    from dotenv import load_dotenv
+    load_dotenv()
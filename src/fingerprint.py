@@ -0,0 +1,151 @@
+import json
+import os
+import sqlite3
+import threading
+
+import numpy as np
+import pandas as pd
+
+# Kolonner som endres ved hver henting uten at selve dataene er endret
+VOLATILE = ('fetch_date', 'page', '_written_at')
+
+_MIX = np.uint64(0x9E3779B97F4A7C15)
+
+
+def _to_text(value):
+    if isinstance(value, (list, tuple, np.ndarray)) and all(isinstance(v, str) for v in value):
+        return '\x1f'.join(value)
+    if isinstance(value, np.ndarray):
+        value = value.tolist()
+    return json.dumps(value, ensure_ascii=False, sort_keys=True, default=str)
+
+
+def _hashable(s: pd.Series) -> pd.Series:
+    if s.dtype == object:
+        first = s.dropna()
+        if not first.empty and isinstance(first.iloc[0], (list, dict, tuple, np.ndarray)):
+            return s.map(_to_text, na_action='ignore')
+    return s
+
+
+def row_hashes(df: pd.DataFrame, ignore: tuple = VOLATILE) -> np.ndarray:
+    '''
+    A stable 64 bit hash of every row. Missing values and the column order do not affect the hash, so a record
+    hashes the same whether a batch has an all-empty column for it or not. Values are hashed with their dtype,
+    so cast the batch to its schema first.
+    :param df: The batch
+    :param ignore: Columns left out of the hash
+    :return: uint64 array with one hash per row
+    '''
+    total = np.zeros(len(df), dtype=np.uint64)
+    with np.errstate(over='ignore'):
+        for col in df.columns:
+            if col in ignore:
+                continue
+            s = _hashable(df[col])
+            values = pd.util.hash_pandas_object(s, index=False).to_numpy()
+            name = pd.util.hash_array(np.array([str(col)], dtype=object))[0]
+            mixed = (values ^ name) * _MIX
+            total += np.where(s.notna().to_numpy(), mixed, np.uint64(0))
+    return total
+
+
+class FingerprintIndex:
+    '''
+    Local SQLite index of the last saved hash of every key, used to skip rows that have not changed since they were
+    last written. `split` returns the new and changed rows of a batch, and `commit` stores their hashes once the
+    write has succeeded. Keys with several rows (e.g. roles) are hashed as a group, so a change in one role keeps all
+    rows of that organisation.
+    '''
+
+    def __init__(self, path: str, logger=None):
+        '''
+        :param path: Path to the SQLite file. Created if it does not exist
+        :param logger: Optional logger
+        '''
+        self.path = path
+        self.logger = logger
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._con = sqlite3.connect(path, check_same_thread=False)
+        self._con.execute('PRAGMA journal_mode=WAL')
+        self._con.execute('''CREATE TABLE IF NOT EXISTS fingerprints (
+                                 dataset TEXT NOT NULL,
+                                 tbl TEXT NOT NULL,
+                                 key TEXT NOT NULL,
+                                 hash INTEGER NOT NULL,
+                                 PRIMARY KEY (dataset, tbl, key)) WITHOUT ROWID''')
+        self._con.commit()
+        self.counters = {}
+
+    @staticmethod
+    def _keys(df: pd.DataFrame, key_cols: list[str]) -> pd.Series:
+        keys = df[key_cols[0]].astype(str)
+        for col in key_cols[1:]:
+            keys = keys + '|' + df[col].astype(str)
+        return keys
+
+    def _lookup(self, dataset: str, table: str, keys: list[str]) -> dict[str, int]:
+        found = {}
+        with self._lock:
+            for i in range(0, len(keys), 500):
+                chunk = keys[i:i + 500]
+                rows = self._con.execute(
+                    f'SELECT key, hash FROM fingerprints WHERE dataset = ? AND tbl = ? AND key IN ({",".join("?" * len(chunk))})',
+                    [dataset, table, *chunk]).fetchall()
+                found.update(rows)
+        return found
+
+    def split(self, df: pd.DataFrame, table: str, dataset: str, key_cols: list[str]) -> tuple[pd.DataFrame, dict]:
+        '''
+        Compares a batch against the index.
+        :param df: The batch, cast to its schema
+        :param table: Table name
+        :param dataset: Dataset name
+        :param key_cols: The key columns
+        :return: The rows of new or changed keys, and the hashes to `commit` once they are written
+        '''
+        if df.empty:
+            return df, {}
+        keys = self._keys(df, key_cols)
+        # Nøkler med flere rader får summen av radene som hash
+        codes, uniques = pd.factorize(keys)
+        grouped = np.zeros(len(uniques), dtype=np.uint64)
+        np.add.at(grouped, codes, row_hashes(df))
+        current = dict(zip(uniques, grouped.view(np.int64).tolist()))
+
+        stored = self._lookup(dataset, table, list(current))
+        changed = {k: h for k, h in current.items() if stored.get(k) != h}
+        counts = self.counters.setdefault(f'{dataset}.{table}', {'unchanged': 0, 'changed': 0, 'new': 0})
+        new = sum(1 for k in changed if k not in stored)
+        counts['new'] += new
+        counts['changed'] += len(changed) - new
+        counts['unchanged'] += len(current) - len(changed)
+        if self.logger:
+            self.logger.info(f"{dataset}.{table}: {new} new, {len(changed) - new} changed, "
+                             f"{len(current) - len(changed)} unchanged keys skipped")
+        return df[keys.isin(changed).to_numpy()], {'dataset': dataset, 'table': table, 'hashes': changed}
+
+    def commit(self, pending: dict):
+        '''
+        Stores the hashes returned by `split` after the rows are written.
+        '''
+        if not pending or not pending['hashes']:
+            return
+        with self._lock:
+            self._con.executemany(
+                'INSERT OR REPLACE INTO fingerprints (dataset, tbl, key, hash) VALUES (?, ?, ?, ?)',
+                [(pending['dataset'], pending['table'], k, h) for k, h in pending['hashes'].items()])
+            self._con.commit()
+
+    def close(self):
+        with self._lock:
+            self._con.close()
+
+    def stats(self) -> dict:
+        return {table: dict(counts) for table, counts in self.counters.items()}
+
+    def __str__(self):
+        return ' | '.join(f"{table}: {c['new']} new, {c['changed']} changed, {c['unchanged']} unchanged"
+                          for table, c in self.counters.items())
@@ -0,0 +1,184 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from urllib.parse import urlencode
+
+# Statuser som er verdt å lagre. 404 betyr f.eks. "ingen regnskap" hos BRREG og er like stabil som et svar
+CACHEABLE_STATUSES = (200, 404)
+_KEPT_HEADERS = ('Content-Type', 'ETag', 'Last-Modified')
+# Antall oppslag som samles før bruketidene skrives
+_ACCESS_BATCH = 1000
+
+
+class CachedResponse:
+    '''
+    A response read from the cache. `fresh` is False once it is older than the cache TTL, and it should then be
+    revalidated with the `conditional_headers`.
+    '''
+
+    def __init__(self, key: str, status: int, headers: dict, body: bytes, stored_at: float, ttl: float):
+        self.key = key
+        self.status = status
+        self.headers = headers
+        self.body = body
+        self.stored_at = stored_at
+        self.fresh = time.time() - stored_at < ttl
+
+    @property
+    def conditional_headers(self) -> dict:
+        headers = {}
+        if self.headers.get('ETag'):
+            headers['If-None-Match'] = self.headers['ETag']
+        if self.headers.get('Last-Modified'):
+            headers['If-Modified-Since'] = self.headers['Last-Modified']
+        return headers
+
+
+class ResponseCache:
+    '''
+    On-disk cache of response bodies keyed by URL and query parameters, in one SQLite file.
+    Entries younger than `ttl` are served without a request. Older entries are revalidated with
+    `If-None-Match`/`If-Modified-Since` when the server sent an ETag or Last-Modified, so an unchanged resource costs a
+    304 instead of the full body. When the stored bodies exceed `max_bytes`, the least recently used entries are removed.
+    '''
+
+    def __init__(self,
+                 path: str,
+                 ttl: float = 7 * 86400,
+                 max_bytes: int = 2 * 1024 ** 3,
+                 compress: bool = True,
+                 logger=None):
+        '''
+        :param path: Path to the SQLite file. Created if it does not exist
+        :param ttl: Seconds an entry is used without asking the server
+        :param max_bytes: Max total size of the stored bodies
+        :param compress: Store bodies zlib compressed
+        :param logger: Optional logger
+        '''
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.compress = compress
+        self.logger = logger
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._con = sqlite3.connect(path, check_same_thread=False)
+        self._con.execute('PRAGMA journal_mode=WAL')
+        self._con.execute('PRAGMA synchronous=NORMAL')
+        self._con.execute('''CREATE TABLE IF NOT EXISTS responses (
+                                 key TEXT PRIMARY KEY,
+                                 status INTEGER NOT NULL,
+                                 headers TEXT NOT NULL,
+                                 body BLOB,
+                                 compressed INTEGER NOT NULL,
+                                 size INTEGER NOT NULL,
+                                 stored_at REAL NOT NULL,
+                                 accessed_at REAL NOT NULL)''')
+        self._con.execute('CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)')
+        self._con.commit()
+        self._size = self._con.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+        # Bruketider fra `get`, skrevet samlet og committet med en gang, så oppslag ikke holder skrivelåsen til
+        # filen (som andre prosesser, f.eks. i sharded crawl, deler) åpen
+        self._accessed = {}
+        self.counters = {'hits': 0, 'revalidated': 0, 'misses': 0, 'stored': 0, 'evicted': 0}
+
+    @staticmethod
+    def key(url: str, params: dict = None) -> str:
+        if not params:
+            return url
+        return f"{url}?{urlencode(sorted((k, str(v)) for k, v in params.items()))}"
+
+    def get(self, url: str, params: dict = None) -> CachedResponse | None:
+        '''
+        Returns the stored response for the url and params, or None. Does not count as a hit until the caller knows
+        whether it was used; see `hit`, `revalidated` and `miss`.
+        '''
+        key = self.key(url, params)
+        with self._lock:
+            row = self._con.execute('SELECT status, headers, body, compressed, stored_at FROM responses WHERE key = ?',
+                                    (key,)).fetchone()
+            if row is None:
+                return None
+            self._accessed[key] = time.time()
+            if len(self._accessed) >= _ACCESS_BATCH:
+                self._write_accessed()
+                self._con.commit()
+        status, headers, body, compressed, stored_at = row
+        if compressed:
+            body = zlib.decompress(body)
+        return CachedResponse(key, status, json.loads(headers), body, stored_at, self.ttl)
+
+    def _write_accessed(self):
+        if self._accessed:
+            self._con.executemany('UPDATE responses SET accessed_at = ? WHERE key = ?',
+                                  [(at, key) for key, at in self._accessed.items()])
+            self._accessed = {}
+
+    def hit(self):
+        self.counters['hits'] += 1
+
+    def miss(self):
+        self.counters['misses'] += 1
+
+    def revalidated(self, cached: CachedResponse):
+        '''
+        Marks a stored response as confirmed by a 304, so it is fresh for another `ttl`.
+        '''
+        self.counters['revalidated'] += 1
+        with self._lock:
+            self._con.execute('UPDATE responses SET stored_at = ? WHERE key = ?', (time.time(), cached.key))
+            self._con.commit()
+
+    def put(self, url: str, params: dict, status: int, headers, body: bytes):
+        '''
+        Stores a response if its status is in CACHEABLE_STATUSES.
+        '''
+        if status not in CACHEABLE_STATUSES:
+            return
+        kept = {h: headers[h] for h in _KEPT_HEADERS if h in headers}
+        stored = zlib.compress(body, 6) if self.compress else body
+        now = time.time()
+        key = self.key(url, params)
+        with self._lock:
+            self._write_accessed()
+            old = self._con.execute('SELECT size FROM responses WHERE key = ?', (key,)).fetchone()
+            self._con.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                              (key, status, json.dumps(kept), stored, int(self.compress), len(stored), now, now))
+            self._size += len(stored) - (old[0] if old else 0)
+            self.counters['stored'] += 1
+            if self._size > self.max_bytes:
+                self._evict()
+            self._con.commit()
+
+    def _evict(self):
+        # Fjerner de minst brukte til vi er under 90 % av grensen
+        target = self.max_bytes * 0.9
+        removed = 0
+        for key, size in self._con.execute('SELECT key, size FROM responses ORDER BY accessed_at').fetchall():
+            if self._size <= target:
+                break
+            self._con.execute('DELETE FROM responses WHERE key = ?', (key,))
+            self._size -= size
+            removed += 1
+        self.counters['evicted'] += removed
+        if self.logger:
+            self.logger.debug(f"Evicted {removed} responses from {self.path}, {self._size / 1e6:.1f} MB left")
+
+    def close(self):
+        with self._lock:
+            self._write_accessed()
+            self._con.commit()
+            self._con.close()
+
+    def stats(self) -> dict:
+        lookups = self.counters['hits'] + self.counters['revalidated'] + self.counters['misses']
+        return {**self.counters,
+                'hit_ratio': round((self.counters['hits'] + self.counters['revalidated']) / lookups, 3) if lookups else 0.0,
+                'size_mb': round(self._size / 1e6, 1)}
+
+    def __str__(self):
+        return ' | '.join(f'{k} {v}' for k, v in self.stats().items())
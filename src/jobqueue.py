@@ -0,0 +1,160 @@
+import os
+import socket
+import sqlite3
+import time
+from contextlib import contextmanager
+
+PENDING = 'pending'
+IN_FLIGHT = 'in_flight'
+DONE = 'done'
+FAILED = 'failed'
+
+
+class JobQueue:
+    '''
+    A durable work queue of items (org numbers) for one job, in a SQLite file that several processes on the same
+    machine can share. Items go from pending to in_flight when a worker claims them, and to done once their data is
+    saved. A failed item goes back to pending until it has been tried `max_attempts` times, and is then kept as failed
+    (dead letter) for inspection. Claims are leased: items held by a worker that crashed become pending again once
+    the lease runs out, so a new run picks up exactly the unfinished items.
+    '''
+
+    def __init__(self, path: str, job: str, max_attempts: int = 3, lease_seconds: float = 3600, logger=None):
+        '''
+        :param path: Path to the SQLite file. Created if it does not exist
+        :param job: Name of the job. One file can hold several jobs
+        :param max_attempts: Attempts before an item is moved to failed
+        :param lease_seconds: Seconds a claimed item is held before another worker can take it
+        :param logger: Optional logger
+        '''
+        self.path = path
+        self.job = job
+        self.max_attempts = max_attempts
+        self.lease_seconds = lease_seconds
+        self.logger = logger
+        self.worker = f'{socket.gethostname()}:{os.getpid()}'
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._con = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self._con.execute('PRAGMA journal_mode=WAL')
+        self._con.execute('''CREATE TABLE IF NOT EXISTS items (
+                                 job TEXT NOT NULL,
+                                 item TEXT NOT NULL,
+                                 state TEXT NOT NULL,
+                                 attempts INTEGER NOT NULL DEFAULT 0,
+                                 leased_until REAL,
+                                 worker TEXT,
+                                 error TEXT,
+                                 updated_at REAL NOT NULL,
+                                 PRIMARY KEY (job, item))''')
+        self._con.execute('CREATE INDEX IF NOT EXISTS items_state ON items (job, state)')
+
+    @contextmanager
+    def _transaction(self):
+        # BEGIN IMMEDIATE tar skrivelåsen med en gang, så to prosesser ikke kan hente de samme elementene
+        self._con.execute('BEGIN IMMEDIATE')
+        try:
+            yield self._con
+        except BaseException:
+            self._con.execute('ROLLBACK')
+            raise
+        self._con.execute('COMMIT')
+
+    def add(self, items) -> int:
+        '''
+        Adds items as pending. Items already in the job are left as they are.
+        :return: Number of new items
+        '''
+        now = time.time()
+        with self._transaction() as con:
+            before = con.total_changes
+            con.executemany('INSERT OR IGNORE INTO items (job, item, state, updated_at) VALUES (?, ?, ?, ?)',
+                            [(self.job, str(item), PENDING, now) for item in items])
+            return con.total_changes - before
+
+    def claim(self, n: int) -> list[str]:
+        '''
+        Claims up to `n` pending items (or in_flight items whose lease has run out) for this worker.
+        '''
+        now = time.time()
+        with self._transaction() as con:
+            items = [row[0] for row in con.execute(
+                '''SELECT item FROM items
+                   WHERE job = ? AND (state = ? OR (state = ? AND leased_until < ?))
+                   LIMIT ?''', (self.job, PENDING, IN_FLIGHT, now, n))]
+            con.executemany('''UPDATE items SET state = ?, attempts = attempts + 1, leased_until = ?, worker = ?,
+                                                updated_at = ?
+                               WHERE job = ? AND item = ?''',
+                            [(IN_FLIGHT, now + self.lease_seconds, self.worker, now, self.job, item) for item in items])
+        return items
+
+    def complete(self, items):
+        '''
+        Marks items as done. Call this after their data is saved.
+        '''
+        now = time.time()
+        with self._transaction() as con:
+            con.executemany('UPDATE items SET state = ?, leased_until = NULL, error = NULL, updated_at = ? '
+                            'WHERE job = ? AND item = ?',
+                            [(DONE, now, self.job, str(item)) for item in items])
+
+    def fail(self, items, error: str = None):
+        '''
+        Puts items back as pending, or moves them to failed once they have been tried `max_attempts` times.
+        '''
+        now = time.time()
+        with self._transaction() as con:
+            con.executemany('''UPDATE items SET state = CASE WHEN attempts >= ? THEN ? ELSE ? END,
+                                                leased_until = NULL, error = ?, updated_at = ?
+                               WHERE job = ? AND item = ?''',
+                            [(self.max_attempts, FAILED, PENDING, error, now, self.job, str(item)) for item in items])
+
+    def release(self, items):
+        '''
+        Puts claimed items back as pending without counting the attempt, e.g. on shutdown.
+        '''
+        now = time.time()
+        with self._transaction() as con:
+            con.executemany('''UPDATE items SET state = ?, attempts = MAX(attempts - 1, 0), leased_until = NULL,
+                                                updated_at = ?
+                               WHERE job = ? AND item = ? AND state = ?''',
+                            [(PENDING, now, self.job, str(item), IN_FLIGHT) for item in items])
+
+    def retry_failed(self) -> int:
+        '''
+        Moves all failed items back to pending with their attempts reset.
+        :return: Number of items moved
+        '''
+        with self._transaction() as con:
+            return con.execute('UPDATE items SET state = ?, attempts = 0, updated_at = ? WHERE job = ? AND state = ?',
+                               (PENDING, time.time(), self.job, FAILED)).rowcount
+
+    def clear(self) -> int:
+        '''
+        Removes every item of the job, e.g. to start it over once it is finished.
+        :return: Number of items removed
+        '''
+        with self._transaction() as con:
+            return con.execute('DELETE FROM items WHERE job = ?', (self.job,)).rowcount
+
+    def failed_items(self) -> list[tuple[str, int, str]]:
+        '''
+        The dead letter items as (item, attempts, last error).
+        '''
+        return self._con.execute('SELECT item, attempts, error FROM items WHERE job = ? AND state = ?',
+                                 (self.job, FAILED)).fetchall()
+
+    def counts(self) -> dict:
+        counts = dict.fromkeys([PENDING, IN_FLIGHT, DONE, FAILED], 0)
+        counts.update(self._con.execute('SELECT state, COUNT(*) FROM items WHERE job = ? GROUP BY state',
+                                        (self.job,)).fetchall())
+        return counts
+
+    def __len__(self):
+        return self._con.execute('SELECT COUNT(*) FROM items WHERE job = ?', (self.job,)).fetchone()[0]
+
+    def close(self):
+        self._con.close()
+
+    def __str__(self):
+        return f'{self.job}: ' + ' | '.join(f'{k} {v}' for k, v in self.counts().items())
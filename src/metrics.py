@@ -0,0 +1,288 @@
+import os
+import re
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+# Sekunder. Dekker alt fra cachede svar til trege lagringer
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+DURATION_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+_ORGNR = re.compile(r'(?<!\d)(NO)?\d{9}(?!\d)')
+
+_HELP = {
+    'http_request_seconds': 'Request latency per endpoint and status (error for connection failures)',
+    'http_response_bytes_total': 'Response body bytes downloaded per endpoint',
+    'http_cache_total': 'Responses served from the response cache, per endpoint and result',
+    'http_retries_total': 'Requests retried after a 429, 5xx or connection error',
+    'items_total': 'Organisations processed per job and result',
+    'records_total': 'Records prepared for saving per table',
+    'saved_rows_total': 'Rows written by the background writer per table',
+    'transform_seconds': 'Time spent flattening and casting batches per stage',
+    'save_seconds': 'Time spent writing one batch per table',
+}
+
+
+def endpoint_of(url: str) -> str:
+    '''
+    The path of a URL with organisation numbers replaced by `{orgnr}`, so all calls to one endpoint share labels.
+    '''
+    return _ORGNR.sub('{orgnr}', urlsplit(url).path) or '/'
+
+
+def _labels(labels: dict) -> tuple:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(labels: tuple, extra: tuple = ()) -> str:
+    pairs = labels + extra
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{k}="{v}"' for k, v in pairs) + '}'
+
+
+class Histogram:
+    '''
+    Counts of observations per bucket, with sum and count, as in Prometheus.
+    '''
+
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        '''
+        Estimates a quantile by linear interpolation inside its bucket.
+        '''
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if seen + n >= rank and n:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * (rank - seen) / n
+            seen += n
+        return self.buckets[-1]
+
+    @property
+    def mean(self) -> float:
+        return self.sum / self.count if self.count else 0.0
+
+
+class Metrics:
+    '''
+    Counters, gauges and histograms for the fetch, transform and save stages of a client, shared by its background
+    writer thread. Labels are given as keyword arguments. Gauges can be functions, which are read on export, e.g.
+    the depth of the write queue. `to_prometheus` gives the Prometheus text format and `write_prometheus` writes it
+    for the node_exporter textfile collector. `summary` condenses a run into request latency per endpoint, bytes,
+    records per second and the share of the run spent transforming and saving.
+    '''
+
+    def __init__(self, namespace: str = 'crawler'):
+        '''
+        :param namespace: Prefix for the exported metric names
+        '''
+        self.namespace = namespace
+        self.started = time.time()
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._gauges = {}
+        self._histograms = {}
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = (name, _labels(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set_gauge(self, name: str, value, **labels):
+        '''
+        Sets a gauge to a number, or to a function returning the number when the metrics are read.
+        '''
+        with self._lock:
+            self._gauges[(name, _labels(labels))] = value
+
+    def observe(self, name: str, value: float, buckets: tuple = LATENCY_BUCKETS, **labels):
+        key = (name, _labels(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, name: str, buckets: tuple = DURATION_BUCKETS, **labels):
+        '''
+        Observes the duration of the block in seconds.
+        '''
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, buckets, **labels)
+
+    def request(self, url: str, status, seconds: float, nbytes: int = 0):
+        endpoint = endpoint_of(url)
+        self.observe('http_request_seconds', seconds, endpoint=endpoint, status=status)
+        if nbytes:
+            self.inc('http_response_bytes_total', nbytes, endpoint=endpoint)
+
+    def item(self, job: str, result: str):
+        self.inc('items_total', job=job, result=result)
+
+    def progress(self, job: str) -> str:
+        '''
+        One line with the items of a job per result and the rate since the metrics were created.
+        '''
+        with self._lock:
+            results = {dict(lbl)['result']: v for (n, lbl), v in self._counters.items()
+                       if n == 'items_total' and dict(lbl).get('job') == job}
+        total = sum(results.values())
+        rate = total / max(time.time() - self.started, 1e-9)
+        return f"{job}: {total:.0f} items ({rate:.1f}/s) | " + ' | '.join(f'{k} {v:.0f}' for k, v in sorted(results.items()))
+
+    def histogram(self, name: str, **labels) -> Histogram:
+        '''
+        All series of a histogram whose labels include `labels`, merged into one, e.g. the request latency over all
+        endpoints with `histogram('http_request_seconds')`.
+        '''
+        wanted = set(_labels(labels))
+        merged = None
+        with self._lock:
+            for (n, lbl), h in self._histograms.items():
+                if n != name or not wanted <= set(lbl):
+                    continue
+                if merged is None:
+                    merged = Histogram(h.buckets)
+                merged.counts = [a + b for a, b in zip(merged.counts, h.counts)]
+                merged.sum += h.sum
+                merged.count += h.count
+        return merged or Histogram(LATENCY_BUCKETS)
+
+    def _gauge_values(self) -> dict:
+        values = {}
+        for key, value in self._gauges.items():
+            try:
+                values[key] = float(value() if callable(value) else value)
+            except Exception:
+                continue
+        return values
+
+    def to_prometheus(self) -> str:
+        '''
+        All metrics in the Prometheus text exposition format.
+        '''
+        lines = []
+        with self._lock:
+            series = [('counter', self._counters), ('gauge', self._gauge_values()), ('histogram', self._histograms)]
+            typed = set()
+            for kind, metrics in series:
+                for (name, labels), value in sorted(metrics.items(), key=lambda kv: kv[0]):
+                    full = f'{self.namespace}_{name}'
+                    if full not in typed:
+                        typed.add(full)
+                        if name in _HELP:
+                            lines.append(f'# HELP {full} {_HELP[name]}')
+                        lines.append(f'# TYPE {full} {kind}')
+                    if kind != 'histogram':
+                        lines.append(f'{full}{_format_labels(labels)} {value:g}')
+                        continue
+                    cumulative = 0
+                    for bound, n in zip(value.buckets, value.counts):
+                        cumulative += n
+                        lines.append(f'{full}_bucket{_format_labels(labels, (("le", f"{bound:g}"),))} {cumulative}')
+                    lines.append(f'{full}_bucket{_format_labels(labels, (("le", "+Inf"),))} {value.count}')
+                    lines.append(f'{full}_sum{_format_labels(labels)} {value.sum:g}')
+                    lines.append(f'{full}_count{_format_labels(labels)} {value.count}')
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path: str):
+        '''
+        Writes `to_prometheus` to a file atomically, e.g. `<textfile dir>/crawler.prom`.
+        '''
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(self.to_prometheus())
+        os.replace(tmp_path, path)
+
+    def summary(self) -> dict:
+        '''
+        A summary of the run so far. `transform_share` and `save_share` are the time spent in each stage divided by
+        the run time: a save share near 1 means the run waited on the warehouse, a high transform share means it was
+        CPU-bound, and low values for both with slow requests mean it was network-bound.
+        '''
+        elapsed = max(time.time() - self.started, 1e-9)
+        with self._lock:
+            requests = {}
+            for (name, labels), h in self._histograms.items():
+                if name != 'http_request_seconds':
+                    continue
+                lbl = dict(labels)
+                endpoint = requests.setdefault(lbl['endpoint'], {'requests': 0, 'statuses': {}, 'seconds': Histogram(LATENCY_BUCKETS)})
+                endpoint['requests'] += h.count
+                endpoint['statuses'][lbl['status']] = endpoint['statuses'].get(lbl['status'], 0) + h.count
+                merged = endpoint['seconds']
+                merged.counts = [a + b for a, b in zip(merged.counts, h.counts)]
+                merged.sum += h.sum
+                merged.count += h.count
+            stage_seconds = {}
+            for (name, labels), h in self._histograms.items():
+                if name in ('transform_seconds', 'save_seconds'):
+                    stage_seconds[name] = stage_seconds.get(name, 0.0) + h.sum
+            counters = dict(self._counters)
+            gauges = self._gauge_values()
+
+        def total(name, by):
+            out = {}
+            for (n, labels), v in counters.items():
+                if n == name:
+                    key = dict(labels).get(by)
+                    out[key] = out.get(key, 0) + v
+            return out
+
+        items = {}
+        for (name, labels), v in counters.items():
+            if name == 'items_total':
+                lbl = dict(labels)
+                items.setdefault(lbl['job'], {})[lbl['result']] = v
+        downloaded = total('http_response_bytes_total', 'endpoint')
+        records = total('records_total', 'table')
+        return {
+            'elapsed_s': round(elapsed, 1),
+            'requests': {endpoint: {'requests': r['requests'],
+                                    'statuses': r['statuses'],
+                                    'mean_ms': round(r['seconds'].mean * 1000, 1),
+                                    'p50_ms': round(r['seconds'].quantile(0.5) * 1000, 1),
+                                    'p95_ms': round(r['seconds'].quantile(0.95) * 1000, 1),
+                                    'p99_ms': round(r['seconds'].quantile(0.99) * 1000, 1),
+                                    'mb': round(downloaded.get(endpoint, 0) / 1e6, 2)}
+                         for endpoint, r in requests.items()},
+            'cache': total('http_cache_total', 'result'),
+            'retries': sum(total('http_retries_total', 'endpoint').values()),
+            'items': items,
+            'records_per_s': {table: round(n / elapsed, 1) for table, n in records.items()},
+            'saved_rows': total('saved_rows_total', 'table'),
+            'transform_share': round(stage_seconds.get('transform_seconds', 0.0) / elapsed, 3),
+            'save_share': round(stage_seconds.get('save_seconds', 0.0) / elapsed, 3),
+            'gauges': {f"{name}{_format_labels(labels)}": v for (name, labels), v in gauges.items()},
+        }
+
+    def __str__(self):
+        summary = self.summary()
+        requests = sum(r['requests'] for r in summary['requests'].values())
+        mb = sum(r['mb'] for r in summary['requests'].values())
+        return (f"{summary['elapsed_s']}s | requests {requests} | {mb:.1f} MB | retries {summary['retries']} | "
+                f"records/s {summary['records_per_s']} | transform_share {summary['transform_share']} | "
+                f"save_share {summary['save_share']}")
@@ -1,56 +1,245 @@
-from sibr_api import ApiBase
+from sibr_api import ApiBase, RateLimitError, APIkeyError
 import os
 import json
 from aiohttp import BasicAuth
 from sibr_module import BigQuery,Logger
+import numpy as np
 import pandas as pd
-from typing import Literal
+from typing import AsyncIterator, Literal
 import aiohttp
 import asyncio
-import inspect
-from datetime import datetime
-from dotenv import load_dotenv
-load_dotenv()
+import time
+from functools import partial
+from itertools import islice
+import tempfile
+from datetime import datetime, date, timedelta
+from src.bulk import iter_bulk_records, iter_batches
+from src.state import read_state, write_state
+from src.pool import imap_bounded, imap_expanding
+from src.schemas import get_schema
+from src.sinks import Sink, BigQuerySink, BackgroundWriter
+from src.fingerprint import FingerprintIndex
+from src.httpcache import ResponseCache
+from src.jobqueue import JobQueue, PENDING, IN_FLIGHT
+from src.orgnr import OrgNumbers
+from src.seen import SeenSet
+from src.spill import SpillFrame
+from src.ratelimit import AdaptiveRateLimiter, RETRY_STATUSES, parse_retry_after
+from src.metrics import Metrics, endpoint_of
+from src.env import load_env
+try:
+    import brotli
+except ImportError:
+    brotli = None
+try:
+    import orjson
+    _loads = orjson.loads
+except ImportError:
+    _loads = json.loads
 #os.chdir("..")
 #from dotenv import load_dotenv
 #load_dotenv()
 
 class EninApi(ApiBase):
-    def __init__(self, logger=None, logger_name=None):
+    PAGE_SIZE = 500
+    # Tabellene et accounts-composite-dokument deles i. company og accounts_type har én rad per selskap
+    ACCOUNTS_TABLES = ('accounts', 'accounts_highlights', 'accounts_income_statement', 'accounts_balance_sheet',
+                       'company', 'accounts_type')
+    _LATEST_ONLY = ('company', 'accounts_type')
+
+    def __init__(self,
+                 logger=None,
+                 logger_name=None,
+                 sink: Sink = None,
+                 max_pending_writes: int = 2,
+                 fingerprints: FingerprintIndex = None,
+                 cache: ResponseCache = None,
+                 metrics: Metrics = None,
+                 memory_limit: int = 256 * 2 ** 20,
+                 spill_dir: str = None):
+        '''
+        :param logger: Optional Logger
+        :param logger_name: Optional logger name
+        :param sink: Where the data is saved. Defaults to BigQuery, which is only connected to on the first save
+        :param max_pending_writes: Max number of batches queued for the background writer before saving blocks
+        :param fingerprints: Optional FingerprintIndex. Rows that have not changed since they were last saved are skipped
+        :param cache: Optional ResponseCache for `fetch_single` calls without a response_handler (e.g. `get_item`)
+        :param metrics: Optional Metrics, e.g. one shared with a BRREGapi. A new one is made if None
+        :param memory_limit: Bytes of fetched data a call that returns its result keeps in memory before the batches are
+            spilled to disk. The cap holds with as_frame=False; the default DataFrame result is built whole at the end
+        :param spill_dir: Folder for the spilled batches. The system temp folder if None
+        '''
+        load_env()
         super().__init__(logger, logger_name)
         if logger is None:
             logger = Logger("EninApi")
         self.logger = logger
         # self.logger.log_level = "DEBUG"
         self.base_url = "https://api.enin.ai/datasets/v1"
-        self.auth = self.load_auth()
-        self.bq = BigQuery(logger=logger)
+        self.analysis_url = "https://api.enin.ai/analysis/v1"
+        self._auth = None
+        self.metrics = metrics or Metrics()
+        self.sink = sink or BigQuerySink(logger=logger)
+        self.writer = BackgroundWriter(self.sink, max_pending=max_pending_writes, logger=logger, metrics=self.metrics)
+        self.fingerprints = fingerprints
+        self.cache = cache
+        self.memory_limit = memory_limit
+        self.spill_dir = spill_dir
+        self._bq = None
+        self.jsonl_stats = {'lines': 0, 'malformed': 0}
+
+    @property
+    def bq(self) -> BigQuery:
+        if isinstance(self.sink, BigQuerySink):
+            return self.sink.bq
+        if self._bq is None:
+            self._bq = BigQuery(logger=self.logger)
+        return self._bq
+
+    async def close(self):
+        '''
+        Waits for the queued writes and closes the session.
+        '''
+        try:
+            await asyncio.to_thread(self.writer.close)
+        finally:
+            if self.fingerprints is not None:
+                self.logger.info(f"Fingerprints: {self.fingerprints}")
+            if self.cache is not None:
+                self.logger.info(f"Response cache: {self.cache}")
+            self.logger.info(f"Metrics: {self.metrics.summary()}")
+            await super().close()
+
+    async def fetch_single(self, url: str,
+                           headers: dict = None,
+                           params: dict = None,
+                           auth=None,
+                           proxy_url: str = None,
+                           timeout: int = 30,
+                           allow_redirects: bool = True,
+                           ssl: bool = True,
+                           return_format: Literal["json", "txt"] = "json",
+                           response_handler=None):
+        '''
+        `ApiBase.fetch_single` with the response cache in front, and the latency, status and size of every request
+        recorded in `self.metrics`. Streamed responses (with a response_handler) are not cached. Fresh entries are
+        returned without a request, stale ones are revalidated with a conditional request.
+        Errors are handled as in `ApiBase.fetch_single`.
+        '''
+        def decode(body: bytes):
+            if return_format == 'txt':
+                return body.decode('utf-8', errors='replace')
+            return _loads(body) if body else None
+
+        cache = self.cache if response_handler is None else None
+        cached = cache.get(url, params) if cache is not None else None
+        if cached is not None and cached.fresh:
+            cache.hit()
+            self.metrics.inc('http_cache_total', endpoint=endpoint_of(url), result='hit')
+            return decode(cached.body) if cached.status == 200 else None
+
+        await self._ensure_session()
+        status = 'error'
+        nbytes = 0
+        start = time.perf_counter()
+        try:
+            async with self.session.get(url,
+                                        headers={**(headers or {}), **(cached.conditional_headers if cached else {})},
+                                        params=params,
+                                        auth=auth,
+                                        proxy=proxy_url,
+                                        timeout=timeout,
+                                        allow_redirects=allow_redirects,
+                                        ssl=ssl) as response:
+                status = response.status
+                if response.status == 304 and cached is not None:
+                    cache.revalidated(cached)
+                    self.metrics.inc('http_cache_total', endpoint=endpoint_of(url), result='revalidated')
+                    return decode(cached.body) if cached.status == 200 else None
+                if response.status == 200 and response_handler is not None:
+                    try:
+                        return await response_handler(response)
+                    finally:
+                        nbytes = response.content.total_bytes
+                body = await response.read()
+                nbytes = len(body)
+                if response.status == 429:
+                    raise RateLimitError(f'Rate limit exceeded. Error: {body.decode("utf-8", errors="replace")}')
+                if response.status == 401:
+                    raise APIkeyError(f'Authorization error. Error: {body.decode("utf-8", errors="replace")}')
+                if response.status == 403:
+                    raise PermissionError(f'Permission denied. Error: {body.decode("utf-8", errors="replace")}')
+                if cache is not None:
+                    cache.miss()
+                    cache.put(url, params, response.status, response.headers, body)
+                if response.status == 200:
+                    try:
+                        return decode(body)
+                    except ValueError as e:
+                        self.logger.error(f"Could not decode response from {url}: {e}")
+                        return None
+                self.logger.error(f'Error message - fetch_single: {response.status}, {body.decode("utf-8", errors="replace")}.')
+                return None
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            self.logger.error(f"Network failure or timeout - {e}. url {url}")
+            return None
+        finally:
+            self.metrics.request(url, status, time.perf_counter() - start, nbytes)
+
+    @property
+    def auth(self) -> BasicAuth:
+        '''
+        Enin credentials from `ENIN_CREDENTIALS_PATH`, read on the first request.
+        '''
+        if self._auth is None:
+            self._auth = self.load_auth()
+        return self._auth
 
     def load_auth(self):
+        load_env()
         with open(os.getenv("ENIN_CREDENTIALS_PATH"), "r") as f:
             auth_data = json.load(f)
             return BasicAuth(auth_data['client_id'], auth_data['client_secret'])
 
+    async def iter_jsonl_batches(self, response, batch_size: int = 500):
+        '''
+        Async generator that parses a jsonl response as the lines arrive and yields lists of at most `batch_size` records.
+        Malformed lines are skipped, logged and counted in `self.jsonl_stats`.
+        :param response: aiohttp.ClientResponse with a jsonl body
+        :param batch_size: Max number of records per batch
+        '''
+        batch = []
+        async for line in response.content:
+            line = line.strip()
+            if not line:
+                continue
+            self.jsonl_stats['lines'] += 1
+            try:
+                batch.append(_loads(line))
+            except ValueError as e:
+                self.jsonl_stats['malformed'] += 1
+                self.logger.warning(f"Could not parse line {self.jsonl_stats['lines']}: {line[:200]!r}, Error: {e} | "
+                                    f"{self.jsonl_stats['malformed']} malformed lines so far")
+                continue
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
     async def handle_jsonl_stream(self, response):
         results = []
-        # BRUK "async for" og "response.content" for å strømme asynkront
-        async for line in response.content:
-            if line:
-                try:
-                    record = json.loads(line.decode('utf-8'))
-                    results.append(record)
-                except json.JSONDecodeError as e:
-                    print(f"Kunne ikke parse linje: {line.decode('utf-8')}, Feil: {e}")
+        async for batch in self.iter_jsonl_batches(response):
+            results.extend(batch)
         return results
 
-    async def get_companie_page(self, offset=0):
-        PAGE_SIZE = 500
+    async def get_companie_page(self, offset=0, response_handler=None):
         url_company_page = f"{self.base_url}/dataset/company"
 
         params_company_page = {
             "response_file_type": "jsonl",
             "company.org_nr_schema": "NO",
-            "limit": PAGE_SIZE,
+            "limit": self.PAGE_SIZE,
             "offset": offset,
             "order_by_fields": "company.insert_timestamp"
         }
@@ -58,442 +247,1119 @@ class EninApi(ApiBase):
         response = await self.fetch_single(url=url_company_page,
                                            params=params_company_page,
                                            auth=self.auth,
-                                           response_handler=self.handle_jsonl_stream,
+                                           response_handler=response_handler or self.handle_jsonl_stream,
                                            )
+        # None betyr at forespørselen feilet, en tom liste at det ikke er flere selskaper
+        return response
 
-        return response if response else []
+    async def save_company_page(self, records: list[dict]):
+        '''
+        Queues a page for `enin.company_dataset`. Waits without blocking the event loop while the writer is
+        `max_pending_writes` batches behind, so the pages in flight keep downloading.
+        '''
+        with self.metrics.timer('transform_seconds', stage='enin.company_dataset'):
+            df = pd.json_normalize(records)
+            self._ensure_fieldnames(df)
+        self.metrics.inc('records_total', len(df), table='enin.company_dataset')
+        await self.writer.submit(df, "company_dataset", "enin", if_exists="append")
+
+    @staticmethod
+    def _insert_timestamp(record: dict):
+        company = record.get('company')
+        if isinstance(company, dict) and 'insert_timestamp' in company:
+            return company['insert_timestamp']
+        return record.get('company.insert_timestamp', record.get('insert_timestamp'))
+
+    async def iter_companies(self,
+                             n: int = None,
+                             batch_size: int = 500,
+                             concurrency: int = 4,
+                             checkpoint_path: str = None,
+                             max_retries: int = 3) -> AsyncIterator[list[dict]]:
+        '''
+        Pages through the company dataset ordered by `company.insert_timestamp`, `PAGE_SIZE` companies per request, and
+        yields the records of one page at a time, so only the pages in flight are held in memory.
+        Up to `concurrency` pages are requested at a time, but pages are yielded in offset order. The crawl stops at
+        the first short page. When the next page is asked for, i.e. after the caller has handled a page, the next
+        offset and the last insert_timestamp are written to `checkpoint_path`, so an interrupted crawl continues from
+        there when called with the same path.
+        :param n: Stop at this offset. If None, fetch until a page comes back short
+        :param batch_size: Number of records per parsed batch
+        :param concurrency: Number of page requests in flight
+        :param checkpoint_path: Optional path to a json checkpoint file
+        :param max_retries: Number of attempts per page. A page that still fails raises, with the checkpoint at the
+            last handled page
+        :return: Async iterator of lists of records
+        '''
+        checkpoint = read_state(checkpoint_path, default={'offset': 0, 'insert_timestamp': None})
+        start_offset = checkpoint['offset']
+        if start_offset:
+            self.logger.info(f"Resuming from offset {start_offset} (insert_timestamp {checkpoint['insert_timestamp']})")
 
-    async def get_companies(self, n: int):
-        results = []
-        for i in range(0, n, 500):
-            self.logger.info(i)
-            results += await self.get_companies(i)
-        return pd.DataFrame.from_dict(results)
+        total = 0
+        starttime = datetime.now()
+
+        async def handle_page(response):
+            page = []
+            async for batch in self.iter_jsonl_batches(response, batch_size):
+                page.extend(batch)
+            return page
+
+        async def fetch_page(offset):
+            for attempt in range(1, max_retries + 1):
+                page = await self.get_companie_page(offset, response_handler=handle_page)
+                if isinstance(page, list) and (page or attempt == max_retries):
+                    return page
+                self.logger.warning(f"Empty or failed page at offset {offset}, attempt {attempt}/{max_retries}")
+            # En side som feiler er ikke slutten på datasettet; sjekkpunktet blir stående så kjøringen kan fortsette
+            raise ValueError(f"Could not fetch company page at offset {offset} after {max_retries} attempts")
+
+        in_flight = {}
+        next_offset = start_offset
+        commit_offset = start_offset
+        done = False
+
+        def schedule():
+            nonlocal next_offset
+            while len(in_flight) < concurrency and (n is None or next_offset < n) and not done:
+                in_flight[next_offset] = asyncio.create_task(fetch_page(next_offset))
+                next_offset += self.PAGE_SIZE
+
+        try:
+            schedule()
+            while commit_offset in in_flight:
+                page = await in_flight.pop(commit_offset)
+                if page:
+                    yield page
+                    total += len(page)
+                    checkpoint = {'offset': commit_offset + len(page),
+                                  'insert_timestamp': self._insert_timestamp(page[-1])}
+                    if checkpoint_path:
+                        write_state(checkpoint_path, checkpoint)
+
+                if len(page) < self.PAGE_SIZE:
+                    done = True
+                    break
+                commit_offset += self.PAGE_SIZE
+                schedule()
+                elapsed = (datetime.now() - starttime).total_seconds()
+                self.logger.info(f"Fetched {total} companies up to offset {commit_offset} | "
+                                 f"{(commit_offset - start_offset) / self.PAGE_SIZE / max(elapsed, 1e-9):.1f} pages/s | "
+                                 f"{self.jsonl_stats['malformed']} malformed lines")
+        finally:
+            for task in in_flight.values():
+                task.cancel()
+            await asyncio.gather(*in_flight.values(), return_exceptions=True)
+
+        self.logger.info(f"Company crawl finished in {datetime.now() - starttime}. Got {total} companies, "
+                         f"last insert_timestamp {checkpoint['insert_timestamp']} | writer: {self.writer}")
+
+    async def get_companies(self,
+                            n: int = None,
+                            save: bool = False,
+                            batch_size: int = 500,
+                            concurrency: int = 4,
+                            checkpoint_path: str = None,
+                            max_retries: int = 3,
+                            as_frame: bool = True) -> pd.DataFrame | SpillFrame | None:
+        '''
+        Fetches the company dataset with `iter_companies`.
+        With `save=True` every page is queued for `enin.company_dataset` as soon as it is handled, and the call returns
+        once all pages are written.
+        :param n: Stop at this offset. If None, fetch until a page comes back short
+        :param save: Save the pages instead of returning them
+        :param batch_size: Number of records per parsed batch
+        :param concurrency: Number of page requests in flight
+        :param checkpoint_path: Optional path to a json checkpoint file
+        :param max_retries: Number of attempts per page. A page that still fails raises, with the checkpoint at the
+            last handled page
+        :param as_frame: If False, return the SpillFrame the pages were gathered in. The default builds one DataFrame
+            of the whole result, which is not bounded by `memory_limit`
+        :return: DataFrame or SpillFrame if save is False, else None
+        '''
+        results = None if save else SpillFrame(memory_limit=self.memory_limit, spill_dir=self.spill_dir,
+                                                logger=self.logger)
+        async for page in self.iter_companies(n, batch_size, concurrency, checkpoint_path, max_retries):
+            if save:
+                await self.save_company_page(page)
+            else:
+                results.append(pd.DataFrame.from_dict(page))
+        if save:
+            await self.writer.wait()
+            return None
+        if not as_frame:
+            return results
+        with results:
+            return results.to_pandas()
 
     async def get_item(self, item):
-        url = f'https://api.enin.ai/analysis/v1/company/NO{item}/accounts-composite?accounts_type_identifier=annual_company_accounts'
+        url = f'{self.analysis_url}/company/NO{item}/accounts-composite?accounts_type_identifier=annual_company_accounts'
         response = await self.fetch_single(url=url,
                                            auth=self.auth, )
         return response if response else []
 
     def save_func(self, data: dict[str, pd.DataFrame], if_exists: str = "merge"):
-
-        def prepare_dataframe(df):
-            string_cols = ["company_uuid", "accounts_type_uuid", "app_url", "uuid", "accounts_uuid", "currency_code",
-                           "accounting_schema", "income_statement__currency_code"]
-            bool_cols = ["corporate_group_accounts_flag", "estimated_accounting_period_flag"]
-            date_cols = ["accounting_announcement_date", "accounting_from_date", "accounting_to_date"]
-
-            # === HANDLE NUMERIC COLUMNS ===
-            num_cols = ['inventory_change']
-            for col in df.columns:
-                if col not in string_cols and col not in bool_cols and col not in date_cols:
-                    df[col] = pd.to_numeric(df[col], errors='coerce')
-                    df[col] = df[col].fillna(0)
-                    # df[col] = df[col].astype("float")
-                elif col in date_cols:
-                    df[col] = pd.to_datetime(df[col], errors='coerce')
-            return df
-
+        '''
+        Casts each table to its schema and queues it for the background writer. Only blocks when the writer is
+        `max_pending_writes` batches behind. Call `close()` (or `writer.flush()`) to wait for the last writes.
+        With a fingerprint index only new and changed rows are written.
+        '''
         for key, df in data.items():
+            if df is None or df.empty:
+                continue
             self.logger.info(f'Processing {key} with {len(df)} records')
-            if not df.empty or df is None:
-                df.dropna(subset=["org_nr"], inplace=True)
-                self.logger.info(f'{len(df)} records after dropping NaNs on org_nr')
-
-                # == HANDLE TROBULE COLUMNS ===
-                trouble_columns = []
-                for col in trouble_columns:
-                    if col in df.columns:
-                        df[col] = df[col].astype(str)
-
-                if if_exists == "merge":
-                    if key in ["company", 'accounts_type']:
-                        self.bq.to_bq(df=df,
-                                      table_name=key,
-                                      dataset_name="enin",
-                                      if_exists="merge",
-                                      merge_on=["org_nr"],
-                                      )
-                    else:
-                        df = prepare_dataframe(df)
-                        self.logger.info(f'{len(df)} records after preparing {key}')
-                        self.bq.to_bq(df=df,
-                                      table_name=key,
-                                      dataset_name="enin",
-                                      if_exists="merge",
-                                      merge_on=["org_nr", "accounting_year"],
-                                      # explicit_schema = {"inventory_change" : "FLOAT"}
-                                      )
-                if if_exists == "replace":
-
-                    if key in ["company", 'accounts_type']:
-                        self.bq.to_bq(df=df,
-                                      table_name=key,
-                                      dataset_name="enin",
-                                      if_exists="replace")
-                    else:
-                        df = prepare_dataframe(df)
-                        self.logger.info(f'{len(df)} records after preparing {key}')
-                        self.bq.to_bq(df=df,
-                                      table_name=key,
-                                      dataset_name="enin",
-                                      if_exists="replace")
+            df = df.dropna(subset=["org_nr"])
+            self.logger.info(f'{len(df)} records after dropping NaNs on org_nr')
+
+            schema = get_schema("enin", key)
+            with self.metrics.timer('transform_seconds', stage=f'cast.enin.{key}'):
+                df = schema.cast(df)
+            self.metrics.inc('records_total', len(df), table=f'enin.{key}')
+            on_done = None
+            if self.fingerprints is not None and if_exists != "replace":
+                df, pending = self.fingerprints.split(df, key, "enin", schema.key)
+                if df.empty:
+                    continue
+                on_done = partial(self.fingerprints.commit, pending)
+            self.writer.write(df, key, "enin",
+                              if_exists=if_exists,
+                              merge_on=schema.key if if_exists == "merge" else None,
+                              explicit_schema=schema.bq_schema(df),
+                              on_done=on_done)
+
+    async def iter_accounts(self,
+                            org_nrs,
+                            concurrency: int = 20,
+                            chunk_rows: int = 20000,
+                            failures: set = None,
+                            summary: dict = None) -> AsyncIterator[dict[str, pd.DataFrame]]:
+        '''
+        Fetches the accounts-composite document of every org number with at most `concurrency` requests in flight.
+        The responses are buffered until they hold `chunk_rows` table rows, and are then flattened into the
+        ACCOUNTS_TABLES with one `transform_data` call (in a thread, so the fetching goes on meanwhile) and yielded.
+        Org numbers are read lazily from `org_nrs`, so memory stays the same for 500 and 500 000 companies.
+        Stops early on a 429 (RateLimitError), after yielding what it has.
+        :param org_nrs: Iterable of organisation numbers
+        :param concurrency: Max number of requests in flight
+        :param chunk_rows: Rows (over all tables) per yielded chunk
+        :param failures: Optional set the org numbers without accounts or with failed requests are added to
+        :param summary: Optional dict the counts of the run are kept in
+        :return: Async iterator of table name -> DataFrame
+        '''
+        starttime = datetime.now()
+        responses = []
+        if summary is None:
+            summary = {}
+        for key in ('companies', 'ok', 'failed', 'rows'):
+            summary.setdefault(key, 0)
+        summary.setdefault('rate_limited', False)
+        buffered = 0
+
+        def progress() -> str:
+            minutes = max((datetime.now() - starttime).total_seconds() / 60, 1e-9)
+            return (f"{summary['companies']} companies | {summary['companies'] / minutes:.0f} companies/min | "
+                    f"ok {summary['ok']} | failed {summary['failed']} | rows {summary['rows'] + buffered}")
+
+        async for orgnr, result in imap_bounded(self.get_item, org_nrs, concurrency):
+            if isinstance(result, RateLimitError):
+                summary['rate_limited'] = True
+                self.logger.warning(f"Rate limit exceeded at {progress()}. Stopping.")
+                break
+            summary['companies'] += 1
+            if isinstance(result, Exception):
+                self.logger.error(f'Task error for orgnr {orgnr}: {result}')
+            if isinstance(result, list) and result and all(isinstance(year, dict) for year in result):
+                summary['ok'] += 1
+                self.metrics.item('enin.accounts', 'ok')
+                responses.append((orgnr, result))
+                # Én rad per år i fire tabeller, og én rad i company og accounts_type
+                buffered += len(result) * (len(self.ACCOUNTS_TABLES) - len(self._LATEST_ONLY)) + len(self._LATEST_ONLY)
+            else:
+                summary['failed'] += 1
+                self.metrics.item('enin.accounts', 'failed')
+                if failures is not None:
+                    failures.add(str(orgnr))
+
+            if buffered >= chunk_rows:
+                items, responses = responses, []
+                summary['rows'] += buffered
+                buffered = 0
+                yield await asyncio.to_thread(self.transform_data, items)
+            if summary['companies'] % 1000 == 0:
+                self.logger.info(f"Processed {progress()} | writer: {self.writer}")
+
+        if responses:
+            summary['rows'] += buffered
+            yield await asyncio.to_thread(self.transform_data, responses)
+        summary['companies_per_min'] = round(summary['companies'] / max((datetime.now() - starttime).total_seconds() / 60, 1e-9))
+        self.logger.info(f"Accounts fetch finished in {datetime.now() - starttime} | {progress()} | writer: {self.writer}")
+
+    async def fetch_accounts(self,
+                             org_nrs,
+                             save: bool = True,
+                             concurrency: int = 20,
+                             chunk_rows: int = 20000,
+                             if_exists: str = "merge",
+                             failures: set = None,
+                             as_frame: bool = True) -> dict:
+        '''
+        Fetches the accounts of every org number with `iter_accounts` and passes each chunk to `save_func`.
+        Without saving, the tables are gathered in one SpillFrame each. They share `memory_limit`, so only that many
+        bytes of the result are held in memory during the run.
+        :param org_nrs: Iterable of organisation numbers
+        :param save: Save the tables. If False they are returned as DataFrames
+        :param concurrency: Max number of requests in flight
+        :param chunk_rows: Rows (over all tables) per save
+        :param if_exists: Passed to save_func
+        :param failures: Optional set the org numbers without accounts or with failed requests are added to
+        :param as_frame: If False, return the SpillFrames under 'data'. The default builds one DataFrame per table of
+            the whole result, which is not bounded by `memory_limit`
+        :return: Summary of the run, with the tables under 'data' if save is False
+        '''
+        summary = {'companies': 0, 'ok': 0, 'failed': 0, 'rows': 0, 'saves': 0, 'rate_limited': False}
+        tables = {key: SpillFrame(memory_limit=self.memory_limit // len(self.ACCOUNTS_TABLES),
+                                  spill_dir=self.spill_dir, logger=self.logger)
+                  for key in self.ACCOUNTS_TABLES}
+        async for chunk in self.iter_accounts(org_nrs, concurrency, chunk_rows, failures, summary):
+            if save:
+                await asyncio.to_thread(self.save_func, chunk, if_exists)
+                summary['saves'] += 1
+            else:
+                for key, df in chunk.items():
+                    tables[key].append(df)
+        if save:
+            await self.writer.wait()
+        else:
+            summary['data'] = tables if not as_frame else {key: spilled.to_pandas() for key, spilled in tables.items()}
+        if save or as_frame:
+            for spilled in tables.values():
+                spilled.close()
+        return summary
 
     def transform_data(self, items) -> dict:
-        data = {
-            'accounts': [],
-            'accounts_highlights': [],
-            'accounts_income_statement': [],
-            'accounts_balance_sheet': [],
-            'company': [],
-            'accounts_type': [],
-        }
-        results = [self.transform_single(item) for item in items if item is not None]
-        for i, result in enumerate(results):
-            self.logger.debug(f'Working result nr {i}')
-            for key in result:
-                self.logger.debug(f'Extending data {key}...')
-                data.get(key).extend(result[key])
-
-        output = {}
-        for key, value in data.items():
-            df = pd.DataFrame(value)
-            output[key] = df
-
+        '''
+        Flattens a batch of (org_nr, accounts-composite) responses into one DataFrame per ACCOUNTS_TABLES table.
+        The years of all companies are gathered in one list, each table is built from it with a single DataFrame
+        call, and org_nr is set as a whole column afterwards. The responses are not modified.
+        Missing sub-documents are skipped instead of failing the batch.
+        :param items: (org_nr, response) tuples. Empty responses count as failed
+        :return: Table name -> DataFrame
+        '''
+        responses = []
+        for item in items:
+            if item is None:
+                continue
+            if item[1]:
+                responses.append(item)
+            else:
+                self.fail_responses += 1
+        self.ok_responses += len(responses)
+
+        with self.metrics.timer('transform_seconds', stage='enin.accounts'):
+            orgs = np.fromiter((int(orgnr) for orgnr, _ in responses), dtype=np.int64, count=len(responses))
+            years = [year for _, res in responses for year in res]
+            year_orgs = np.repeat(orgs, [len(res) for _, res in responses])
+            latest = [res[0] for _, res in responses]
+
+            output = {}
+            for key in self.ACCOUNTS_TABLES:
+                # company og accounts_type tas fra nyeste år, de andre tabellene har én rad per år
+                source, org_nr = (latest, orgs) if key in self._LATEST_ONLY else (years, year_orgs)
+                rows = [doc.get(key) for doc in source]
+                present = [row is not None for row in rows]
+                if not all(present):
+                    rows = [row for row in rows if row is not None]
+                    org_nr = org_nr[np.array(present, dtype=bool)]
+                df = pd.DataFrame(rows)
+                if rows:
+                    df['org_nr'] = org_nr
+                output[key] = df
         return output
 
     def transform_single(self, output):
+        '''
+        Splits one (org_nr, accounts-composite) response into lists of rows per ACCOUNTS_TABLES table.
+        '''
         orgnr, res = output
-
-        data = {
-            'accounts': [],
-            'accounts_highlights': [],
-            'accounts_income_statement': [],
-            'accounts_balance_sheet': [],
-            'company': [],
-            'accounts_type': [],
-        }
-
-        if res and len(res) > 0:
-            self.ok_responses += 1
-            for year in res:
-                for key in data:
-                    if key not in ["company", 'accounts_type']:
-                        self.logger.debug(f'Adding data {key}')
-                        sub_data = year.get(key)
-                        sub_data["org_nr"] = int(orgnr)
-                        data.get(key).append(sub_data)
-
-            for key in ["company", 'accounts_type']:
-                self.logger.debug(f'Adding data {key}')
-                sub_data = res[0].get(key)
-                sub_data["org_nr"] = int(orgnr)
-                data.get(key).append(sub_data)
-            return data
-        else:
+        data = {key: [] for key in self.ACCOUNTS_TABLES}
+        if not res:
             self.fail_responses += 1
             return data
+        self.ok_responses += 1
+        org_nr = int(orgnr)
+        for key in self.ACCOUNTS_TABLES:
+            source = res[:1] if key in self._LATEST_ONLY else res
+            data[key] = [{**doc[key], 'org_nr': org_nr} for doc in source if doc.get(key) is not None]
+        return data
 
 class RateLimitException(Exception):
     """Custom exception for API rate limiting errors (HTTP 429)."""
     pass
 
-class BRREGapi:
+class Response:
+    '''
+    Status, headers and body of a finished request. The body is read before the connection is released,
+    so the socket is back in the pool before the caller starts parsing.
+    `json()` and `text()` are async to match aiohttp.ClientResponse.
+    '''
+    def __init__(self, url: str, status: int, headers, body: bytes):
+        self.url = url
+        self.status = status
+        self.headers = headers
+        self.body = body
 
-    def __init__(self, logger : Logger = None):
+    async def json(self):
+        return _loads(self.body) if self.body else None
+
+    async def text(self) -> str:
+        return self.body.decode('utf-8', errors='replace')
+
+class BRREGapi:
+    # Søket gir ikke treff lenger ut enn (page + 1) * size <= PAGING_CAP
+    PAGING_CAP = 10000
+    REGISTER_START = date(1800, 1, 1)
+
+    def __init__(self,
+                 logger : Logger = None,
+                 limiter : AdaptiveRateLimiter = None,
+                 connection_limit : int = 200,
+                 timeout : aiohttp.ClientTimeout = None,
+                 sink : Sink = None,
+                 max_pending_writes : int = 2,
+                 fingerprints : FingerprintIndex = None,
+                 cache : ResponseCache = None,
+                 metrics : Metrics = None,
+                 seen : SeenSet = None,
+                 memory_limit : int = 256 * 2 ** 20,
+                 spill_dir : str = None):
+        '''
+        :param logger: Optional Logger
+        :param limiter: Optional AdaptiveRateLimiter. All requests made by this client share it
+        :param connection_limit: Max number of pooled connections (BRREG is a single host, so this is also the per host limit)
+        :param timeout: Optional aiohttp.ClientTimeout. Defaults to 60s total, 10s connect and 30s read
+        :param sink: Where the data is saved, e.g. `LocalSink` for offline runs. Defaults to BigQuery
+        :param max_pending_writes: Max number of batches queued for the background writer before the fetchers wait
+        :param fingerprints: Optional FingerprintIndex. Rows that have not changed since they were last saved are skipped
+        :param cache: Optional ResponseCache. Makes reruns after a crash read finished responses from disk
+        :param metrics: Optional Metrics, e.g. one shared with an EninApi. A new one is made if None
+        :param seen: Optional SeenSet. Org numbers already saved for a table in this crawl window are not fetched again
+        :param memory_limit: Bytes of fetched data a call that returns its result keeps in memory before the batches are
+            spilled to disk. The cap holds with as_frame=False; the default DataFrame result is built whole at the end
+        :param spill_dir: Folder for the spilled batches. The system temp folder if None
+        '''
+        load_env()
         self._base_url = "https://data.brreg.no/enhetsregisteret/api/enheter"
+        self._bulk_url = "https://data.brreg.no/enhetsregisteret/api/enheter/lastned"
+        self._regnskap_url = "https://data.brreg.no/regnskapsregisteret/regnskap"
+        self._updates_url = "https://data.brreg.no/enhetsregisteret/api/oppdateringer/enheter"
         if not logger:
             logger = Logger('brregAPI','a')
         self.logger = logger
         self._headers = {
-            'accept': 'application/json'
+            'accept': 'application/json',
+            'accept-encoding': 'gzip, deflate, br' if brotli else 'gzip, deflate',
         }
+        self._connection_limit = connection_limit
+        self._timeout = timeout or aiohttp.ClientTimeout(total=60, connect=10, sock_read=30)
         self._session = None
-        self._bq = BigQuery(logger = logger)
+        self.metrics = metrics or Metrics()
+        self.sink = sink or BigQuerySink(logger=logger)
+        self.writer = BackgroundWriter(self.sink, max_pending=max_pending_writes, logger=logger, metrics=self.metrics)
+        self.fingerprints = fingerprints
+        self.cache = cache
+        self.seen = seen
+        self.memory_limit = memory_limit
+        self.spill_dir = spill_dir
+        # Kall som er i gang, per (url, params), så like kall samtidig deler ett svar
+        self._in_flight = {}
+        self._bq_client = None
+        self.limiter = limiter or AdaptiveRateLimiter()
+        self.metrics.set_gauge('limiter_rate', lambda: self.limiter.rate)
+        self.metrics.set_gauge('limiter_concurrency', lambda: self.limiter.concurrency)
+        self.metrics.set_gauge('requests_in_flight', lambda: self.limiter._in_flight)
         self.logger.set_level('INFO')
 
 
+    @property
+    def _bq(self) -> BigQuery:
+        '''
+        BigQuery client for the fill_* queries. Created on first use, and shared with the sink if it writes to BigQuery.
+        '''
+        if isinstance(self.sink, BigQuerySink):
+            return self.sink.bq
+        if self._bq_client is None:
+            self._bq_client = BigQuery(logger=self.logger)
+        return self._bq_client
+
     def _ensure_fieldnames(self,df):
-        new_cols = []
-        for col in df.columns:
-            new_cols.append(col.replace('.', '_',))
-        df.columns = new_cols
+        df.columns = df.columns.str.replace('.', '_', regex=False)
         if list(df.columns).count('virksomhet_organisasjonsnummer')>1:
             self.logger.error(f'Duplicate columns found: {df.columns}')
             raise ValueError(f"Duplicate columns found: {df.columns}")
     async def _ensure_session(self):
         if self._session is None or self._session.closed:
-            self._session = aiohttp.ClientSession(headers=self._headers)
+            connector = aiohttp.TCPConnector(limit=self._connection_limit,
+                                             limit_per_host=self._connection_limit,
+                                             use_dns_cache=True,
+                                             ttl_dns_cache=300,
+                                             keepalive_timeout=30,
+                                             enable_cleanup_closed=True)
+            self._session = aiohttp.ClientSession(headers=self._headers,
+                                                  connector=connector,
+                                                  timeout=self._timeout)
         return self._session
     async def close(self):
-        if self._session and not self._session.closed:
-            await self._session.close()
+        '''
+        Waits for the queued writes and closes the session.
+        '''
+        try:
+            await asyncio.to_thread(self.writer.close)
+        finally:
+            if self.fingerprints is not None:
+                self.logger.info(f"Fingerprints: {self.fingerprints}")
+            if self.cache is not None:
+                self.logger.info(f"Response cache: {self.cache}")
+            if self.seen is not None:
+                self.logger.info(f"Seen: {self.seen}")
+            self.logger.info(f"Metrics: {self.metrics.summary()}")
+            if self._session and not self._session.closed:
+                await self._session.close()
     async def _reset_session(self):
         if self._session:
             await self._session.close()
         self._session = None
         return await self._ensure_session()
 
-    async def _request(self, url: str, params: dict = None) -> aiohttp.ClientResponse | None:
+    async def _request(self, url: str, params: dict = None, use_cache: bool = True) -> Response | None:
         """
-        Utfører et nettverkskall og returnerer hele respons-objektet.
-        Håndterer kun generelle tilkoblingsfeil.
+        Som `_send`, men like kall (samme url og params) som gjøres mens et er i gang, venter på det og får samme
+        `Response` i stedet for å gå ut på nettet selv. Teller slike i `http_coalesced_total`.
         """
-        try:
-            session = await self._ensure_session()
-            return await session.get(url, headers=self._headers, params=params)
-        except Exception as e:
-            self.logger.error(f"Tilkoblingsfeil for URL {url}: {e}")
-            return None
+        key = (url, tuple(sorted((params or {}).items())), use_cache)
+        task = self._in_flight.get(key)
+        if task is not None:
+            self.metrics.inc('http_coalesced_total', endpoint=endpoint_of(url))
+        else:
+            task = asyncio.ensure_future(self._send(url, params, use_cache))
+            self._in_flight[key] = task
+            task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        # shield: en kansellert venter skal ikke kansellere kallet de andre venter på
+        return await asyncio.shield(task)
 
-    def save_bq(self,df,key_col,table,dataset):
+    async def _send(self, url: str, params: dict = None, use_cache: bool = True) -> Response | None:
+        """
+        Utfører et nettverkskall og returnerer status, headers og body som en `Response`.
+        Body leses ferdig før tilkoblingen slippes tilbake til poolen.
+        Alle kall går gjennom `self.limiter`. Ved 429, 502-504 og tilkoblingsfeil gir kallet fra seg plassen sin og
+        settes i kø igjen etter backoff (minst `Retry-After`). Etter `limiter.max_retries` forsøk returneres siste
+        respons, eller None ved tilkoblingsfeil.
+        Med `self.cache` returneres ferske svar fra disk uten kall, og eldre svar sjekkes med
+        If-None-Match/If-Modified-Since, slik at et uendret svar bare koster en 304. `use_cache=False` brukes for
+        svar som endrer seg, som oppdateringsfeeden og søkesidene i `iter_by_nace_geo`.
+        """
+        cache = self.cache if use_cache else None
+        cached = cache.get(url, params) if cache is not None else None
+        if cached is not None and cached.fresh:
+            cache.hit()
+            self.metrics.inc('http_cache_total', endpoint=endpoint_of(url), result='hit')
+            return Response(url, cached.status, cached.headers, cached.body)
+        headers = cached.conditional_headers if cached is not None else None
+
+        limiter = self.limiter
+        for attempt in range(limiter.max_retries + 1):
+            response = None
+            retry_after = None
+            async with limiter.slot():
+                start = time.perf_counter()
+                try:
+                    session = await self._ensure_session()
+                    async with session.get(url, params=params, headers=headers) as resp:
+                        body = await resp.read()
+                        response = Response(str(resp.url), resp.status, resp.headers, body)
+                except Exception as e:
+                    error = e
+                    limiter.on_error()
+                self.metrics.request(url, response.status if response is not None else 'error',
+                                     time.perf_counter() - start, len(response.body) if response is not None else 0)
+
+            if response is not None:
+                if response.status == 304 and cached is not None:
+                    limiter.on_success()
+                    cache.revalidated(cached)
+                    self.metrics.inc('http_cache_total', endpoint=endpoint_of(url), result='revalidated')
+                    return Response(url, cached.status, cached.headers, cached.body)
+                if response.status not in RETRY_STATUSES:
+                    limiter.on_success()
+                    if cache is not None:
+                        cache.miss()
+                        cache.put(url, params, response.status, response.headers, response.body)
+                    return response
+                retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                if response.status == 429:
+                    limiter.on_throttle(retry_after)
+                else:
+                    limiter.on_error()
+                error = f'status {response.status}'
+
+            if attempt == limiter.max_retries:
+                limiter.counters['give_ups'] += 1
+                self.logger.error(f"Giving up on URL {url} after {attempt + 1} attempts: {error} | {limiter}")
+                return response
+            limiter.counters['retries'] += 1
+            self.metrics.inc('http_retries_total', endpoint=endpoint_of(url))
+            delay = limiter.backoff(attempt, retry_after)
+            self.logger.debug(f"Retrying URL {url} in {delay:.1f}s ({error}) | {limiter}")
+            await asyncio.sleep(delay)
+
+    def _flatten(self, records: list[dict], stage: str = 'brreg') -> pd.DataFrame:
+        '''
+        Flattens a batch of raw json records into one DataFrame in a single pass.
+        Nested objects become `parent_child` columns, the same names `_ensure_fieldnames` gives `pd.json_normalize`.
+        :param records: The records
+        :param stage: Label for the transform time in `self.metrics`
+        '''
+        with self.metrics.timer('transform_seconds', stage=stage):
+            df = pd.json_normalize(records, sep='_')
+            self._ensure_fieldnames(df)
+        return df
+
+    def _prep_company_data(self, df):
+        self._ensure_fieldnames(df)
+        df['country'] = 'NO'
+        df["fetch_date"] = pd.Timestamp.now()
+        return df
+
+    async def save_bq(self,df,key_col,table,dataset,if_exists='append'):
+        '''
+        Casts the DataFrame to the declared schema of `dataset.table` (see `src.schemas`) and queues it for
+        `self.writer`, which writes it to `self.sink` on a worker thread while fetching goes on.
+        Waits without blocking the event loop if the writer is `max_pending_writes` batches behind.
+        With a fingerprint index only the rows of new or changed keys are written, and their hashes are stored once
+        the write has succeeded. With a SeenSet the keys are added to it for `dataset.table` once they are written.
+        :param df: DataFrame to save
+        :param key_col: Rows without this column are dropped. Also the key with if_exists='merge' or 'replace_keys'
+        :param table: Table name
+        :param dataset: Dataset name
+        :param if_exists: 'append', 'replace', 'merge' or 'replace_keys'
+        '''
         df = df.dropna(subset=[key_col])
         if df.empty:
             self.logger.warning("DataFrame er tom etter fjerning av NaN-verdier")
             return df
+        schema = get_schema(dataset, table)
+        explicit_schema = None
+        if schema:
+            with self.metrics.timer('transform_seconds', stage=f'cast.{dataset}.{table}'):
+                df = schema.cast(df)
+            explicit_schema = schema.bq_schema(df)
+        self.metrics.inc('records_total', len(df), table=f'{dataset}.{table}')
+        on_done = None
+        keys = df[key_col].astype(str).unique() if self.seen is not None else None
+        if self.fingerprints is not None and if_exists != 'replace':
+            df, pending = self.fingerprints.split(df, table, dataset, [key_col])
+            if df.empty:
+                if keys is not None:
+                    self.seen.add(f'{dataset}.{table}', keys)
+                return df
+            on_done = partial(self.fingerprints.commit, pending)
+        if keys is not None:
+            on_done = partial(self._on_saved, on_done, f'{dataset}.{table}', keys)
         self.logger.debug(f"DataFrame før BigQuery-lagring:\n{df.head()}")
-        self.logger.debug(f"Kolonner: {df.columns.tolist()}")
         self.logger.debug(f"Datatyper:\n{df.dtypes}")
-        self._bq.to_bq(df, table, dataset, if_exists='append')
+        await self.writer.submit(df, table, dataset,
+                                 if_exists=if_exists,
+                                 merge_on=[key_col] if if_exists in ('merge', 'replace_keys') else None,
+                                 explicit_schema=explicit_schema,
+                                 on_done=on_done)
+
+    def _on_saved(self, on_done, job: str, keys):
+        if on_done is not None:
+            on_done()
+        self.seen.add(job, keys)
+
+    def _unseen(self, job: str, org_nums):
+        # Uten SeenSet hentes alt, med SeenSet bare det jobben ikke har lagret i vinduet
+        return org_nums if self.seen is None else self.seen.filter(job, org_nums)
+
+    async def _iter_fetch(self,
+                          job: str,
+                          fetch,
+                          prep,
+                          org_nums,
+                          concurrency: int,
+                          batch_size: int,
+                          failures: set = None,
+                          use_seen: bool = True):
+        '''
+        Runs `fetch` for every org number not yet saved for `job` (every org number if `use_seen` is False) and yields
+        `prep(records)` for every `batch_size` organisations with a result. Only the batch being filled is held in memory.
+        '''
+        records = []
+        processed = 0
+        # Organisasjoner med svar (eller 404) siden forrige batch. Roller gir flere rader per organisasjon
+        batched = 0
+        source = self._unseen(job, org_nums) if use_seen else org_nums
+        async for orgnr, result in imap_bounded(fetch, source, concurrency):
+            processed += 1
+            if isinstance(result, Exception):
+                self.logger.error(f'Task error for orgnr {orgnr}: {result}')
+            elif result:
+                if isinstance(result, list):
+                    records.extend(result)
+                else:
+                    records.append(result)
+                batched += 1
+            if isinstance(result, Exception) or not result:
+                self.metrics.item(job, 'failed')
+                if failures is not None:
+                    failures.add(str(orgnr))
 
-    async def get_companies(self, org_nums: list,save_bq = False) -> pd.DataFrame|None:
-        data_frames = []
-        SAVE_INTERVAL = 5000
-        BATCH_SIZE = 200
-        base_url = "https://data.brreg.no/enhetsregisteret/api/enheter/"
+            if processed % 1000 == 0:
+                self.logger.info(f"Processed {processed} organizations | {self.metrics.progress(job)} | {self.limiter}")
 
-        async def fetch_single(orgnr):
-            response = await self._request(base_url + str(orgnr))
-            if not response:
-                return None
+            if batched >= batch_size:
+                batch, records, batched = records, [], 0
+                yield prep(batch)
 
-            if response.status == 200:
-                data = await response.json()
-                return pd.json_normalize(data)
-            else:
-                error_text = await response.text()
-                self.logger.error(
-                    f'Error message - {inspect.currentframe().f_code.co_name}: orgnr {orgnr}, {response.status}, {error_text}')
+        if records:
+            yield prep(records)
+        self.logger.info(f"Fetched {processed} organizations | {self.metrics.progress(job)} | {self.metrics}")
 
-        for i in range(0, len(org_nums), BATCH_SIZE):
-            batch_orgs = org_nums[i:i + BATCH_SIZE]
-            tasks = [fetch_single(orgnr) for orgnr in batch_orgs]
-            self.logger.debug(f'Fetching batch: {batch_orgs[:10]}..Truncated')
+    async def _collect(self, batches, save, as_frame: bool):
+        '''
+        Saves every batch from `batches` with `save`, or gathers them in a SpillFrame if `save` is None.
+        :return: None when saving, else a DataFrame, or the SpillFrame itself if `as_frame` is False
+        '''
+        result = None if save else self._spill()
+        async for df in batches:
+            if df is None or df.empty:
+                continue
+            if save:
+                await save(df)
+            else:
+                result.append(df)
+        if save:
+            await self.writer.wait()
+            return None
+        if not as_frame:
+            return result
+        with result:
+            return result.to_pandas()
+
+    def _spill(self) -> SpillFrame:
+        return SpillFrame(memory_limit=self.memory_limit, spill_dir=self.spill_dir, logger=self.logger)
+
+    def iter_companies(self,
+                       org_nums: list | OrgNumbers,
+                       concurrency: int = 200,
+                       batch_size: int = 5000,
+                       failures: set = None,
+                       use_seen: bool = True) -> AsyncIterator[pd.DataFrame]:
+        '''
+        Fetches one organisation per request from `/enheter/{orgnr}` and yields a `brreg.company_data` DataFrame per
+        `batch_size` organisations, so a caller can save or process a run of any size in bounded memory.
+        :param org_nums: Organisation numbers, e.g. an OrgNumbers
+        :param concurrency: Max number of requests in flight
+        :param batch_size: Organisations per yielded DataFrame
+        :param failures: Optional set the org numbers that could not be fetched are added to
+        :param use_seen: Skip org numbers the SeenSet has. False fetches all, e.g. to refresh changed organisations
+        :return: Async iterator of DataFrames
+        '''
+        return self._iter_fetch('brreg.company_data', self._fetch_company,
+                                lambda batch: self._prep_company_data(self._flatten(batch, 'brreg.company_data')),
+                                org_nums, concurrency, batch_size, failures, use_seen)
+
+    async def get_companies(self,
+                            org_nums: list | OrgNumbers,
+                            save_bq = False,
+                            concurrency: int = 200,
+                            if_exists: Literal['append', 'merge'] = 'append',
+                            failures: set = None,
+                            as_frame: bool = True,
+                            use_seen: bool = True) -> pd.DataFrame | SpillFrame | None:
+        '''
+        Fetches one organisation per request from `/enheter/{orgnr}`. Use `get_companies_bulk` for the whole register.
+        :param org_nums: Organisation numbers, e.g. an OrgNumbers
+        :param save_bq: Save to `brreg.company_data` every 5000 companies
+        :param concurrency: Max number of requests in flight
+        :param if_exists: 'append', or 'merge' to upsert on organisasjonsnummer
+        :param failures: Optional set the org numbers that could not be fetched are added to
+        :param as_frame: If False, return the SpillFrame the batches were gathered in. The default builds one DataFrame
+            of the whole result, which is not bounded by `memory_limit`
+        :param use_seen: Skip org numbers the SeenSet has. False fetches all, e.g. to refresh changed organisations
+        :return: DataFrame or SpillFrame if save_bq is False, else None
+        '''
+        async def save(df):
+            await self.save_bq(df, 'organisasjonsnummer', table='company_data', dataset='brreg', if_exists=if_exists)
 
-            batch_results = await asyncio.gather(*tasks, return_exceptions=True)
+        return await self._collect(self.iter_companies(org_nums, concurrency, failures=failures, use_seen=use_seen),
+                                   save if save_bq else None, as_frame)
 
-            batch_results = [result for result in batch_results if result is not None and ((hasattr(result, 'empty') and not result.empty))]
-            data_frames.extend(batch_results)
+    async def download_bulk(self, path: str = None, fmt: Literal["json", "csv"] = "json") -> str:
+        '''
+        Streams the full register dump from `/enheter/lastned` to a local gzip file in chunks.
+        :param path: Where to store the file. A temporary file is created if None
+        :param fmt: "json" or "csv"
+        :return: The path of the downloaded file
+        '''
+        url = self._bulk_url if fmt == "json" else f"{self._bulk_url}/csv"
+        accept = "application/vnd.brreg.enhetsregisteret.enhet.v2+gzip;charset=UTF-8" if fmt == "json" else "text/csv"
+        if path is None:
+            path = tempfile.NamedTemporaryFile(prefix='enheter_', suffix=f'.{fmt}.gz', delete=False).name
+
+        session = await self._ensure_session()
+        self.logger.info(f"Downloading bulk file from {url} to {path}")
+        size = 0
+        async with session.get(url,
+                               headers={'accept': accept},
+                               timeout=aiohttp.ClientTimeout(total=None, connect=30, sock_read=300)) as response:
+            if response.status != 200:
+                error_text = await response.text()
+                raise ValueError(f"Could not download bulk file from {url}. Error: {response.status}, {error_text}")
+            with open(path, 'wb') as f:
+                async for chunk in response.content.iter_chunked(1 << 20):
+                    f.write(chunk)
+                    size += len(chunk)
+        self.logger.info(f"Downloaded {size / 1e6:.1f} MB to {path}")
+        return path
+
+    async def get_companies_bulk(self,
+                                 source: str = None,
+                                 fmt: Literal["json", "csv"] = "json",
+                                 save_interval: int = 50000,
+                                 save_bq=False,
+                                 as_frame: bool = True) -> pd.DataFrame | SpillFrame | None:
+        '''
+        Loads the whole register from the bulk dump instead of one request per organisation.
+        The file is parsed incrementally, so only `save_interval` records are held in memory at a time.
+        The data has the same shape as `get_companies` and is merged into `brreg.company_data` on `organisasjonsnummer`.
+        Use `get_companies` for small ad-hoc lists of org numbers.
+        :param source: Path to a local dump (gzip or plain). The latest dump is downloaded if None
+        :param fmt: "json" or "csv"
+        :param save_interval: Number of records per batch
+        :param save_bq: Save each batch to BigQuery. If False, all batches are returned as one DataFrame
+        :param as_frame: If False, return the SpillFrame the batches were gathered in. The default builds one DataFrame
+            of the whole result, which is not bounded by `memory_limit`
+        :return: DataFrame or SpillFrame if save_bq is False, else None
+        '''
+        downloaded = source is None
+        if downloaded:
+            source = await self.download_bulk(fmt=fmt)
 
-            if len(data_frames) >= SAVE_INTERVAL:
-                df = pd.concat(data_frames, ignore_index=True)
-                self._ensure_fieldnames(df)
-                df['country'] = 'NO'
-                df["fetch_date"] = pd.Timestamp.now()
+        starttime = datetime.now()
+        total = 0
+        data_frames = self._spill()
+        try:
+            for batch in iter_batches(iter_bulk_records(source, fmt=fmt), save_interval):
+                df = self._prep_company_data(self._flatten(batch, 'brreg.bulk'))
+                total += len(df)
                 if save_bq:
-                    self.save_bq(df,'organisasjonsnummer',table='companies',dataset='brreg')
-                data_frames = []
-
-            if save_bq and data_frames:
-                if len(data_frames)>1:
-                    df = pd.concat(data_frames, ignore_index=True)
-                elif len(data_frames)==1:
-                    df = data_frames[0]
+                    await self.save_bq(df, 'organisasjonsnummer', table='company_data', dataset='brreg', if_exists='merge')
+                    self.logger.info(f"Processed {total} organizations so far | writer: {self.writer}")
                 else:
-                    raise ValueError("no data frames")
-                self._ensure_fieldnames(df)
-                df['country'] = 'NO'
-                df["fetch_date"] = pd.Timestamp.now()
-                if 'paategninger' in df.columns:
-                    df['paategninger'] = df['paategninger'].astype(str)
-                self.logger.info(f"Processed {len(data_frames)} organizations so far")
-                self.save_bq(df, 'organisasjonsnummer', table='company_data', dataset='brreg')
-
-    async def get_financial_data(self, org_nums: list,save_bq=False) -> list[pd.DataFrame] | None:
-        saved_frames = []
-        data_frames = []
-
-        SAVE_INTERVAL = 5000
-        BATCH_SIZE = 200
-        count = 0
-        count_ok = 0
-        count_fail = 0
-        base_url = 'https://data.brreg.no/regnskapsregisteret/regnskap/'
-
-        async def fetch_single(orgnr) -> pd.DataFrame | None:
-            nonlocal count,count_ok,count_fail
-            count += 1
-
-            if count % 1000==0:
-                self.logger.info(f"Processed {count} organizations. {count_ok} OK, {count_fail} failed")
-        #
-            self.logger.debug(f"Henter data fra: {base_url + str(orgnr)}")
-
-            response = await self._request(base_url + str(orgnr))
-            if response is None:
-                return None
+                    data_frames.append(df)
+            if save_bq:
+                await self.writer.wait()
+        finally:
+            if downloaded:
+                os.remove(source)
+
+        self.logger.info(f'Bulk load completed in {datetime.now() - starttime}, got {total} companies')
+        if not save_bq:
+            if not as_frame:
+                return data_frames
+            with data_frames:
+                return data_frames.to_pandas()
+
+    def iter_financial_data(self,
+                            org_nums: list | OrgNumbers,
+                            concurrency: int = 200,
+                            batch_size: int = 5000,
+                            failures: set = None,
+                            use_seen: bool = True) -> AsyncIterator[pd.DataFrame]:
+        '''
+        Fetches the latest annual accounts of each organisation from the Regnskapsregisteret and yields a
+        `brreg.financial` DataFrame per `batch_size` organisations.
+        Organisations without accounts (404) are kept with only their org number.
+        :param org_nums: Organisation numbers, e.g. an OrgNumbers
+        :param concurrency: Max number of requests in flight
+        :param batch_size: Organisations per yielded DataFrame
+        :param failures: Optional set the org numbers that could not be fetched are added to
+        :param use_seen: Skip org numbers the SeenSet has. False fetches all, e.g. to refresh changed organisations
+        :return: Async iterator of DataFrames
+        '''
+        return self._iter_fetch('brreg.financial', self._fetch_financial, self._prep_financial,
+                                org_nums, concurrency, batch_size, failures, use_seen)
+
+    async def get_financial_data(self,
+                                 org_nums: list | OrgNumbers,
+                                 save_bq=False,
+                                 concurrency: int = 200,
+                                 failures: set = None,
+                                 as_frame: bool = True,
+                                 use_seen: bool = True) -> pd.DataFrame | SpillFrame | None:
+        '''
+        Fetches the latest annual accounts of each organisation from the Regnskapsregisteret.
+        Organisations without accounts (404) are kept with only their org number.
+        :param org_nums: Organisation numbers, e.g. an OrgNumbers
+        :param save_bq: Append to `brreg.financial` every 5000 organisations
+        :param concurrency: Max number of requests in flight
+        :param failures: Optional set the org numbers that could not be fetched are added to
+        :param as_frame: If False, return the SpillFrame the batches were gathered in. The default builds one DataFrame
+            of the whole result, which is not bounded by `memory_limit`
+        :param use_seen: Skip org numbers the SeenSet has. False fetches all, e.g. to refresh changed organisations
+        :return: DataFrame or SpillFrame with all fetched accounts if save_bq is False, else None
+        '''
+        async def save(df):
+            await self.save_bq(df, 'virksomhet_organisasjonsnummer', table='financial', dataset='brreg')
+
+        return await self._collect(self.iter_financial_data(org_nums, concurrency, failures=failures, use_seen=use_seen),
+                                   save if save_bq else None, as_frame)
+
+    def iter_roles(self,
+                   org_nums: list | OrgNumbers,
+                   concurrency: int = 200,
+                   batch_size: int = 2000,
+                   failures: set = None,
+                   use_seen: bool = True) -> AsyncIterator[pd.DataFrame]:
+        '''
+        Fetches the roles of each organisation from `/enheter/{orgnr}/roller` and yields a `brreg.roles` DataFrame,
+        one row per role, per `batch_size` organisations.
+        :param org_nums: Organisation numbers, e.g. an OrgNumbers
+        :param concurrency: Max number of requests in flight
+        :param batch_size: Organisations per yielded DataFrame
+        :param failures: Optional set the org numbers that could not be fetched are added to
+        :param use_seen: Skip org numbers the SeenSet has. False fetches all, e.g. to refresh changed organisations
+        :return: Async iterator of DataFrames
+        '''
+        return self._iter_fetch('brreg.roles', self._fetch_roles, self._prep_roles,
+                                org_nums, concurrency, batch_size, failures, use_seen)
+
+    async def get_roles(self,
+                        org_nums: list | OrgNumbers,
+                        save_bq = False,
+                        concurrency: int = 200,
+                        if_exists: Literal['append', 'replace_keys'] = 'append',
+                        failures: set = None,
+                        as_frame: bool = True,
+                        use_seen: bool = True) -> pd.DataFrame | SpillFrame | None:
+        '''
+        Fetches the roles of each organisation from `/enheter/{orgnr}/roller`, one row per role.
+        :param org_nums: Organisation numbers, e.g. an OrgNumbers
+        :param save_bq: Save to `brreg.roles` every 2000 organisations
+        :param concurrency: Max number of requests in flight
+        :param if_exists: 'append', or 'replace_keys' to replace all stored roles of the fetched organisations
+        :param failures: Optional set the org numbers that could not be fetched are added to
+        :param as_frame: If False, return the SpillFrame the batches were gathered in. The default builds one DataFrame
+            of the whole result, which is not bounded by `memory_limit`
+        :param use_seen: Skip org numbers the SeenSet has. False fetches all, e.g. to refresh changed organisations
+        :return: DataFrame or SpillFrame if save_bq is False, else None
+        '''
+        async def save(df):
+            await self.save_bq(df, 'organisasjonsnummer', table='roles', dataset='brreg', if_exists=if_exists)
 
-            if response.status == 200:
-                count_ok += 1
-                data = await response.json()
-                if data and len(data) > 0:
-                    return pd.json_normalize(data[0])
-                else:
-                    self.logger.info(f'No data found for orgnr {orgnr}')
-                    self.logger.info(f'Data is empty: {data}')
-                    return None
-                    # return pd.DataFrame([{'virksomhet_organisasjonsnummer_empty': str(orgnr), }])
-            elif response.status == 404 and orgnr:
-                count_fail += 1
-                self.logger.debug(
-                    f'No data found for orgnr {orgnr} with status code {response.status}. Adding {orgnr} with no financial data')
-                return pd.DataFrame([{'virksomhet_organisasjonsnummer_empty': str(orgnr), }])
-
-            elif response.status == 500 and 'Regnskapet inneholder en oppstillingsplan som ikke er stottet' in response.text():
-                count_fail += 1
-                self.logger.debug(
-                    f'No data found for orgnr {orgnr} with status code {response.status}. Adding {orgnr} with no financial data')
-                return pd.DataFrame([{'virksomhet_organisasjonsnummer_empty': str(orgnr), }])
+        return await self._collect(self.iter_roles(org_nums, concurrency, failures=failures, use_seen=use_seen),
+                                   save if save_bq else None, as_frame)
+
+    async def _fetch_company(self, orgnr) -> dict | None:
+        response = await self._request(f'{self._base_url}/{orgnr}')
+        if not response:
+            return None
+
+        if response.status == 200:
+            self.metrics.item('brreg.company_data', 'ok')
+            return await response.json()
+        else:
+            error_text = await response.text()
+            self.logger.error(f'Error message - get_companies: orgnr {orgnr}, {response.status}, {error_text}')
+
+    async def _fetch_financial(self, orgnr) -> dict | None:
+        self.logger.debug(f"Henter data fra: {self._regnskap_url}/{orgnr}")
+
+        response = await self._request(f'{self._regnskap_url}/{orgnr}')
+        if response is None:
+            return None
+
+        if response.status == 200:
+            data = await response.json()
+            if data and len(data) > 0:
+                self.metrics.item('brreg.financial', 'ok')
+                return data[0]
             else:
-                error_text = await response.text()
-                self.logger.error(
-                    f'Could not get data for orgnr {orgnr}. Error: {response.status}, {error_text} | Function: {inspect.currentframe().f_code.co_name}')
+                self.logger.info(f'No data found for orgnr {orgnr}')
+                self.logger.info(f'Data is empty: {data}')
                 return None
+                # return pd.DataFrame([{'virksomhet_organisasjonsnummer_empty': str(orgnr), }])
+        elif response.status == 404 and orgnr:
+            self.metrics.item('brreg.financial', 'no_accounts')
+            self.logger.debug(
+                f'No data found for orgnr {orgnr} with status code {response.status}. Adding {orgnr} with no financial data')
+            return {'virksomhet': {'organisasjonsnummer': str(orgnr)}}
+
+        elif response.status == 500 and 'Regnskapet inneholder en oppstillingsplan som ikke er stottet' in await response.text():
+            self.metrics.item('brreg.financial', 'no_accounts')
+            self.logger.debug(
+                f'No data found for orgnr {orgnr} with status code {response.status}. Adding {orgnr} with no financial data')
+            return {'virksomhet': {'organisasjonsnummer': str(orgnr)}}
+        else:
+            error_text = await response.text()
+            self.logger.error(
+                f'Could not get data for orgnr {orgnr}. Error: {response.status}, {error_text} | Function: get_financial_data')
+            return None
 
-            # try:
-            #     session = await self._ensure_session()
-            #     async with session.get(url, headers=self._headers) as response:
-            #         reponse_text = await response.text()
-            #
-            #
-            # except Exception as e:
-            #     tb = traceback.format_exc()  # Hent full stack trace
-            #     self.logger.error(f"Stack trace: {tb}")  # Logg stack trace
-            #     self.logger.error(f"Error processing orgnr {orgnr}: {e} | Function: {inspect.currentframe().f_code.co_name}")
-            #     return None
-
-        def prep_save(frames):
-            if not frames:
-                self.logger.info('No data frames to save')
-                return None
+    def _prep_financial(self, batch: list[dict]) -> pd.DataFrame | None:
+        if not batch:
+            self.logger.info('No data frames to save')
+            return None
 
-            df_to_save = pd.concat(data_frames, ignore_index=True)
-            self._ensure_fieldnames(df_to_save)
-            df_to_save["fetch_date"] = pd.Timestamp.now()
-            if 'virksomhet_organisasjonsnummer_empty' in df_to_save.columns:
-                df_to_save['virksomhet_organisasjonsnummer'] = df_to_save['virksomhet_organisasjonsnummer_empty'].fillna(
-                    df_to_save['virksomhet_organisasjonsnummer'])
-                df_to_save.drop('virksomhet_organisasjonsnummer_empty', axis=1, inplace=True)
-            return df_to_save
-
-        for i in range(0, len(org_nums), BATCH_SIZE):
-            batch_orgs = org_nums[i:i + BATCH_SIZE]
-            batch_results = await asyncio.gather(*[fetch_single(orgnr) for orgnr in batch_orgs],return_exceptions=True)
-
-            batch_results = [result for result in batch_results if result is not None and ((hasattr(result, 'empty') and not result.empty))]
-            data_frames.extend(batch_results)
-            saved_frames.extend(batch_results)
-
-            if save_bq and count % SAVE_INTERVAL == 0:
-                data_frames = prep_save(data_frames)
-                self.save_bq(data_frames, 'virksomhet_organisasjonsnummer', table='financial', dataset='brreg')
-
-
-        if save_bq:
-            df = prep_save(data_frames)
-            self.save_bq(df, 'virksomhet_organisasjonsnummer', table='financial', dataset='brreg')
-        return prep_save(saved_frames)
-
-    async def get_roles(self, org_nums: list,save_bq = False) -> pd.DataFrame|None:
-                dataframes = []
-                session = await self._ensure_session()
-                SAVE_INTERVAL = 2000
-                BATCH_SIZE = 200
-                count = 0
-                save_count = 0
-
-                async def fetch_single(orgnr):
-                    nonlocal count,save_count
-                    base = f'https://data.brreg.no/enhetsregisteret/api/enheter/{orgnr}/roller'
-                    response = await self._request(url = base)
-                    if response.status == 200:
-                        df = pd.DataFrame()
-                        res = await response.json()
-                        role_groups = res.get('rollegrupper', [])
-                        if role_groups:
-                            for group in role_groups:
-                                df1 = pd.json_normalize(group['roller'])
-                                df1['organisasjonsnummer'] = orgnr
-                                df = pd.concat([df, df1], ignore_index=True)
-                            count += 1
-                            save_count += 1
-                            self.logger.debug(
-                                f'Got {len(df)} roles for {orgnr}. Count {count} | save_count {save_count}')
-                            return df
-                        else:
-                            self.logger.error(f'No role groups found for {orgnr}')
-                    elif response.status == 404 and orgnr:
-                        count += 1
-                        save_count += 1
-                        self.logger.debug(
-                            f'No roles {orgnr}. Count {count} | save_count {save_count}. Saved to dataframe')
-                        return pd.DataFrame([{'organisasjonsnummer': str(orgnr), }])
-                    else:
-                        error_text = await response.text()
-                        self.logger.error(
-                            f'Error message - {inspect.currentframe().f_code.co_name}: orgnr {orgnr}, {response.status}, {error_text} | Count {count} | save_count {save_count}')
-
-
-                for i in range(0, len(org_nums), BATCH_SIZE):
-                    batch = org_nums[i:i + BATCH_SIZE]
-                    tasks = [fetch_single(orgnr) for orgnr in batch]
-
-                    res = await asyncio.gather(*tasks, return_exceptions=True)
-
-                    res = [result for result in res if result is not None and ((hasattr(result, 'empty') and not result.empty))]
-                    dataframes.extend(res)
-                    self.logger.debug(f'Fetched {len(res)}. Dataframes {len(dataframes)} Count: {count}')
-
-                    if count % 1000 == 0:
-                        self.logger.info(f"Processed {count} organizations | save_count {save_count} | dataframes: {len(dataframes)}")
-
-                    if save_count >= SAVE_INTERVAL and save_bq:
-                        if dataframes:
-                            df = pd.concat(dataframes, ignore_index=True)
-                            self._ensure_fieldnames(df)
-                            df['country'] = 'NO'
-                            if 'stadfestetFremtidsfullmakt' in df.columns:
-                                df['stadfestetFremtidsfullmakt'] = df['stadfestetFremtidsfullmakt'].astype(str)
-                            if 'begrensetRettsligHandleevne' in df.columns:
-                                df['begrensetRettsligHandleevne'] = df['begrensetRettsligHandleevne'].astype(str)
-                            self.save_bq(df,'organisasjonsnummer',table='roles',dataset='brreg')
-                            dataframes = []
-                            save_count = 0
-
-                if save_bq and dataframes:
-                    df = pd.concat(dataframes, ignore_index=True)
-                    self._ensure_fieldnames(df)
-                    df['country'] = 'NO'
-                    df["fetch_date"] = pd.Timestamp.now()
-                    self.save_bq(df,'organisasjonsnummer',table='roles',dataset='brreg')
+        df_to_save = self._flatten(batch, 'brreg.financial')
+        df_to_save["fetch_date"] = pd.Timestamp.now()
+        return df_to_save
 
-    async def get_by_nace_geo(self,
-                              nace_codes : list = None,
-                              geo_type: Literal["kommune","kommunenummer","postnummer","poststed"] = "kommunenummer",
-                              geo_value : list = None,
-                              batch_size = 200,
-                              save_interval = 50000,
-                              save_bq=False) -> pd.DataFrame | None:
+    async def _fetch_roles(self, orgnr) -> list[dict] | None:
+        base = f'{self._base_url}/{orgnr}/roller'
+        response = await self._request(url = base)
+        if response is None:
+            return None
+        if response.status == 200:
+            res = await response.json()
+            role_groups = res.get('rollegrupper', [])
+            if role_groups:
+                roles = [{**role, 'organisasjonsnummer': str(orgnr)}
+                         for group in role_groups for role in group['roller']]
+                self.metrics.item('brreg.roles', 'ok')
+                self.logger.debug(f'Got {len(roles)} roles for {orgnr}')
+                return roles
+            else:
+                self.logger.error(f'No role groups found for {orgnr}')
+        elif response.status == 404 and orgnr:
+            self.metrics.item('brreg.roles', 'no_roles')
+            self.logger.debug(f'No roles {orgnr}. Saved to dataframe')
+            return [{'organisasjonsnummer': str(orgnr), }]
+        else:
+            error_text = await response.text()
+            self.logger.error(f'Error message - get_roles: orgnr {orgnr}, {response.status}, {error_text}')
+
+    def _prep_roles(self, batch: list[dict]) -> pd.DataFrame:
+        df = self._flatten(batch, 'brreg.roles')
+        df['country'] = 'NO'
+        df["fetch_date"] = pd.Timestamp.now()
+        return df
+
+    async def get_all(self,
+                      org_nums: list | OrgNumbers,
+                      concurrency: int = 200,
+                      failures: set = None) -> dict:
+        '''
+        Fetches company data, accounts and roles of each organisation in one pass, and saves them to
+        `brreg.company_data`, `brreg.financial` and `brreg.roles`. The three requests for an org number are queued
+        together and share one pool of `concurrency` requests in flight, so the run takes about as long as the slowest
+        endpoint instead of the sum of three crawls. Each table is saved at the interval of its own `get_*` function.
+        :param org_nums: Organisation numbers, e.g. an OrgNumbers
+        :param concurrency: Max number of requests in flight over all three endpoints
+        :param failures: Optional set the org numbers that could not be fetched from one or more endpoints are added to
+        :return: Summary with ok, failed and saved rows per table
+        '''
+        starttime = datetime.now()
+        # table: (hent, lagre, nøkkel, lagringsintervall i organisasjoner)
+        endpoints = {
+            'company_data': (self._fetch_company,
+                             lambda batch: self._prep_company_data(self._flatten(batch, 'brreg.company_data')),
+                             'organisasjonsnummer', 5000),
+            'financial': (self._fetch_financial, self._prep_financial, 'virksomhet_organisasjonsnummer', 5000),
+            'roles': (self._fetch_roles, self._prep_roles, 'organisasjonsnummer', 2000),
+        }
+        records = {table: [] for table in endpoints}
+        unsaved = {table: 0 for table in endpoints}
+        summary = {table: {'ok': 0, 'failed': 0, 'rows': 0, 'skipped': 0} for table in endpoints}
+        processed = 0
+        organizations = 0
+
+        def work():
+            nonlocal organizations
+            org_iter = iter(org_nums)
+            while chunk := list(islice(org_iter, 5000)):
+                organizations += len(chunk)
+                todo = {table: set(self._unseen(f'brreg.{table}', chunk)) if self.seen is not None else None
+                        for table in endpoints}
+                for table in endpoints:
+                    if todo[table] is not None:
+                        summary[table]['skipped'] += len(chunk) - len(todo[table])
+                for orgnr in chunk:
+                    for table in endpoints:
+                        if todo[table] is None or str(orgnr) in todo[table]:
+                            yield orgnr, table
+
+        async def fetch(work_item):
+            orgnr, table = work_item
+            return await endpoints[table][0](orgnr)
+
+        async def save(table):
+            _, prep, key_col, _ = endpoints[table]
+            df = prep(records[table])
+            summary[table]['rows'] += len(df)
+            await self.save_bq(df, key_col, table=table, dataset='brreg')
+            records[table] = []
+            unsaved[table] = 0
+
+        async for (orgnr, table), result in imap_bounded(fetch, work(), concurrency):
+            processed += 1
+            if isinstance(result, Exception):
+                self.logger.error(f'Task error for orgnr {orgnr} ({table}): {result}')
+            if isinstance(result, Exception) or not result:
+                summary[table]['failed'] += 1
+                self.metrics.item(f'brreg.{table}', 'failed')
+                if failures is not None:
+                    failures.add(str(orgnr))
+                continue
+            summary[table]['ok'] += 1
+            if table == 'roles':
+                records[table].extend(result)
+            else:
+                records[table].append(result)
+            unsaved[table] += 1
+
+            if processed % 3000 == 0:
+                self.logger.info(f"Processed {processed} requests for {organizations} organizations | "
+                                 + ' | '.join(f'{t} {c["ok"]} ok, {c["failed"]} failed' for t, c in summary.items())
+                                 + f' | {self.limiter}')
+            if unsaved[table] >= endpoints[table][3]:
+                await save(table)
+
+        for table in endpoints:
+            if records[table]:
+                await save(table)
+        await self.writer.wait()
+        elapsed = (datetime.now() - starttime).total_seconds()
+        summary.update(organizations=organizations, seconds=round(elapsed, 1),
+                       organizations_per_s=round(organizations / max(elapsed, 1e-9), 1))
+        self.logger.info(f"Fetched company data, accounts and roles in one pass: {summary} | {self.metrics}")
+        return summary
+
+    async def iter_by_nace_geo(self,
+                               nace_codes: list = None,
+                               geo_type: Literal["kommune","kommunenummer","postnummer","poststed"] = "kommunenummer",
+                               geo_value: list = None,
+                               batch_size = 200,
+                               save_interval = 50000,
+                               page_size: int = 100) -> AsyncIterator[pd.DataFrame]:
         '''
-        Fetches company data based on NACE code or geographical location.
+        Fetches company data based on NACE code or geographical location and yields a `brreg.company_data` DataFrame
+        per `save_interval` companies, so only one batch is held in memory.
         If either one of the parameters is None, it will not be used in the query.
-        The data is transformed to a Pandas DataFrame and exported to Big Query Table `brreg.company_data`
+
+        Each combination is first probed for its hit count (`page.totalElements`). Combinations under the search
+        paging cap (`PAGING_CAP` hits) get all their remaining pages requested in parallel. Larger ones are split in two
+        by registration date (`fraRegistreringsdatoEnhetsregisteret`/`tilRegistreringsdatoEnhetsregisteret`) until
+        every slice fits under the cap, so big combinations are neither fetched as one long chain nor truncated.
+        Pages and probes share one pool of `batch_size` requests in flight.
         :param nace_codes:
         :param geo_type:
         :param geo_value:
-        :param save_bq:
-        :return:
+        :param batch_size: Max number of requests in flight
+        :param save_interval: Companies per yielded DataFrame
+        :param page_size: Companies per search page
+        :return: Async iterator of DataFrames
         '''
 
         self.logger.info("\n \n Starting new session with NACE/GEO funksjon")
@@ -508,179 +1374,390 @@ class BRREGapi:
         if geo_value is not None and not isinstance(geo_value, list):
             geo_value = [geo_value]
 
-        antall_per_side = 100
+        PAGE_SIZE = page_size
         BATCH_SIZE = batch_size
         SAVE_INTERVAL = save_interval
         total_companies = 0
         total_count = 0
-        dataframes = []
-
-        async def fetch_single(nace=None,geo=None)->pd.DataFrame | None:
-            #session = await self._reset_session()
-            companies = []
-            side = 0
-
-            while True:
-                params = {
-                    "page": side,
-                    "size": antall_per_side,
-                    "naeringskode": nace,
-                    f"forretningsadresse.{geo_type}": geo
-                }
-                params = {k: v for k, v in params.items() if v is not None}  # Fjern None-verdier
-
-                #print(params,self._base_url)
-                response =  await self._request(self._base_url, params)
-                if response is None:
-                    return None
-
-                if response.status == 200:
-                    # self.logger.debug(f'Got response 200 for {nace},{geo}')
-                    data = await response.json()
-                    selskaper = data.get("_embedded", {}).get("enheter", [])  # liste av selskaper
-                    if not selskaper:
-                        break
-                    df = pd.json_normalize(selskaper)
-                    df['page'] = side
-                    side += 1
-                    companies.append(df)
-                    self.logger.debug(f'Found {len(df)} for {nace} and {geo} on page {side} and added to companies')
-                elif response.status == 429:
-                    error_text = await response.text()
-                    self.logger.error(f"error code 429 {error_text}")
-                    raise RateLimitException(f"Rate limit exceeded (429) for NACE: {nace}, Geo: {geo}")
-                else:
-                    error_text = await response.text()
-                    self.logger.error(
-                        f'Error message - {inspect.currentframe().f_code.co_name}: nace code {nace}, geo {geo}, {response.status}, {error_text}')
-                    break
-
-                # try:
-                #     async with session.get(self._base_url, params=params) as response:
-                # except Exception as e:
-                #     tb = traceback.format_exc()  # Hent full stack trace
-                #     self.logger.error(f"Stack trace: {tb}")  # Logg stack trace
-                #     self.logger.error(
-                #         f"Error processing nace {nace} and geo {geo} with geotype {geo_type}: {e} | Function: {inspect.currentframe().f_code.co_name}")
-                #     break
-
-            if companies:
-                return pd.concat(companies, ignore_index=True)
+        records = []
+        stats = {'requests': 0, 'splits': 0, 'failed': 0, 'truncated': 0, 'expected': 0, 'duplicates': 0, 'seen': 0}
+        # Selskaper som allerede er med, så overlappende kombinasjoner ikke flates ut og lagres to ganger
+        collected = set()
+
+        def slice_params(nace, geo, dates=None) -> dict:
+            params = {
+                "naeringskode": nace,
+                f"forretningsadresse.{geo_type}": geo,
+            }
+            if dates:
+                params["fraRegistreringsdatoEnhetsregisteret"] = dates[0].isoformat()
+                params["tilRegistreringsdatoEnhetsregisteret"] = dates[1].isoformat()
+            return {k: v for k, v in params.items() if v is not None}  # Fjern None-verdier
+
+        async def fetch_page(params: dict, side: int) -> tuple[list[dict], int] | None:
+            stats['requests'] += 1
+            # Søkesidene og treffene (totalElements) endrer seg når selskaper registreres, så de hentes alltid
+            response = await self._request(self._base_url, {**params, "page": side, "size": PAGE_SIZE},
+                                           use_cache=False)
+            if response is None:
+                return None
+            if response.status == 200:
+                data = await response.json()
+                selskaper = data.get("_embedded", {}).get("enheter", [])  # liste av selskaper
+                for selskap in selskaper:
+                    selskap['page'] = side
+                self.logger.debug(f'Found {len(selskaper)} for {params} on page {side}')
+                return selskaper, data.get("page", {}).get("totalElements", len(selskaper))
+            error_text = await response.text()
+            self.logger.error(
+                f'Error message - get_by_nace_geo: {params}, page {side}, {response.status}, {error_text} | {self.limiter}')
             return None
-        async def process_batch(tasks) -> list[pd.DataFrame]:
-            self.logger.debug('Doing gathering of tasks')
-            results = await asyncio.gather(*tasks,return_exceptions=True)
-            valid = []
-
-            for res in results:
-                if isinstance(res,RateLimitException):
-                    raise res
-                if isinstance(res,Exception):
-                    self.logger.error(f'Task error: {res}')
-                if isinstance(res,pd.DataFrame) and not res.empty:
-                    valid.append(res)
-            self.logger.debug(f'Gathered {len(valid)} dataframes')
-            return valid
-        def prep_save(frames):
-            table = 'company_data'
-            dataset = 'brreg'
-            if not frames:
-                self.logger.info(f'No data frames to save with nace {nace_codes[:10]} and {geo_type} {geo_value}')
-                return []
-            df = pd.concat(frames, ignore_index=True)
+
+        async def fetch_single(work: tuple) -> tuple[list[dict], list[tuple]]:
+            '''
+            One unit of work for the planner. ('probe', nace, geo, dates) fetches the first page of a slice and plans
+            the rest: the other pages if the slice fits under the paging cap, else two halves of its registration
+            date range. ('page', nace, geo, dates, side) fetches one page.
+            '''
+            kind, nace, geo, dates, *side = work
+            params = slice_params(nace, geo, dates)
+            result = await fetch_page(params, side[0] if side else 0)
+            if result is None:
+                stats['failed'] += 1
+                return [], []
+            selskaper, total = result
+            if kind == 'page':
+                return selskaper, []
+
+            if dates is None:
+                stats['expected'] += total
+            if total <= self.PAGING_CAP:
+                pages = -(-total // PAGE_SIZE)
+                return selskaper, [('page', nace, geo, dates, p) for p in range(1, pages)]
+
+            start, end = dates or (self.REGISTER_START, date.today())
+            if start >= end:
+                # En enkelt dag med flere treff enn taket kan ikke deles mer
+                stats['truncated'] += total - self.PAGING_CAP
+                self.logger.error(f'{total} companies for {params} registered on a single day. '
+                                  f'Only the first {self.PAGING_CAP} can be fetched')
+                return selskaper, [('page', nace, geo, dates, p) for p in range(1, self.PAGING_CAP // PAGE_SIZE)]
+            stats['splits'] += 1
+            mid = start + (end - start) // 2
+            self.logger.debug(f'Splitting {params} with {total} companies at {mid}')
+            return [], [('probe', nace, geo, (start, mid)), ('probe', nace, geo, (mid + timedelta(days=1), end))]
+
+        def prep(frames) -> pd.DataFrame:
+            df = self._flatten(frames, 'brreg.nace_geo')
             df = df.drop_duplicates(subset = ["organisasjonsnummer"])
-            self._ensure_fieldnames(df)
-            trouble_columns = [
-                            "paategninger",
-                            #"vedtektsfestetFormaal",
-                            #"aktivitet",
-                            #"forretningsadresse_adresse",
-                            ]
-            for col in trouble_columns:
-                if col in df.columns:
-                    df[col] = df[col].apply(lambda x: str(x))
             df['country'] = 'NO'
-            df['page'] = df['page'].astype(int)
             df["fetch_date"] = pd.Timestamp.now()
-            # orgnrliste = df['organisasjonsnummer'].astype(str).to_list()
-            # if len(orgnrliste) == 1:
-            #     query = f''' SELECT organisasjonsnummer FROM {dataset}.{table}
-            #                 WHERE organisasjonsnummer = '{orgnrliste[0]}'
-            #                 '''
-            # else:
-            #     query = f''' SELECT organisasjonsnummer FROM {dataset}.{table}
-            #                                 WHERE organisasjonsnummer IN {tuple(orgnrliste)}
-            #                                 '''
-            # # self.logger.info(query)
-            # # self.logger.info(f'Fetched {len(df)} companies from nace {nace_codes} and {geo_value}')
-            # overlaping = self._bq.read_bq(query)
-            # df_new = df[~df['organisasjonsnummer'].isin(overlaping)]
-            # if not df_new.empty:
-            #     self.logger.info(
-            #         f"Got {len(df)} companies from API call. Removing {len(overlaping)} that already exists in DB, adding {len(df_new)} new ones.")
-            self._bq.to_bq(df = df,
-                           table_name=table,
-                           dataset_name = dataset,
-                            if_exists='merge',
-                           merge_on = ['organisasjonsnummer']
-                            )
+            return df
 
         starttime = datetime.now()
-        self.logger.info(f"Fetching data for NACE codes: {nace_codes[:10]} and geo_type: {geo_type} with values: {geo_value}")
+        self.logger.info(f"Fetching data for NACE codes: {(nace_codes or [])[:10]} and geo_type: {geo_type} with values: {geo_value}")
 
         combinations = []
         if nace_codes and geo_value:
             for nace in nace_codes:
                 for geo in geo_value:
-                    combinations.append((nace,geo))
+                    combinations.append(('probe', nace, geo, None))
         elif nace_codes:
             for nace in nace_codes:
-                combinations.append((nace,None))
+                combinations.append(('probe', nace, None, None))
         else:
             for geo in geo_value:
-                combinations.append((None,geo))
-
-        for i in range(0,len(combinations),BATCH_SIZE):
+                combinations.append(('probe', None, geo, None))
+
+        async for work, res in imap_expanding(fetch_single, combinations, BATCH_SIZE):
+            if isinstance(res, Exception):
+                stats['failed'] += 1
+                self.logger.error(f'Task error for {work}: {res}')
+                continue
+            if not res:
+                continue
+            fresh = []
+            for selskap in res:
+                orgnr = selskap.get('organisasjonsnummer')
+                if orgnr in collected:
+                    stats['duplicates'] += 1
+                    continue
+                collected.add(orgnr)
+                fresh.append(selskap)
+            if self.seen is not None and fresh:
+                already = self.seen.seen('brreg.company_data', [str(selskap.get('organisasjonsnummer')) for selskap in fresh])
+                stats['seen'] += len(already)
+                fresh = [selskap for selskap in fresh if str(selskap.get('organisasjonsnummer')) not in already]
+            records.extend(fresh)
+            total_companies += len(fresh)
+            self.logger.debug(f'Processed {total_companies} companies so far')
 
-            comb = combinations[i:i+BATCH_SIZE]
-            tasks = [fetch_single(nace,geo) for nace,geo in comb]
-            self.logger.debug(f'fetching combination: {comb}')
+            if total_companies >= SAVE_INTERVAL:
+                batch, records = records, []
+                total_count += total_companies
+                self.logger.info(f"Fetched {total_count} so far... | {stats} | {self.limiter} | writer: {self.writer}")
+                total_companies = 0
+                yield prep(batch)
 
-            batch_df = await process_batch(tasks)
-            dataframes.extend(batch_df)
+        total_count += total_companies
+        if records:
+            yield prep(records)
 
-            total_companies += sum(len(df) for df in batch_df)
-            self.logger.debug(f'Processed {total_companies} companies so far')
+        self.logger.info(f'Task completed in {datetime.now() - starttime}, got {total_count} of {stats["expected"]} companies '
+                         f'in {stats["requests"]} requests | {stats} | {self.limiter}')
+        missing = stats['expected'] - total_count - stats['duplicates'] - stats['seen']
+        if missing > 0:
+            self.logger.warning(f'{missing} companies were not fetched '
+                                f'({stats["failed"]} failed requests, {stats["truncated"]} truncated)')
 
-            if save_bq and total_companies>=SAVE_INTERVAL:
-                if dataframes:
-                    prep_save(dataframes)
-                    dataframes = []
-                    total_count += total_companies
-                    self.logger.info(f"Fetched {total_count} so far...")
-                    total_companies = 0
-
-        if save_bq:
-            if dataframes:
-                prep_save(dataframes)
-                total_count += total_companies
+    async def get_by_nace_geo(self,
+                              nace_codes : list = None,
+                              geo_type: Literal["kommune","kommunenummer","postnummer","poststed"] = "kommunenummer",
+                              geo_value : list = None,
+                              batch_size = 200,
+                              save_interval = 50000,
+                              save_bq=False,
+                              page_size: int = 100,
+                              as_frame: bool = True) -> pd.DataFrame | SpillFrame | None:
+        '''
+        Fetches company data based on NACE code or geographical location with `iter_by_nace_geo`.
+        The data is transformed to a Pandas DataFrame and exported to Big Query Table `brreg.company_data`
+        :param nace_codes:
+        :param geo_type:
+        :param geo_value:
+        :param batch_size: Max number of requests in flight
+        :param save_interval:
+        :param save_bq:
+        :param page_size: Companies per search page
+        :param as_frame: If False, return the SpillFrame the batches were gathered in. The default builds one DataFrame
+            of the whole result, which is not bounded by `memory_limit`
+        :return: DataFrame or SpillFrame if save_bq is False, else None
+        '''
+        async def save(df):
+            await self.save_bq(df, 'organisasjonsnummer', table='company_data', dataset='brreg', if_exists='merge')
 
-        self.logger.info(f'Task completed in {datetime.now() - starttime}, got {total_count} companies')
+        return await self._collect(self.iter_by_nace_geo(nace_codes, geo_type, geo_value, batch_size, save_interval,
+                                                         page_size),
+                                   save if save_bq else None, as_frame)
 
+    async def iter_updates(self, since: str = None, after_id: int = None, page_size: int = 1000):
+        '''
+        Pages through the update feed `/oppdateringer/enheter` in id order and yields one list of updates per page.
+        The first page is requested from `since` or after `after_id`, the following pages after the last id seen.
+        :param since: ISO timestamp, e.g. "2024-01-01T00:00:00.000Z". Used when after_id is None
+        :param after_id: Last oppdateringsid already handled
+        :param page_size: Updates per request (max 10000)
+        '''
+        if after_id is None and since is None:
+            raise ValueError("Either since or after_id must be provided.")
+        while True:
+            params = {'size': page_size}
+            if after_id is not None:
+                params['oppdateringsid'] = after_id + 1
+            else:
+                params['dato'] = since
+            response = await self._request(self._updates_url, params, use_cache=False)
+            if response is None or response.status != 200:
+                error_text = await response.text() if response else 'no response'
+                raise ValueError(f"Could not read update feed with {params}. Error: {response.status if response else None}, {error_text}")
+            data = await response.json()
+            updates = data.get('_embedded', {}).get('oppdaterteEnheter', [])
+            if not updates:
+                return
+            yield updates
+            after_id = updates[-1]['oppdateringsid']
+            if len(updates) < page_size:
+                return
+
+    async def sync_updates(self,
+                           state_path: str,
+                           since: str = None,
+                           roles: bool = True,
+                           page_size: int = 1000,
+                           chunk_size: int = 10000,
+                           concurrency: int = 200,
+                           max_attempts: int = 5) -> dict:
+        '''
+        Incremental refresh of `brreg.company_data` (and `brreg.roles`) from the update feed, instead of re-crawling.
+        Reads the high-water mark (last oppdateringsid) from `state_path`, fetches only the organisations changed since,
+        upserts them, and writes the new mark once every `chunk_size` updates are saved, so an interrupted sync picks up
+        from the last saved chunk. Deleted organisations ("Sletting"/"Fjernet") are not fetched; their `slettedato` is
+        merged in instead. The roles of changed organisations replace their stored roles.
+        Organisations that could not be fetched are kept under 'retry' in the state file with their number of attempts,
+        and are fetched again at the start of the next sync, so the mark can move past them without losing the change.
+        They are dropped with an error after `max_attempts` syncs. A write that fails raises before the mark is moved,
+        so the next sync fetches the same updates again.
+        :param state_path: Path to the json file with the high-water mark
+        :param since: ISO timestamp to start from when there is no stored mark, e.g. "2024-01-01T00:00:00.000Z"
+        :param roles: Also refresh the roles of the changed organisations
+        :param page_size: Updates per feed request
+        :param chunk_size: Number of updates saved per high-water mark
+        :param concurrency: Max number of requests in flight
+        :param max_attempts: Number of syncs an organisation that fails is tried in before it is dropped
+        :return: Summary with the number of updates, changed, deleted and retried organisations and the new mark
+        '''
+        state = read_state(state_path, default={'oppdateringsid': None, 'dato': None})
+        if state['oppdateringsid'] is None and since is None:
+            raise ValueError(f"No high-water mark in {state_path}. Provide `since` for the first sync.")
+        # orgnr -> antall forsøk for organisasjoner som ikke kunne hentes i en tidligere synk
+        retry = state.setdefault('retry', {})
+        self.logger.info(f"Starting update sync after id {state['oppdateringsid']} (since {state['dato'] or since}), "
+                         f"{len(retry)} organisations to retry")
+        starttime = datetime.now()
+        summary = {'updates': 0, 'changed': 0, 'deleted': 0, 'retried': 0, 'dropped': 0}
+
+        async def refresh(org_nums: list) -> set:
+            failures = set()
+            # Endrede organisasjoner er lagret før, så SeenSet skal ikke hoppe over dem
+            await self.get_companies(org_nums, save_bq=True, concurrency=concurrency, if_exists='merge',
+                                     use_seen=False, failures=failures)
+            if roles:
+                await self.get_roles(org_nums, save_bq=True, concurrency=concurrency, if_exists='replace_keys',
+                                     use_seen=False, failures=failures)
+            return failures
+
+        def remember(org_nums, failures: set):
+            for orgnr in org_nums:
+                if orgnr not in failures:
+                    retry.pop(orgnr, None)
+                    continue
+                retry[orgnr] = retry.get(orgnr, 0) + 1
+                if retry[orgnr] >= max_attempts:
+                    del retry[orgnr]
+                    summary['dropped'] += 1
+                    self.logger.error(f"Giving up on updated organisation {orgnr} after {max_attempts} syncs")
+
+        if retry:
+            org_nums = list(retry)
+            remember(org_nums, await refresh(org_nums))
+            summary['retried'] += len(org_nums)
+            write_state(state_path, state)
+            self.logger.info(f"Retried {len(org_nums)} organisations from earlier syncs, {len(retry)} still failing")
+
+        async def apply(updates):
+            latest = {}
+            for update in updates:
+                latest[str(update['organisasjonsnummer'])] = update
+            deleted = {orgnr: u for orgnr, u in latest.items() if u.get('endringstype') in ('Sletting', 'Fjernet')}
+            changed = [orgnr for orgnr in latest if orgnr not in deleted]
+
+            if changed:
+                remember(changed, await refresh(changed))
+            if deleted:
+                for orgnr in deleted:
+                    retry.pop(orgnr, None)
+                df = pd.DataFrame({'organisasjonsnummer': list(deleted),
+                                   'slettedato': [str(u.get('dato', ''))[:10] or None for u in deleted.values()]})
+                df['fetch_date'] = pd.Timestamp.now()
+                await self.save_bq(df, 'organisasjonsnummer', table='company_data', dataset='brreg', if_exists='merge')
+                await self.writer.wait()
+
+            summary['updates'] += len(updates)
+            summary['changed'] += len(changed)
+            summary['deleted'] += len(deleted)
+            state.update(oppdateringsid=updates[-1]['oppdateringsid'], dato=updates[-1].get('dato'))
+            write_state(state_path, state)
+            self.logger.info(f"Synced {summary['updates']} updates up to id {state['oppdateringsid']} ({state['dato']}) | "
+                             f"{summary['changed']} changed, {summary['deleted']} deleted, {len(retry)} to retry | "
+                             f"{self.limiter}")
+
+        pending = []
+        async for updates in self.iter_updates(since=since, after_id=state['oppdateringsid'], page_size=page_size):
+            pending.extend(updates)
+            if len(pending) >= chunk_size:
+                await apply(pending)
+                pending = []
+        if pending:
+            await apply(pending)
+
+        summary.update(oppdateringsid=state['oppdateringsid'], dato=state['dato'], to_retry=len(retry))
+        self.logger.info(f"Update sync completed in {datetime.now() - starttime}: {summary}")
+        return summary
+
+    async def run_job(self, queue: JobQueue, fetch, chunk_size: int = 5000) -> dict:
+        '''
+        Works through the pending items of a JobQueue, `chunk_size` at a time. `fetch(items, failures)` fetches and saves
+        a chunk and adds the items it could not fetch to `failures`. The other items are marked done once `fetch` has
+        returned, i.e. after their data is written, so a crash loses at most the chunks in progress, and they are
+        picked up again when their lease runs out. Several processes can work on the same queue.
+        Rows saved for a chunk that is later repeated are written again, so use merging saves or a FingerprintIndex
+        where duplicates matter.
+        :param queue: The JobQueue
+        :param fetch: Async function (items, failures) that fetches and saves the items
+        :param chunk_size: Items claimed at a time
+        :return: Item counts per state
+        '''
+        starttime = datetime.now()
+        self.logger.info(f"Starting job {queue}")
+        while True:
+            items = queue.claim(chunk_size)
+            if not items:
+                break
+            failures = set()
+            try:
+                await fetch(items, failures)
+            except BaseException as e:
+                queue.release(items)
+                self.logger.error(f"Chunk of {len(items)} items failed and was released: {e!r} | {queue}")
+                raise
+            queue.complete([item for item in items if item not in failures])
+            if failures:
+                queue.fail(failures, 'fetch failed')
+            self.logger.info(f"Finished chunk of {len(items)} items, {len(failures)} failed | {queue} | {self.limiter}")
+
+        counts = queue.counts()
+        self.logger.info(f"Job {queue.job} finished in {datetime.now() - starttime} | {queue}")
+        if counts['failed']:
+            self.logger.warning(f"{counts['failed']} items in {queue.job} failed {queue.max_attempts} times. "
+                                f"See JobQueue.failed_items()")
+        return counts
+
+    async def _fill(self, queue: JobQueue, query: str, fetch, description: str, chunk_size: int = 5000):
+        # Med kø hentes arbeidslisten fra BigQuery bare når forrige kjøring er ferdig, ellers fortsetter den fra køen
+        counts = queue.counts() if queue is not None else {}
+        if counts.get(PENDING, 0) + counts.get(IN_FLIGHT, 0):
+            self.logger.info(f"Resuming {queue}")
+        else:
+            if queue is not None and len(queue):
+                self.logger.info(f"Last run finished ({queue}). Starting over with a new query for companies "
+                                 f"without {description}")
+                queue.clear()
+            orgs = OrgNumbers(self._bq.read_bq(query)['organisasjonsnummer'])
+            self.logger.info(f"Found {len(orgs)} companies without {description} | {orgs}")
+            if not orgs:
+                return None
+            if queue is None:
+                return await fetch(orgs, None)
+            queue.add(orgs)
+        return await self.run_job(queue, fetch, chunk_size)
 
-    async def fill_roles(self):
+    async def fill_roles(self, queue: JobQueue = None, chunk_size: int = 2000):
+        '''
+        Fetches roles for the companies in `brreg.company_data` without any.
+        :param queue: Optional JobQueue. The work list is then stored locally, and a rerun resumes where it stopped.
+            Once the list is done, the next run queries for new gaps
+        :param chunk_size: Org numbers per chunk with a queue
+        '''
         query = '''SELECT DISTINCT(c.organisasjonsnummer)
                 FROM `brreg.company_data` c
                 LEFT JOIN `brreg.roles` r ON c.organisasjonsnummer = r.organisasjonsnummer
                 WHERE r.organisasjonsnummer IS NULL
                 '''
-        orgs = self._bq.read_bq(query)
-        orgs = orgs['organisasjonsnummer'].tolist()
-        self.logger.info(f"Found {len(orgs)} companies without role data")
-        if orgs:
-            return await self.get_roles(orgs,save_bq=True)
+        return await self._fill(queue, query,
+                                lambda orgs, failures: self.get_roles(orgs, save_bq=True, failures=failures),
+                                'role data', chunk_size)
 
-    async def fill_financials(self,head=None, year : int = 2024):
+    async def fill_financials(self,head=None, year : int = 2024, queue: JobQueue = None, chunk_size: int = 5000):
+        '''
+        Fetches accounts for the companies in `brreg.company_data` without accounts for `year`.
+        The query already leaves out the companies with accounts for `year`, and the SeenSet has no year, so it is
+        not used to skip companies here: those saved for an earlier year would never get their new accounts.
+        :param head: Only the first `head` companies
+        :param year: Accounting year
+        :param queue: Optional JobQueue. The work list is then stored locally, and a rerun resumes where it stopped.
+            Once the list is done, the next run queries for new gaps
+        :param chunk_size: Org numbers per chunk with a queue
+        '''
         query = f'''SELECT c.organisasjonsnummer
         FROM `brreg.company_data` c
         WHERE NOT EXISTS (
@@ -691,15 +1768,32 @@ class BRREGapi:
         '''
         if head:
             query += f'LIMIT {head}'
-        orgs = self._bq.read_bq(query)
-        orgs = orgs['organisasjonsnummer'].tolist()
-        self.logger.info(f"Found {len(orgs)} companies without financial data")
-        if orgs:
-            return await self.get_financial_data(org_nums=orgs,
-                                                 save_bq=True)
-
-    async def fill_companies(self,org_nums):
-        await self.get_financial_data(org_nums,save_bq=True)
-        await self.get_companies(org_nums,save_bq=True)
-        await self.get_roles(org_nums,save_bq=True)
+        return await self._fill(queue, query,
+                                lambda orgs, failures: self.get_financial_data(org_nums=orgs, save_bq=True, failures=failures,
+                                                                               use_seen=False),
+                                'financial data', chunk_size)
+
+    async def fill_companies(self,org_nums, queue: JobQueue = None, chunk_size: int = 5000, fused: bool = True):
+        '''
+        Fetches accounts, company data and roles for the given org numbers.
+        :param org_nums: Organisation numbers. Duplicates and numbers with a wrong check digit are skipped
+        :param queue: Optional JobQueue. The org numbers are added to it, and a rerun resumes where it stopped
+        :param chunk_size: Org numbers per chunk with a queue
+        :param fused: Fetch all three in one pass with `get_all`. If False, run get_financial_data, get_companies
+            and get_roles one after the other
+        '''
+        org_nums = OrgNumbers(org_nums)
+        self.logger.info(f"Filling {org_nums}")
+
+        async def fetch(orgs, failures):
+            if fused:
+                return await self.get_all(orgs, failures=failures)
+            await self.get_financial_data(orgs,save_bq=True,failures=failures)
+            await self.get_companies(orgs,save_bq=True,failures=failures)
+            await self.get_roles(orgs,save_bq=True,failures=failures)
+
+        if queue is None:
+            return await fetch(org_nums, None)
+        queue.add(org_nums)
+        return await self.run_job(queue, fetch, chunk_size)
 
@@ -0,0 +1,139 @@
+from typing import Iterable, Iterator
+
+import numpy as np
+
+# Vektene for kontrollsifferet (modulus 11) i organisasjonsnummeret, for de åtte første sifrene
+WEIGHTS = (3, 2, 7, 6, 5, 4, 3, 2)
+MIN_ORGNR = 100000000
+MAX_ORGNR = 999999999
+
+
+def check_digit(first8: int) -> int | None:
+    '''
+    The mod-11 check digit for the first eight digits of an organisation number, or None if there is none
+    (a remainder of 1 gives 10, and such numbers are never issued).
+    '''
+    total = sum(int(d) * w for d, w in zip(f'{first8:08d}', WEIGHTS))
+    check = (11 - total % 11) % 11
+    return None if check == 10 else check
+
+
+def valid_mask(values: np.ndarray) -> np.ndarray:
+    '''
+    Vectorised mod-11 check of an array of nine digit numbers.
+    :return: bool array, True where the last digit is the check digit of the first eight
+    '''
+    values = values.astype(np.uint32, copy=False)
+    total = np.zeros(len(values), dtype=np.uint32)
+    for i, weight in enumerate(WEIGHTS):
+        total += (values // np.uint32(10 ** (8 - i)) % np.uint32(10)) * np.uint32(weight)
+    check = (np.uint32(11) - total % np.uint32(11)) % np.uint32(11)
+    return (check != 10) & (check == values % np.uint32(10))
+
+
+def _parse(values) -> np.ndarray:
+    import pandas as pd  # tar lang tid å importere, og trengs ikke for å bruke et ferdig OrgNumbers
+
+    # Tall og rene siffer-strenger går rett gjennom. Resten kan ha mellomrom og NO-prefiks (som hos Enin),
+    # og blir NaN om de fortsatt ikke er tall
+    s = values if isinstance(values, pd.Series) else pd.Series(values if isinstance(values, np.ndarray) else list(values))
+    parsed = pd.to_numeric(s, errors='coerce').to_numpy(dtype=np.float64, na_value=np.nan)
+    retry = np.isnan(parsed) & s.notna().to_numpy()
+    if retry.any():
+        cleaned = s[retry].astype(str).str.strip().str.removeprefix('NO').str.replace(' ', '', regex=False)
+        parsed[retry] = pd.to_numeric(cleaned, errors='coerce').to_numpy(dtype=np.float64, na_value=np.nan)
+    return parsed
+
+
+def _unique(values: np.ndarray) -> np.ndarray:
+    # Første forekomst av hver verdi, i rekkefølgen de kom. pd.unique hasher, og er raskere enn å sortere
+    import pandas as pd
+    return pd.unique(values)
+
+
+class OrgNumbers:
+    '''
+    A batch of organisation numbers as a uint32 array, four bytes per number instead of a Python str or int each.
+    The input (ints, strings with or without an `NO` prefix, a DataFrame column) is parsed once, duplicates are
+    dropped (the first occurrence is kept), and numbers that are not nine digits or fail the mod-11 check are left
+    out, so they never cost a request. Iterating gives the numbers as strings, so an OrgNumbers can be passed
+    wherever a list of org numbers is taken. Slices are views of the same array, so work units cost no copies.
+    '''
+
+    def __init__(self, values: Iterable = (), validate: bool = True):
+        '''
+        :param values: Organisation numbers
+        :param validate: Drop numbers with a wrong check digit. Numbers that are not nine digits are always dropped
+        '''
+        if isinstance(values, OrgNumbers):
+            self.values, self.invalid, self.counts = values.values, values.invalid, dict(values.counts)
+            return
+        parsed = _parse(values)
+        in_range = (parsed >= MIN_ORGNR) & (parsed <= MAX_ORGNR) & (parsed == np.floor(parsed))
+        numbers = parsed[in_range].astype(np.uint32)
+        unique = _unique(numbers)
+        self.counts = {'input': len(parsed),
+                       'unparseable': int(len(parsed) - in_range.sum()),
+                       'duplicates': int(len(numbers) - len(unique)),
+                       'invalid': 0}
+        if validate:
+            valid = valid_mask(unique)
+            self.invalid = unique[~valid]
+            unique = unique[valid]
+            self.counts['invalid'] = len(self.invalid)
+        else:
+            self.invalid = np.empty(0, dtype=np.uint32)
+        self.values = np.ascontiguousarray(unique, dtype=np.uint32)
+
+    @classmethod
+    def _view(cls, values: np.ndarray) -> 'OrgNumbers':
+        view = cls.__new__(cls)
+        view.values = values
+        view.invalid = np.empty(0, dtype=np.uint32)
+        view.counts = {'input': len(values), 'unparseable': 0, 'duplicates': 0, 'invalid': 0}
+        return view
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def __iter__(self) -> Iterator[str]:
+        # I biter, så en lang liste aldri blir Python-objekter på én gang
+        for start in range(0, len(self.values), 10000):
+            yield from map(str, self.values[start:start + 10000].tolist())
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self._view(self.values[index])
+        return str(self.values[index])
+
+    def __contains__(self, orgnr) -> bool:
+        try:
+            return bool((self.values == np.uint32(int(str(orgnr).removeprefix('NO')))).any())
+        except (ValueError, OverflowError):
+            return False
+
+    def chunks(self, size: int) -> Iterator['OrgNumbers']:
+        '''
+        Consecutive work units of at most `size` numbers, as views of this batch.
+        '''
+        for start in range(0, len(self.values), size):
+            yield self[start:start + size]
+
+    def shards(self, n: int) -> list['OrgNumbers']:
+        '''
+        `n` interleaved shards (every n-th number), as views of this batch.
+        '''
+        return [self[i::n] for i in range(n)]
+
+    def tolist(self) -> list[str]:
+        return list(self)
+
+    def stats(self) -> dict:
+        return {'count': len(self), **{k: v for k, v in self.counts.items() if k != 'input'},
+                'mb': round(self.values.nbytes / 1e6, 2)}
+
+    def __str__(self):
+        return ' | '.join(f'{k} {v}' for k, v in self.stats().items())
+
+    def __repr__(self):
+        return f'OrgNumbers({str(self)})'
@@ -0,0 +1,96 @@
+import asyncio
+from collections import deque
+from typing import AsyncIterable, AsyncIterator, Awaitable, Callable, Iterable
+
+
+async def _aiter(items: Iterable | AsyncIterable) -> AsyncIterator:
+    if hasattr(items, '__aiter__'):
+        async for item in items:
+            yield item
+    else:
+        for item in items:
+            yield item
+
+
+async def imap_bounded(func: Callable[..., Awaitable],
+                       items: Iterable | AsyncIterable,
+                       limit: int = 200) -> AsyncIterator[tuple]:
+    '''
+    Runs `func(item)` for every item with at most `limit` calls in flight and yields `(item, result)` as soon as
+    each call finishes. A new item is started as soon as one finishes, so slow calls do not hold back the rest the
+    way `asyncio.gather` over fixed blocks does. Items are pulled lazily from `items`, which can be a regular or an
+    async iterable. Exceptions raised by `func` are yielded as the result instead of stopping the pool.
+    :param func: Async function taking one item
+    :param items: Iterable or async iterable of items
+    :param limit: Max number of calls in flight
+    :return: Async iterator of (item, result) in completion order
+    '''
+    if limit < 1:
+        raise ValueError(f"limit must be at least 1, got {limit}")
+
+    async def run(item):
+        try:
+            return item, await func(item)
+        except Exception as e:
+            return item, e
+
+    source = _aiter(items)
+    pending = set()
+    exhausted = False
+    try:
+        while True:
+            while not exhausted and len(pending) < limit:
+                try:
+                    item = await source.__anext__()
+                except StopAsyncIteration:
+                    exhausted = True
+                    break
+                pending.add(asyncio.create_task(run(item)))
+            if not pending:
+                return
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                yield task.result()
+    finally:
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+
+async def imap_expanding(func: Callable[..., Awaitable[tuple]],
+                         items: Iterable,
+                         limit: int = 200) -> AsyncIterator[tuple]:
+    '''
+    Like `imap_bounded`, for work that discovers more work. `func(item)` returns `(result, new_items)`, and the new
+    items are run in the same window as the rest. Yields `(item, result)` in completion order until no work is left.
+    Exceptions raised by `func` are yielded as the result.
+    :param func: Async function taking one item and returning (result, list of new items)
+    :param items: The initial items
+    :param limit: Max number of calls in flight
+    :return: Async iterator of (item, result) in completion order
+    '''
+    if limit < 1:
+        raise ValueError(f"limit must be at least 1, got {limit}")
+
+    async def run(item):
+        try:
+            result, new_items = await func(item)
+            return item, result, new_items
+        except Exception as e:
+            return item, e, []
+
+    queue = deque(items)
+    pending = set()
+    try:
+        while queue or pending:
+            while queue and len(pending) < limit:
+                pending.add(asyncio.create_task(run(queue.popleft())))
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                item, result, new_items = task.result()
+                queue.extend(new_items)
+                yield item, result
+    finally:
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
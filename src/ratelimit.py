@@ -0,0 +1,231 @@
+import asyncio
+import multiprocessing
+import random
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+RETRY_STATUSES = (429, 502, 503, 504)
+
+
+def parse_retry_after(value: str | None) -> float | None:
+    '''
+    Parses a `Retry-After` header, given either as seconds or as an HTTP date.
+    :param value: The header value
+    :return: Seconds to wait, or None if the header is missing or invalid
+    '''
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+class AdaptiveRateLimiter:
+    '''
+    A token bucket combined with an AIMD (additive increase, multiplicative decrease) limit on concurrent requests.
+
+    Every successful response raises the request rate by `rate_step` and the concurrency limit by roughly one slot
+    per window of completed requests. A 429 halves both (at most once per `cooldown` seconds) and pauses all requests
+    for the `Retry-After` period. Throughput therefore climbs while the server is healthy and settles just below the
+    level where it starts throttling.
+    '''
+
+    def __init__(self,
+                 rate: float = 50.0,
+                 min_rate: float = 1.0,
+                 max_rate: float = 1000.0,
+                 concurrency: float = 20,
+                 min_concurrency: int = 1,
+                 max_concurrency: int = 200,
+                 rate_step: float = 0.1,
+                 decrease: float = 0.5,
+                 cooldown: float = 1.0,
+                 max_retries: int = 5,
+                 base_backoff: float = 0.5,
+                 max_backoff: float = 60.0):
+        '''
+        :param rate: Initial number of requests per second
+        :param min_rate: Lower bound for the rate
+        :param max_rate: Upper bound for the rate
+        :param concurrency: Initial number of requests in flight
+        :param min_concurrency: Lower bound for the concurrency
+        :param max_concurrency: Upper bound for the concurrency
+        :param rate_step: Requests per second added for every successful response
+        :param decrease: Factor applied to rate and concurrency on throttling
+        :param cooldown: Minimum seconds between two decreases
+        :param max_retries: Number of retries before a request is given up
+        :param base_backoff: Base seconds for the exponential backoff
+        :param max_backoff: Max seconds for the exponential backoff
+        '''
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.concurrency = float(concurrency)
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.rate_step = rate_step
+        self.decrease = decrease
+        self.cooldown = cooldown
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+
+        self._tokens = 1.0
+        self._last_refill = time.monotonic()
+        self._last_decrease = 0.0
+        self._blocked_until = 0.0
+        self._in_flight = 0
+        self._cond = asyncio.Condition()
+        self.counters = {'requests': 0, 'ok': 0, 'throttled': 0, 'errors': 0, 'retries': 0, 'give_ups': 0}
+
+    def _refill(self, now: float):
+        self._tokens = min(max(1.0, self.rate / 10), self._tokens + (now - self._last_refill) * self.rate)
+        self._last_refill = now
+
+    def _take(self, now: float) -> float:
+        '''
+        Takes a token if one is free.
+        :return: 0 if a token was taken, else seconds to wait before trying again
+        '''
+        if now < self._blocked_until:
+            return self._blocked_until - now
+        self._refill(now)
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0.0
+        return (1 - self._tokens) / self.rate
+
+    async def acquire(self):
+        async with self._cond:
+            await self._cond.wait_for(lambda: self._in_flight < int(self.concurrency))
+            self._in_flight += 1
+        try:
+            while True:
+                wait = self._take(time.monotonic())
+                if not wait:
+                    self.counters['requests'] += 1
+                    return
+                await asyncio.sleep(wait)
+        except BaseException:
+            await self.release()
+            raise
+
+    async def release(self):
+        async with self._cond:
+            self._in_flight -= 1
+            self._cond.notify_all()
+
+    @asynccontextmanager
+    async def slot(self):
+        await self.acquire()
+        try:
+            yield
+        finally:
+            await self.release()
+
+    def on_success(self):
+        self.counters['ok'] += 1
+        self.rate = min(self.max_rate, self.rate + self.rate_step)
+        self.concurrency = min(self.max_concurrency, self.concurrency + 1 / self.concurrency)
+
+    def on_throttle(self, retry_after: float = None):
+        self.counters['throttled'] += 1
+        now = time.monotonic()
+        if retry_after:
+            self._blocked_until = max(self._blocked_until, now + retry_after)
+        if now - self._last_decrease >= self.cooldown:
+            self._last_decrease = now
+            self.rate = max(self.min_rate, self.rate * self.decrease)
+            self.concurrency = max(self.min_concurrency, self.concurrency * self.decrease)
+            self._tokens = 0.0
+
+    def on_error(self):
+        self.counters['errors'] += 1
+
+    def backoff(self, attempt: int, retry_after: float = None) -> float:
+        '''
+        Seconds to wait before retry number `attempt` (starting at 0). Uses exponential backoff with full jitter,
+        but never less than `retry_after`.
+        '''
+        delay = random.uniform(0, min(self.max_backoff, self.base_backoff * 2 ** attempt))
+        return max(delay, retry_after or 0.0)
+
+    def stats(self) -> dict:
+        return {'rate': round(self.rate, 1),
+                'concurrency': int(self.concurrency),
+                'in_flight': self._in_flight,
+                **self.counters}
+
+    def __str__(self):
+        return ' | '.join(f'{k} {v}' for k, v in self.stats().items())
+
+
+def _shared_value(index: int) -> property:
+    # Et attributt som leses og skrives i delt minne
+    def get(self):
+        return self._shared[index]
+
+    def set(self, value):
+        self._shared[index] = value
+
+    return property(get, set)
+
+
+class SharedRateLimiter(AdaptiveRateLimiter):
+    '''
+    An AdaptiveRateLimiter for several processes with one global budget. The token bucket, the rate and the
+    `Retry-After` pause live in shared memory, so a 429 seen by one process slows down all of them, and the rate
+    climbs with the successful responses of all of them. The limit on requests in flight is kept per process.
+
+    Create it in the parent process and pass it to the workers when they are started; it cannot be sent over a
+    queue afterwards.
+    '''
+    _tokens = _shared_value(0)
+    _last_refill = _shared_value(1)
+    _blocked_until = _shared_value(2)
+    rate = _shared_value(3)
+    _last_decrease = _shared_value(4)
+
+    def __init__(self, *args, **kwargs):
+        '''
+        Takes the same parameters as AdaptiveRateLimiter.
+        '''
+        # Array med RLock; verdiene settes av AdaptiveRateLimiter.__init__ via propertyene over.
+        # Låsen må lages i spawn-konteksten for å kunne sendes til prosesser startet med spawn
+        self._shared = multiprocessing.get_context('spawn').Array('d', 5)
+        super().__init__(*args, **kwargs)
+
+    def _take(self, now: float) -> float:
+        with self._shared.get_lock():
+            return super()._take(now)
+
+    def on_success(self):
+        with self._shared.get_lock():
+            super().on_success()
+
+    def on_throttle(self, retry_after: float = None):
+        with self._shared.get_lock():
+            super().on_throttle(retry_after)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # Condition og tellere hører til prosessen
+        del state['_cond']
+        state['_in_flight'] = 0
+        state['counters'] = dict.fromkeys(self.counters, 0)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._cond = asyncio.Condition()
+
@@ -0,0 +1,229 @@
+import json
+import math
+
+import pandas as pd
+
+STRING = 'STRING'
+INTEGER = 'INTEGER'
+FLOAT = 'FLOAT'
+BOOLEAN = 'BOOLEAN'
+DATETIME = 'DATETIME'
+JSON = 'JSON'      # Nested objects, stored as a json string
+ARRAY = 'ARRAY'    # Lists of strings, stored as REPEATED STRING
+
+_BQ_TYPES = {
+    STRING: 'STRING',
+    INTEGER: 'INTEGER',
+    FLOAT: 'FLOAT',
+    BOOLEAN: 'BOOLEAN',
+    DATETIME: 'DATETIME',
+    JSON: 'STRING',
+    ARRAY: ('STRING', 'REPEATED'),
+}
+
+_BOOLS = {True: True, False: False, 'true': True, 'false': False, 'True': True, 'False': False}
+
+
+def _is_missing(value) -> bool:
+    return value is None or (isinstance(value, float) and math.isnan(value))
+
+
+def _to_json(value):
+    if _is_missing(value):
+        return None
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, ensure_ascii=False, default=str)
+    return str(value)
+
+
+def _to_array(value) -> list:
+    if isinstance(value, (list, tuple)):
+        return [str(v) for v in value if not _is_missing(v)]
+    if _is_missing(value):
+        return []
+    return [str(value)]
+
+
+class TableSchema:
+    '''
+    Declared column types for one table. `cast` converts a whole batch with one operation per type group,
+    and `bq_schema` gives `BigQuery.to_bq` an explicit schema for the declared columns.
+    Columns that are not declared get the `default` type, or are left as they are if `default` is None
+    (nested dicts in such columns are still stored as json).
+    '''
+
+    def __init__(self, columns: dict[str, str], key: list[str] = None, default: str = None, fill_numeric: bool = False):
+        '''
+        :param columns: Column name -> type (STRING, INTEGER, FLOAT, BOOLEAN, DATETIME, JSON or ARRAY)
+        :param key: The columns a merge is done on
+        :param default: Type for columns that are not declared
+        :param fill_numeric: Replace missing numbers with 0
+        '''
+        self.columns = columns
+        self.key = key or []
+        self.default = default
+        self.fill_numeric = fill_numeric
+
+    def _groups(self, df: pd.DataFrame) -> dict[str, list[str]]:
+        groups = {}
+        for col in df.columns:
+            groups.setdefault(self.columns.get(col, self.default), []).append(col)
+        return groups
+
+    def cast(self, df: pd.DataFrame) -> pd.DataFrame:
+        '''
+        Casts a DataFrame to the declared types. Values that can not be converted become missing.
+        :param df: The batch to cast
+        :return: The cast DataFrame
+        '''
+        groups = self._groups(df)
+        df = df.copy()
+
+        numeric = groups.get(INTEGER, []) + groups.get(FLOAT, [])
+        if numeric:
+            df[numeric] = df[numeric].apply(pd.to_numeric, errors='coerce')
+            if self.fill_numeric:
+                df[numeric] = df[numeric].fillna(0)
+        if groups.get(INTEGER):
+            df[groups[INTEGER]] = df[groups[INTEGER]].round().astype('Int64')
+        if groups.get(FLOAT):
+            df[groups[FLOAT]] = df[groups[FLOAT]].astype('float64')
+        if groups.get(BOOLEAN):
+            df[groups[BOOLEAN]] = df[groups[BOOLEAN]].apply(lambda s: s.map(_BOOLS)).astype('boolean')
+        if groups.get(DATETIME):
+            df[groups[DATETIME]] = df[groups[DATETIME]].apply(pd.to_datetime, errors='coerce')
+        if groups.get(STRING):
+            df[groups[STRING]] = df[groups[STRING]].astype('string')
+        for col in groups.get(JSON, []):
+            df[col] = df[col].map(_to_json)
+        for col in groups.get(ARRAY, []):
+            df[col] = df[col].map(_to_array)
+        for col in groups.get(None, []):
+            if df[col].dtype == object and df[col].map(lambda v: isinstance(v, dict)).any():
+                df[col] = df[col].map(_to_json)
+        return df
+
+    def bq_schema(self, df: pd.DataFrame) -> dict:
+        '''
+        The BigQuery types of the declared columns present in `df`, in the format `BigQuery.to_bq(explicit_schema=...)` takes.
+        '''
+        return {col: _BQ_TYPES[kind] for col in df.columns
+                if (kind := self.columns.get(col, self.default)) in _BQ_TYPES}
+
+
+def _columns(**groups: list[str]) -> dict[str, str]:
+    return {col: kind for kind, cols in groups.items() for col in cols}
+
+
+# === BRREG ===
+# Datoer lagres som tekst (ISO), slik tabellene allerede har dem. Tall som kan mangle i en batch er FLOAT,
+# som er typen de fikk når batchen inneholdt NaN.
+_ADDRESS = ['land', 'landkode', 'postnummer', 'poststed', 'kommune', 'kommunenummer']
+
+COMPANY_DATA = TableSchema(
+    key=['organisasjonsnummer'],
+    columns=_columns(
+        STRING=['organisasjonsnummer', 'navn', 'organisasjonsform_kode', 'organisasjonsform_beskrivelse',
+                'organisasjonsform__links_self_href', 'hjemmeside', 'epostadresse', 'telefon', 'mobil',
+                *[f'postadresse_{c}' for c in _ADDRESS], *[f'forretningsadresse_{c}' for c in _ADDRESS],
+                'registreringsdatoEnhetsregisteret', 'registreringsdatoMerverdiavgiftsregisteret',
+                'registreringsdatoForetaksregisteret', 'registreringsdatoAntallAnsatteEnhetsregisteret',
+                'registreringsdatoAntallAnsatteNAVAaregisteret', 'stiftelsesdato', 'vedtektsdato',
+                'naeringskode1_kode', 'naeringskode1_beskrivelse', 'naeringskode2_kode', 'naeringskode2_beskrivelse',
+                'naeringskode3_kode', 'naeringskode3_beskrivelse', 'hjelpeenhetskode_kode', 'hjelpeenhetskode_beskrivelse',
+                'institusjonellSektorkode_kode', 'institusjonellSektorkode_beskrivelse', 'sisteInnsendteAarsregnskap',
+                'konkursdato', 'underAvviklingDato', 'tvangsavvikletPgaManglendeSlettingDato',
+                'tvangsopplostPgaManglendeDagligLederDato', 'tvangsopplostPgaManglendeRevisorDato',
+                'tvangsopplostPgaManglendeRegnskapDato', 'tvangsopplostPgaMangelfulltStyreDato',
+                'maalform', 'overordnetEnhet', 'slettedato', '_links_self_href', 'country'],
+        BOOLEAN=['registrertIMvaregisteret', 'harRegistrertAntallAnsatte', 'registrertIForetaksregisteret',
+                 'registrertIStiftelsesregisteret', 'registrertIFrivillighetsregisteret', 'registrertIPartiregisteret',
+                 'konkurs', 'underAvvikling', 'underTvangsavviklingEllerTvangsopplosning'],
+        FLOAT=['antallAnsatte'],
+        INTEGER=['page'],
+        DATETIME=['fetch_date'],
+        ARRAY=['postadresse_adresse', 'forretningsadresse_adresse', 'vedtektsfestetFormaal', 'aktivitet',
+               'frivilligMvaRegistrertBeskrivelser'],
+        JSON=['paategninger'],
+    ))
+
+FINANCIAL = TableSchema(
+    key=['virksomhet_organisasjonsnummer'],
+    columns=_columns(
+        STRING=['virksomhet_organisasjonsnummer', 'virksomhet_organisasjonsform', 'journalnr', 'regnskapstype', 'valuta',
+                'oppstillingsplan', 'regnskapsperiode_fraDato', 'regnskapsperiode_tilDato',
+                'regnkapsprinsipper_regnskapsregler'],
+        BOOLEAN=['virksomhet_morselskap', 'avviklingsregnskap', 'revisjon_ikkeRevidertAarsregnskap',
+                 'revisjon_fravalgRevisjon', 'regnkapsprinsipper_smaaForetak'],
+        FLOAT=['id',
+               'egenkapitalGjeld_sumEgenkapitalGjeld',
+               'egenkapitalGjeld_egenkapital_sumEgenkapital',
+               'egenkapitalGjeld_egenkapital_opptjentEgenkapital_sumOpptjentEgenkapital',
+               'egenkapitalGjeld_egenkapital_innskuttEgenkapital_sumInnskuttEgenkaptial',
+               'egenkapitalGjeld_gjeldOversikt_sumGjeld',
+               'egenkapitalGjeld_gjeldOversikt_kortsiktigGjeld_sumKortsiktigGjeld',
+               'egenkapitalGjeld_gjeldOversikt_langsiktigGjeld_sumLangsiktigGjeld',
+               'eiendeler_sumEiendeler',
+               'eiendeler_omloepsmidler_sumOmloepsmidler',
+               'eiendeler_anleggsmidler_sumAnleggsmidler',
+               'resultatregnskapResultat_ordinaertResultatFoerSkattekostnad',
+               'resultatregnskapResultat_aarsresultat',
+               'resultatregnskapResultat_totalresultat',
+               'resultatregnskapResultat_finansresultat_nettoFinans',
+               'resultatregnskapResultat_finansresultat_finansinntekt_sumFinansinntekter',
+               'resultatregnskapResultat_finansresultat_finanskostnad_sumFinanskostnad',
+               'resultatregnskapResultat_driftsresultat_driftsresultat',
+               'resultatregnskapResultat_driftsresultat_driftsinntekter_sumDriftsinntekter',
+               'resultatregnskapResultat_driftsresultat_driftskostnad_sumDriftskostnad'],
+        DATETIME=['fetch_date'],
+    ))
+
+ROLES = TableSchema(
+    key=['organisasjonsnummer'],
+    columns=_columns(
+        STRING=['organisasjonsnummer', 'type_kode', 'type_beskrivelse', 'person_fodselsdato', 'person_navn_fornavn',
+                'person_navn_mellomnavn', 'person_navn_etternavn', 'enhet_organisasjonsnummer',
+                'enhet_organisasjonsform_kode', 'enhet_organisasjonsform_beskrivelse', 'valgtAv_kode',
+                'valgtAv_beskrivelse', 'country'],
+        BOOLEAN=['fratraadt', 'avregistrert', 'person_erDoed', 'enhet_erSlettet'],
+        FLOAT=['rekkefolge'],
+        DATETIME=['fetch_date'],
+        ARRAY=['enhet_navn'],
+        JSON=['stadfestetFremtidsfullmakt', 'begrensetRettsligHandleevne'],
+    ))
+
+# === ENIN ===
+_ACCOUNTS = dict(
+    key=['org_nr', 'accounting_year'],
+    default=FLOAT,
+    fill_numeric=True,
+    columns=_columns(
+        STRING=['company_uuid', 'accounts_type_uuid', 'app_url', 'uuid', 'accounts_uuid', 'currency_code',
+                'accounting_schema', 'income_statement__currency_code'],
+        BOOLEAN=['corporate_group_accounts_flag', 'estimated_accounting_period_flag'],
+        DATETIME=['accounting_announcement_date', 'accounting_from_date', 'accounting_to_date'],
+        INTEGER=['org_nr', 'accounting_year'],
+    ))
+
+SCHEMAS = {
+    'brreg': {
+        'company_data': COMPANY_DATA,
+        'financial': FINANCIAL,
+        'roles': ROLES,
+    },
+    'enin': {
+        'accounts': TableSchema(**_ACCOUNTS),
+        'accounts_highlights': TableSchema(**_ACCOUNTS),
+        'accounts_income_statement': TableSchema(**_ACCOUNTS),
+        'accounts_balance_sheet': TableSchema(**_ACCOUNTS),
+        'company': TableSchema(key=['org_nr'], columns=_columns(INTEGER=['org_nr'], STRING=['uuid'])),
+        'accounts_type': TableSchema(key=['org_nr'], columns=_columns(INTEGER=['org_nr'], STRING=['uuid'])),
+    },
+}
+
+
+def get_schema(dataset: str, table: str) -> TableSchema | None:
+    '''
+    Returns the declared schema for `dataset.table`, or None if the table has none.
+    '''
+    return SCHEMAS.get(dataset, {}).get(table)
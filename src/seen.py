@@ -0,0 +1,151 @@
+import os
+import sqlite3
+import threading
+import time
+from typing import Iterable, Iterator
+
+import numpy as np
+
+from src.orgnr import MAX_ORGNR, MIN_ORGNR, OrgNumbers
+
+
+def _org_id(key: str) -> int:
+    # Nøkkelen som tall om den er et organisasjonsnummer, ellers 0
+    if len(key) != 9 or not key.isdigit():
+        return 0
+    value = int(key)
+    return value if MIN_ORGNR <= value <= MAX_ORGNR else 0
+
+
+class SeenSet:
+    '''
+    Local SQLite set of the keys each job has already saved, e.g. the org numbers in `brreg.roles`. Fetchers skip
+    keys that are in the set, so a rerun or an overlapping crawl inside the same window never requests or flattens
+    them again. Keys are added once their rows are written. With `max_age` the set covers a sliding crawl window:
+    older entries count as unseen and are purged when the set is opened.
+    '''
+
+    def __init__(self, path: str, max_age: float = None, logger=None):
+        '''
+        :param path: Path to the SQLite file. Created if it does not exist
+        :param max_age: Seconds an entry counts as seen. None keeps entries until `clear`
+        :param logger: Optional logger
+        '''
+        self.path = path
+        self.max_age = max_age
+        self.logger = logger
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._con = sqlite3.connect(path, check_same_thread=False)
+        self._con.execute('PRAGMA journal_mode=WAL')
+        self._con.execute('''CREATE TABLE IF NOT EXISTS seen (
+                                 job TEXT NOT NULL,
+                                 key TEXT NOT NULL,
+                                 seen_at REAL NOT NULL,
+                                 PRIMARY KEY (job, key)) WITHOUT ROWID''')
+        if max_age is not None:
+            self._con.execute('DELETE FROM seen WHERE seen_at < ?', (time.time() - max_age,))
+        self._con.commit()
+        self.counters = {}
+
+    def _count(self, job: str, name: str, n: int):
+        counts = self.counters.setdefault(job, {'skipped': 0, 'added': 0})
+        counts[name] += n
+
+    def seen(self, job: str, keys: list[str]) -> set[str]:
+        '''
+        The keys of `keys` that `job` has already saved.
+        '''
+        cutoff = time.time() - self.max_age if self.max_age is not None else 0
+        found = set()
+        with self._lock:
+            for i in range(0, len(keys), 500):
+                chunk = keys[i:i + 500]
+                rows = self._con.execute(
+                    f'SELECT key FROM seen WHERE job = ? AND seen_at >= ? AND key IN ({",".join("?" * len(chunk))})',
+                    [job, cutoff, *chunk]).fetchall()
+                found.update(row[0] for row in rows)
+        return found
+
+    def filter(self, job: str, keys: Iterable, chunk_size: int = 5000) -> Iterator[str]:
+        '''
+        Yields the keys `job` has not saved, as strings, looked up `chunk_size` at a time so the input is read lazily.
+        Repeats within `keys` are yielded once. An OrgNumbers has no repeats, so nothing is kept for it; for other
+        input the org numbers already yielded are kept as sorted uint32 arrays (four bytes each), and only keys
+        that are not org numbers are kept as strings.
+        '''
+        check_repeats = not isinstance(keys, OrgNumbers)
+        # Sorterte biter, der en bit slås sammen med den forrige når den blir like stor. Da er det O(log n) biter å
+        # søke i, og hvert tall sorteres O(log n) ganger i stedet for at alt sorteres på nytt for hver bit
+        yielded_ids = []
+        yielded_other = set()
+
+        def flush(chunk):
+            # Første forekomst av hver nøkkel i biten, i rekkefølgen de kom
+            if check_repeats:
+                chunk = list(dict.fromkeys(chunk))
+                ids = np.fromiter(map(_org_id, chunk), dtype=np.uint32, count=len(chunk))
+                repeated = np.zeros(len(chunk), dtype=bool)
+                for run in yielded_ids:
+                    pos = np.minimum(np.searchsorted(run, ids), len(run) - 1)
+                    repeated |= (ids > 0) & (run[pos] == ids)
+                other = ids == 0
+                for i in np.flatnonzero(other):
+                    repeated[i] = chunk[i] in yielded_other
+                    yielded_other.add(chunk[i])
+                chunk = [key for key, rep in zip(chunk, repeated) if not rep]
+                new = np.sort(ids[~repeated & ~other])
+                if len(new):
+                    yielded_ids.append(new)
+                while len(yielded_ids) > 1 and len(yielded_ids[-2]) <= len(yielded_ids[-1]):
+                    last = yielded_ids.pop()
+                    yielded_ids[-1] = np.sort(np.concatenate([yielded_ids[-1], last]), kind='stable')
+            found = self.seen(job, chunk)
+            self._count(job, 'skipped', len(found))
+            return [key for key in chunk if key not in found]
+
+        chunk = []
+        for key in keys:
+            chunk.append(str(key))
+            if len(chunk) >= chunk_size:
+                yield from flush(chunk)
+                chunk = []
+        if chunk:
+            yield from flush(chunk)
+
+    def add(self, job: str, keys: Iterable):
+        '''
+        Marks keys as saved for `job`. Called from the writer thread once their rows are written.
+        '''
+        now = time.time()
+        rows = [(job, str(key), now) for key in keys]
+        with self._lock:
+            self._con.executemany('INSERT OR REPLACE INTO seen (job, key, seen_at) VALUES (?, ?, ?)', rows)
+            self._con.commit()
+        self._count(job, 'added', len(rows))
+
+    def clear(self, job: str = None):
+        '''
+        Empties the set for one job, or for all jobs. Use it to start a new crawl window.
+        '''
+        with self._lock:
+            if job is None:
+                self._con.execute('DELETE FROM seen')
+            else:
+                self._con.execute('DELETE FROM seen WHERE job = ?', (job,))
+            self._con.commit()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._con.execute('SELECT COUNT(*) FROM seen').fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._con.close()
+
+    def stats(self) -> dict:
+        return {job: dict(counts) for job, counts in self.counters.items()}
+
+    def __str__(self):
+        return ' | '.join(f"{job}: {c['skipped']} skipped, {c['added']} added" for job, c in self.counters.items())
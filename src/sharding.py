@@ -0,0 +1,206 @@
+import asyncio
+import multiprocessing
+import time
+from datetime import datetime
+from functools import partial
+from queue import Empty
+
+from sibr_module import Logger
+
+from src.jobqueue import JobQueue
+from src.modules import BRREGapi
+from src.orgnr import OrgNumbers
+from src.ratelimit import SharedRateLimiter
+from src.sinks import Sink, BigQuerySink, QueueSink, serve_queue
+
+
+async def _companies(api: BRREGapi, orgs, failures):
+    await api.get_companies(orgs, save_bq=True, failures=failures)
+
+
+async def _roles(api: BRREGapi, orgs, failures):
+    await api.get_roles(orgs, save_bq=True, failures=failures)
+
+
+async def _financials(api: BRREGapi, orgs, failures):
+    await api.get_financial_data(orgs, save_bq=True, failures=failures)
+
+
+async def _fill_companies(api: BRREGapi, orgs, failures):
+    await api.get_all(orgs, failures=failures)
+
+
+def brreg_client(limiter, sink, cache: str = None, seen: str = None, seen_max_age: float = None,
+                 fingerprints: str = None, log_level: str = None) -> BRREGapi:
+    '''
+    An api_factory for crawl_sharded that opens the ResponseCache, SeenSet and FingerprintIndex in the worker.
+    The SQLite connections can not be sent to a spawned process, so the files are passed by path, e.g.
+    `partial(brreg_client, cache='cache.sqlite')`. The workers share the files.
+    :param limiter: The shared limiter from crawl_sharded
+    :param sink: The QueueSink from crawl_sharded
+    :param cache: Optional path to a ResponseCache file
+    :param seen: Optional path to a SeenSet file
+    :param seen_max_age: Seconds an entry in the SeenSet counts as seen. None keeps entries until cleared
+    :param fingerprints: Optional path to a FingerprintIndex file
+    :param log_level: Optional log level for the client
+    '''
+    kwargs = {}
+    if cache:
+        from src.httpcache import ResponseCache
+        kwargs['cache'] = ResponseCache(cache)
+    if seen:
+        from src.seen import SeenSet
+        kwargs['seen'] = SeenSet(seen, max_age=seen_max_age)
+    if fingerprints:
+        from src.fingerprint import FingerprintIndex
+        kwargs['fingerprints'] = FingerprintIndex(fingerprints)
+    api = BRREGapi(limiter=limiter, sink=sink, **kwargs)
+    if log_level:
+        api.logger.set_level(log_level)
+    return api
+
+
+# Jobbene en arbeider kan kjøre. Funksjonene tar (api, org_nums, failures) og lagrer selv
+JOBS = {'companies': _companies,
+        'roles': _roles,
+        'financials': _financials,
+        'fill_companies': _fill_companies}
+
+
+async def _work(job: str, org_nums, queue_spec: dict, chunk_size: int, api_factory, limiter, sink) -> dict:
+    api = api_factory(limiter=limiter, sink=sink)
+    fetch = partial(JOBS[job], api)
+    failures = set()
+    start = time.perf_counter()
+    try:
+        if queue_spec is not None:
+            job_queue = JobQueue(**queue_spec)
+            try:
+                await api.run_job(job_queue, fetch, chunk_size)
+            finally:
+                job_queue.close()
+        else:
+            await fetch(org_nums, failures)
+    finally:
+        await api.close()
+    return {'items': len(org_nums) if org_nums is not None else None,
+            'failed': len(failures),
+            'seconds': round(time.perf_counter() - start, 2),
+            **limiter.counters}
+
+
+def _run_worker(index: int, job: str, org_nums, queue_spec, chunk_size, api_factory, limiter, batches, ack, results):
+    sink = QueueSink(batches, ack, index)
+    try:
+        results.put((index, asyncio.run(_work(job, org_nums, queue_spec, chunk_size, api_factory, limiter, sink)), None))
+    except BaseException as e:
+        results.put((index, None, repr(e)))
+    finally:
+        sink.done()
+
+
+def crawl_sharded(job: str,
+                  org_nums: list | OrgNumbers = None,
+                  queue: JobQueue = None,
+                  workers: int = 4,
+                  sink: Sink = None,
+                  limiter: SharedRateLimiter = None,
+                  api_factory=None,
+                  chunk_size: int = 5000,
+                  max_pending: int = 4,
+                  logger: Logger = None) -> dict:
+    '''
+    Runs a BRREG job in `workers` processes, each with its own event loop, session and BRREGapi, so JSON decoding
+    and DataFrame work use several cores. The processes share one request budget through a SharedRateLimiter, and
+    send their batches to this process, where a single writer saves them to `sink` in arrival order.
+
+    The org numbers are parsed into an OrgNumbers first, so duplicates and invalid numbers are dropped. Without a
+    queue, they are split in `workers` shards up front, which are sent to the workers as compact arrays. With a
+    JobQueue the org numbers are added to it and the workers claim chunks from it, which balances the load and lets
+    a rerun resume where it stopped.
+    :param job: One of JOBS: 'companies', 'roles', 'financials' or 'fill_companies'
+    :param org_nums: Organisation numbers. Optional with a queue that already holds the work
+    :param queue: Optional JobQueue the workers share
+    :param workers: Number of worker processes
+    :param sink: Where the data is saved. Defaults to BigQuery. Closed when the run is done
+    :param limiter: Optional SharedRateLimiter. The budget is for all workers together
+    :param api_factory: Picklable callable (limiter, sink) -> BRREGapi run in every worker, e.g. a partial of
+        brreg_client. Defaults to BRREGapi
+    :param chunk_size: Org numbers per chunk with a queue
+    :param max_pending: Max number of batches waiting for the writer before the workers wait
+    :param logger: Optional logger
+    :return: Summary of the run
+    '''
+    if job not in JOBS:
+        raise ValueError(f"Unknown job {job}, expected one of {list(JOBS)}")
+    if org_nums is None and queue is None:
+        raise ValueError("Either org_nums or queue must be given")
+    logger = logger or Logger('brregSharded')
+    sink = sink or BigQuerySink(logger=logger)
+    limiter = limiter or SharedRateLimiter()
+    api_factory = api_factory or BRREGapi
+
+    if org_nums is not None:
+        org_nums = OrgNumbers(org_nums)
+        logger.info(f"Org numbers: {org_nums}")
+    if queue is not None:
+        if org_nums is not None:
+            queue.add(org_nums)
+        queue_spec = dict(path=queue.path, job=queue.job, max_attempts=queue.max_attempts,
+                          lease_seconds=queue.lease_seconds)
+        shards = [None] * workers
+    else:
+        queue_spec = None
+        shards = org_nums.shards(workers)
+
+    # spawn gir hver arbeider en ren prosess uten kopier av foreldrenes event loop, sesjoner og tråder
+    ctx = multiprocessing.get_context('spawn')
+    batches = ctx.Queue(maxsize=max_pending)
+    acks = [ctx.Queue() for _ in range(workers)]
+    results = ctx.Queue()
+    processes = [ctx.Process(target=_run_worker,
+                             args=(i, job, shards[i], queue_spec, chunk_size, api_factory, limiter, batches, acks[i], results),
+                             name=f'{job}-{i}',
+                             daemon=True)
+                 for i in range(workers)]
+
+    starttime = datetime.now()
+    logger.info(f"Starting {job} in {workers} processes | {queue if queue is not None else f'{len(org_nums)} org numbers'}")
+    for process in processes:
+        process.start()
+    try:
+        writes = serve_queue(batches, acks, sink, workers,
+                             alive=lambda: any(p.is_alive() for p in processes), logger=logger)
+        per_worker, errors = {}, {}
+        for _ in range(workers):
+            try:
+                index, summary, error = results.get(timeout=60)
+            except Empty:
+                break
+            if error:
+                errors[index] = error
+            else:
+                per_worker[index] = summary
+        for process in processes:
+            process.join()
+    finally:
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+        sink.close()
+
+    summary = {'workers': workers,
+               'seconds': round((datetime.now() - starttime).total_seconds(), 2),
+               **{k: sum(w[k] for w in per_worker.values())
+                  for k in ('requests', 'ok', 'throttled', 'retries', 'give_ups')},
+               **writes}
+    if queue is not None:
+        summary.update(queue.counts())
+    else:
+        summary['failed_items'] = sum(w['failed'] for w in per_worker.values())
+    summary['worker_seconds'] = [per_worker[i]['seconds'] if i in per_worker else None for i in range(workers)]
+    logger.info(f"Sharded {job} finished in {datetime.now() - starttime} | {summary}")
+    errors.update({i: 'no result' for i in range(workers) if i not in per_worker and i not in errors})
+    if errors:
+        raise RuntimeError(f"Workers failed: {errors}")
+    return summary
@@ -0,0 +1,540 @@
+import abc
+import asyncio
+import glob
+import json
+import os
+import queue
+import shutil
+import threading
+import time
+import uuid
+from typing import Literal
+
+from typing import TYPE_CHECKING
+
+import pandas as pd
+
+from src.env import load_env
+from src.metrics import DURATION_BUCKETS
+
+if TYPE_CHECKING:
+    from sibr_module import BigQuery
+
+
+def _duckdb():
+    # duckdb er valgfri og tar lang tid å importere, så den hentes først når en tabell leses
+    try:
+        import duckdb
+    except ImportError:
+        return None
+    return duckdb
+
+
+IF_EXISTS = ['append', 'replace', 'merge', 'replace_keys']
+
+
+class Sink(metaclass=abc.ABCMeta):
+    '''
+    Where the fetchers write their batches. `write` has the same arguments as `BigQuery.to_bq`, plus
+    if_exists='replace_keys' for tables with several rows per key (e.g. roles): all existing rows with the keys in
+    the batch are replaced by the rows in the batch.
+    '''
+
+    @abc.abstractmethod
+    def write(self,
+              df: pd.DataFrame,
+              table: str,
+              dataset: str,
+              if_exists: Literal['append', 'replace', 'merge', 'replace_keys'] = 'append',
+              merge_on: list[str] = None,
+              explicit_schema: dict = None) -> None:
+        '''
+        Saves a DataFrame to `dataset.table`. Raises if the batch could not be written.
+        :param df: The batch to save
+        :param table: Table name
+        :param dataset: Dataset name
+        :param if_exists: 'append', 'replace', 'merge' or 'replace_keys'
+        :param merge_on: Key columns, required with if_exists='merge' or 'replace_keys'
+        :param explicit_schema: Optional column -> BigQuery type
+        '''
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+# Typene sibr_module.BigQuery.to_bq gir en kolonne ut fra første verdi, så tabellene får samme skjema som før
+_BQ_TYPES = {'str': 'STRING', 'list': ('STRING', 'REPEATED'), 'int': 'INTEGER', 'int64': 'INTEGER',
+             'float': 'FLOAT', 'float32': 'FLOAT', 'float64': 'FLOAT', 'bool': 'BOOLEAN', 'Decimal': 'NUMERIC',
+             'datetime': 'DATETIME', 'date': 'DATE', 'Timestamp': 'TIMESTAMP'}
+
+
+class BigQuerySink(Sink):
+    '''
+    Writes to BigQuery. Appends and replaces are load jobs run here and merges go through
+    `sibr_module.BigQuery.to_bq`. 'replace_keys' loads the batch to a staging table and deletes the old rows of its
+    keys and inserts the new ones in one transaction. A write that fails raises, and the writer does not run its callback (e.g.
+    committing fingerprints or marking queue items done) for rows that were never written.
+    The client is created on the first write.
+    '''
+
+    def __init__(self, bq: 'BigQuery' = None, logger=None):
+        self._bq = bq
+        self._client = None
+        self.logger = logger
+
+    @property
+    def bq(self) -> 'BigQuery':
+        if self._bq is None:
+            from sibr_module import BigQuery
+            load_env()
+            self._bq = BigQuery(logger=self.logger)
+        return self._bq
+
+    @property
+    def client(self):
+        if self._client is None:
+            from google.cloud import bigquery
+            self._client = bigquery.Client(project=self.bq.project)
+        return self._client
+
+    @staticmethod
+    def _schema(df: pd.DataFrame, explicit_schema: dict = None) -> tuple[list, dict]:
+        from google.cloud import bigquery
+
+        explicit_schema = explicit_schema or {}
+        fields, types = [], {}
+        for col in df.columns:
+            values = df[col].dropna()
+            spec = explicit_schema.get(col) or (_BQ_TYPES.get(type(values.iloc[0]).__name__, 'STRING')
+                                                if len(values) else 'STRING')
+            bq_type, mode = spec if isinstance(spec, tuple) else (spec, 'NULLABLE')
+            fields.append(bigquery.SchemaField(str(col), bq_type, mode=mode))
+            types[col] = bq_type
+        return fields, types
+
+    @staticmethod
+    def _prepare(df: pd.DataFrame, types: dict) -> pd.DataFrame:
+        # Som to_bq: tall og tidspunkter tvinges til kolonnetypen, verdier som ikke passer blir NULL
+        df = df.copy()
+        for col, bq_type in types.items():
+            if bq_type in ('INTEGER', 'FLOAT'):
+                df[col] = pd.to_numeric(df[col], errors='coerce')
+                if bq_type == 'INTEGER':
+                    df[col] = df[col].astype('Int64')
+            elif bq_type in ('DATETIME', 'TIMESTAMP', 'DATE'):
+                df[col] = pd.to_datetime(df[col], errors='coerce', utc=True).replace({pd.NaT: None})
+        return df
+
+    def _load(self, df: pd.DataFrame, table_id: str, write_disposition: str, explicit_schema: dict = None):
+        from google.cloud import bigquery
+
+        schema, types = self._schema(df, explicit_schema)
+        job_config = bigquery.LoadJobConfig(write_disposition=write_disposition, schema=schema)
+        # result() venter på jobben og reiser feilen hvis lastingen feilet
+        self.client.load_table_from_dataframe(self._prepare(df, types), table_id, job_config=job_config).result()
+        if self.logger:
+            self.logger.info(f"{len(df)} rows written to {table_id}")
+
+    def _replace_keys(self, df: pd.DataFrame, table: str, dataset: str, key: str, explicit_schema: dict = None):
+        from google.api_core.exceptions import NotFound
+
+        table_id = f'{self.bq.project}.{dataset}.{table}'
+        try:
+            self.client.get_table(table_id)
+        except NotFound:
+            if self.logger:
+                self.logger.warning(f"Table {dataset}.{table} does not exist. Nothing to replace.")
+            self._load(df, table_id, 'WRITE_APPEND', explicit_schema)
+            return
+        # Batchen lastes til en egen tabell først, og slettingen og innsettingen skjer i én transaksjon,
+        # så feiler noe, står de gamle radene urørt
+        staging_id = f'{table_id}_staging_{uuid.uuid4().hex}'
+        columns = ', '.join(f'`{col}`' for col in df.columns)
+        try:
+            self._load(df, staging_id, 'WRITE_TRUNCATE', explicit_schema)
+            self.bq.exe_query(f"""
+                BEGIN TRANSACTION;
+                DELETE FROM `{table_id}` WHERE `{key}` IN (SELECT DISTINCT `{key}` FROM `{staging_id}`);
+                INSERT INTO `{table_id}` ({columns}) SELECT {columns} FROM `{staging_id}`;
+                COMMIT TRANSACTION;
+                """)
+        finally:
+            self.client.delete_table(staging_id, not_found_ok=True)
+
+    def write(self, df, table, dataset, if_exists='append', merge_on=None, explicit_schema=None):
+        if if_exists not in IF_EXISTS:
+            raise ValueError(f"Invalid if_exists value: {if_exists}. Choose between {IF_EXISTS}")
+        if if_exists == 'replace_keys':
+            if not merge_on or len(merge_on) != 1:
+                raise ValueError("merge_on must be a list with one column name when if_exists is 'replace_keys'.")
+            self._replace_keys(df, table, dataset, merge_on[0], explicit_schema)
+            return
+        if if_exists == 'merge':
+            self.bq.to_bq(df=df,
+                          table_name=table,
+                          dataset_name=dataset,
+                          if_exists=if_exists,
+                          merge_on=merge_on,
+                          explicit_schema=explicit_schema)
+            return
+        self._load(df, f'{self.bq.project}.{dataset}.{table}',
+                   'WRITE_TRUNCATE' if if_exists == 'replace' else 'WRITE_APPEND', explicit_schema)
+
+
+class LocalSink(Sink):
+    '''
+    Writes every batch as a Parquet file under `root/dataset/table/write_date=YYYY-MM-DD/`.
+    Writes are append-only; with if_exists='merge' or 'replace_keys' the key is recorded and `read`/`compact` keep
+    the rows from the most recent write of each key (whole rows, so a merge of a subset of the columns does not keep
+    the other columns the way a BigQuery MERGE does), using DuckDB if it is installed and pandas otherwise. `export` loads a staged table into
+    another sink (e.g. BigQuery) in one go.
+    '''
+
+    def __init__(self, root: str, logger=None):
+        '''
+        :param root: Folder the tables are written to
+        :param logger: Optional logger
+        '''
+        self.root = root
+        self.logger = logger
+        os.makedirs(root, exist_ok=True)
+
+    def _table_path(self, table: str, dataset: str) -> str:
+        return os.path.join(self.root, dataset, table)
+
+    def _meta(self, table: str, dataset: str) -> dict:
+        path = os.path.join(self._table_path(table, dataset), '_meta.json')
+        if not os.path.exists(path):
+            return {}
+        with open(path, 'r') as f:
+            return json.load(f)
+
+    def _files(self, table: str, dataset: str) -> list[str]:
+        return sorted(glob.glob(os.path.join(self._table_path(table, dataset), '*', '*.parquet')))
+
+    def write(self, df, table, dataset, if_exists='append', merge_on=None, explicit_schema=None):
+        if if_exists not in IF_EXISTS:
+            raise TypeError(f"Invalid if_exists value: {if_exists}. Choose between {', '.join(IF_EXISTS)}.")
+        if if_exists in ['merge', 'replace_keys'] and (not merge_on or not isinstance(merge_on, list)):
+            raise ValueError(f"merge_on must be a list of column names when if_exists is '{if_exists}'.")
+
+        table_path = self._table_path(table, dataset)
+        if if_exists == 'replace' and os.path.exists(table_path):
+            shutil.rmtree(table_path)
+
+        now = pd.Timestamp.now()
+        partition = os.path.join(table_path, f'write_date={now.date().isoformat()}')
+        os.makedirs(partition, exist_ok=True)
+        if if_exists in ['merge', 'replace_keys']:
+            with open(os.path.join(table_path, '_meta.json'), 'w') as f:
+                json.dump({'merge_on': merge_on, 'if_exists': if_exists}, f)
+
+        df = df.assign(_written_at=now)
+        path = os.path.join(partition, f'part-{now.strftime("%Y%m%dT%H%M%S%f")}-{uuid.uuid4().hex[:8]}.parquet')
+        df.to_parquet(path, index=False)
+        if self.logger:
+            self.logger.info(f"{len(df)} rader lagret i {path}")
+
+    def read(self, table: str, dataset: str) -> pd.DataFrame:
+        '''
+        Reads a table. For merged tables only the rows from the latest write of each key are returned.
+        '''
+        files = self._files(table, dataset)
+        if not files:
+            return pd.DataFrame()
+        merge_on = self._meta(table, dataset).get('merge_on')
+
+        duckdb = _duckdb()
+        if duckdb is not None:
+            source = f"read_parquet({files!r}, union_by_name = true, hive_partitioning = false)"
+            if merge_on:
+                keys = ', '.join(f'"{k}"' for k in merge_on)
+                query = f'''SELECT * EXCLUDE (_written_at) FROM {source}
+                            QUALIFY _written_at = max(_written_at) OVER (PARTITION BY {keys})'''
+            else:
+                query = f'SELECT * EXCLUDE (_written_at) FROM {source}'
+            with duckdb.connect() as con:
+                return con.execute(query).df()
+
+        df = pd.concat([pd.read_parquet(f) for f in files], ignore_index=True)
+        if merge_on:
+            latest = df.groupby(merge_on, dropna=False)['_written_at'].transform('max')
+            df = df[df['_written_at'] == latest]
+        return df.drop(columns=['_written_at']).reset_index(drop=True)
+
+    def compact(self, table: str, dataset: str) -> int:
+        '''
+        Rewrites a table as a single file with one version per key.
+        :return: Number of rows after compaction
+        '''
+        files = self._files(table, dataset)
+        if len(files) < 2:
+            return len(self.read(table, dataset))
+        meta = self._meta(table, dataset)
+        df = self.read(table, dataset)
+        self.write(df, table, dataset,
+                   if_exists=meta.get('if_exists', 'merge') if meta.get('merge_on') else 'append',
+                   merge_on=meta.get('merge_on'))
+        for f in files:
+            os.remove(f)
+        return len(df)
+
+    def export(self, target: Sink, table: str, dataset: str, if_exists: str = 'merge', explicit_schema: dict = None):
+        '''
+        Loads a staged table into another sink in one write.
+        :param target: The sink to load into, e.g. BigQuerySink
+        :param table: Table name
+        :param dataset: Dataset name
+        :param if_exists: 'append', 'replace' or 'merge'. 'merge' uses the mode the table was written with
+        :param explicit_schema: Optional column -> BigQuery type
+        '''
+        df = self.read(table, dataset)
+        if df.empty:
+            return
+        meta = self._meta(table, dataset)
+        merge_on = meta.get('merge_on')
+        if if_exists == 'merge':
+            if_exists = meta.get('if_exists', 'merge') if merge_on else 'append'
+        target.write(df, table, dataset, if_exists=if_exists, merge_on=merge_on, explicit_schema=explicit_schema)
+
+
+class BackgroundWriter(Sink):
+    '''
+    Runs the writes of another sink on a worker thread, so uploads overlap with fetching instead of freezing the
+    event loop. Writes are queued in order and done one at a time, so merges into the same table keep their order.
+    The queue holds at most `max_pending` batches; when it is full `write` blocks and `submit` waits, which slows
+    fetching down to the speed of the uploads instead of buffering without limit.
+    A failed write is logged and raised again from the next `flush`/`wait`/`close`. `on_done` is called on the worker
+    thread after a write succeeds.
+    '''
+
+    def __init__(self, sink: Sink, max_pending: int = 2, logger=None, metrics=None):
+        '''
+        :param sink: The sink doing the actual writes
+        :param max_pending: Max number of batches waiting for upload
+        :param logger: Optional logger
+        :param metrics: Optional Metrics. Gets the save durations, rows written and the queue depth
+        '''
+        self.sink = sink
+        self.logger = logger
+        self.metrics = metrics
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._thread = None
+        self._lock = threading.Lock()
+        self._errors = []
+        self.counters = {'writes': 0, 'rows': 0, 'failed': 0, 'blocked': 0, 'blocked_s': 0.0,
+                         'upload_s': 0.0, 'last_upload_s': 0.0, 'max_upload_s': 0.0, 'peak_depth': 0}
+        if metrics is not None:
+            metrics.set_gauge('writer_queue_depth', self._queue.qsize)
+            metrics.set_gauge('writer_blocked_seconds', lambda: self.counters['blocked_s'])
+
+    def _ensure_thread(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='BackgroundWriter', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            try:
+                if job is None:
+                    return
+                df, args, kwargs, on_done = job
+                start = time.perf_counter()
+                try:
+                    self.sink.write(df, *args, **kwargs)
+                except Exception as e:
+                    self.counters['failed'] += 1
+                    self._errors.append(e)
+                    if self.logger:
+                        self.logger.error(f"Background write of {len(df)} rows to {args} failed: {e}")
+                    continue
+                if on_done is not None:
+                    # En feil i etterarbeidet (f.eks. SQLite i SeenSet/FingerprintIndex) skal ikke stoppe tråden
+                    try:
+                        on_done()
+                    except Exception as e:
+                        self._errors.append(e)
+                        if self.logger:
+                            self.logger.error(f"Callback after writing {len(df)} rows to {args} failed: {e}")
+                elapsed = time.perf_counter() - start
+                if self.metrics is not None:
+                    table = f'{args[1]}.{args[0]}'
+                    self.metrics.observe('save_seconds', elapsed, DURATION_BUCKETS, table=table)
+                    self.metrics.inc('saved_rows_total', len(df), table=table)
+                self.counters['writes'] += 1
+                self.counters['rows'] += len(df)
+                self.counters['upload_s'] += elapsed
+                self.counters['last_upload_s'] = elapsed
+                self.counters['max_upload_s'] = max(self.counters['max_upload_s'], elapsed)
+                if self.logger:
+                    self.logger.debug(f"Wrote {len(df)} rows to {args} in {elapsed:.2f}s | {self}")
+            finally:
+                self._queue.task_done()
+
+    def _put(self, job, block: bool) -> bool:
+        try:
+            self._queue.put(job, block=block)
+        except queue.Full:
+            return False
+        self.counters['peak_depth'] = max(self.counters['peak_depth'], self._queue.qsize())
+        return True
+
+    def _blocked(self, start: float):
+        self.counters['blocked'] += 1
+        self.counters['blocked_s'] += time.perf_counter() - start
+        if self.logger:
+            self.logger.debug(f"Write queue full, waited {time.perf_counter() - start:.2f}s | {self}")
+
+    def write(self, df, table, dataset, if_exists='append', merge_on=None, explicit_schema=None, on_done=None):
+        '''
+        Queues a write. Blocks the calling thread while the queue is full. Use `submit` from async code.
+        '''
+        self._ensure_thread()
+        job = (df, (table, dataset), dict(if_exists=if_exists, merge_on=merge_on, explicit_schema=explicit_schema), on_done)
+        if not self._put(job, block=False):
+            start = time.perf_counter()
+            self._put(job, block=True)
+            self._blocked(start)
+
+    async def submit(self, df, table, dataset, if_exists='append', merge_on=None, explicit_schema=None, on_done=None):
+        '''
+        Queues a write without blocking the event loop. Waits (letting other tasks run) while the queue is full.
+        '''
+        self._ensure_thread()
+        job = (df, (table, dataset), dict(if_exists=if_exists, merge_on=merge_on, explicit_schema=explicit_schema), on_done)
+        if not self._put(job, block=False):
+            start = time.perf_counter()
+            await asyncio.to_thread(self._put, job, True)
+            self._blocked(start)
+
+    def _raise_errors(self):
+        if self._errors:
+            errors, self._errors = self._errors, []
+            raise errors[0]
+
+    def flush(self):
+        '''
+        Blocks until every queued write is done. Raises the first error since the last flush.
+        '''
+        if self._thread is not None:
+            self._queue.join()
+        self._raise_errors()
+
+    async def wait(self):
+        '''
+        Async version of `flush`.
+        '''
+        if self._thread is not None:
+            await asyncio.to_thread(self._queue.join)
+        self._raise_errors()
+
+    def close(self):
+        '''
+        Flushes the queue, stops the worker thread and closes the wrapped sink.
+        '''
+        try:
+            self.flush()
+        finally:
+            if self._thread is not None and self._thread.is_alive():
+                self._queue.put(None)
+                self._thread.join()
+            self._thread = None
+            self.sink.close()
+
+    def stats(self) -> dict:
+        writes = self.counters['writes']
+        return {'depth': self._queue.qsize(),
+                'peak_depth': self.counters['peak_depth'],
+                'writes': writes,
+                'rows': self.counters['rows'],
+                'failed': self.counters['failed'],
+                'mean_upload_s': round(self.counters['upload_s'] / writes, 2) if writes else 0.0,
+                'max_upload_s': round(self.counters['max_upload_s'], 2),
+                'blocked': self.counters['blocked'],
+                'blocked_s': round(self.counters['blocked_s'], 2)}
+
+    def __str__(self):
+        return ' | '.join(f'{k} {v}' for k, v in self.stats().items())
+
+
+class QueueSink(Sink):
+    '''
+    Sends writes to another process over a multiprocessing queue, so several worker processes can share one writer
+    (see `src.sharding`). The receiving process runs `serve_queue`. `write` waits until the batch is written there,
+    so a worker never counts rows as saved before they are, and a full queue holds the workers back.
+    '''
+
+    def __init__(self, batches, acks, worker: int, timeout: float = 3600):
+        '''
+        :param batches: multiprocessing queue shared by all workers
+        :param acks: multiprocessing queue for the replies to this worker
+        :param worker: Index of this worker
+        :param timeout: Seconds to wait for a write before giving up
+        '''
+        self.batches = batches
+        self.acks = acks
+        self.worker = worker
+        self.timeout = timeout
+
+    def write(self, df, table, dataset, if_exists='append', merge_on=None, explicit_schema=None):
+        self.batches.put((self.worker, df, table, dataset,
+                          dict(if_exists=if_exists, merge_on=merge_on, explicit_schema=explicit_schema)))
+        try:
+            error = self.acks.get(timeout=self.timeout)
+        except queue.Empty:
+            raise TimeoutError(f"No reply from the writer for {dataset}.{table} in {self.timeout}s")
+        if error:
+            raise RuntimeError(f"Write of {len(df)} rows to {dataset}.{table} failed in the writer: {error}")
+
+    def done(self):
+        '''
+        Tells `serve_queue` that this worker will not send more batches.
+        '''
+        self.batches.put((self.worker, None, None, None, None))
+
+
+def serve_queue(batches, acks: list, sink: Sink, workers: int, alive=None, logger=None) -> dict:
+    '''
+    Writes the batches sent by `QueueSink`s to `sink`, one at a time in the order they arrive, and replies to
+    each worker when its batch is written. Returns when every worker has called `done`, or when `alive()`
+    returns False and the queue is empty (e.g. the worker processes were killed).
+    :param batches: The queue the QueueSinks write to
+    :param acks: Reply queue per worker
+    :param sink: The sink doing the actual writes
+    :param workers: Number of workers
+    :param alive: Optional function telling whether any worker is still running
+    :param logger: Optional logger
+    :return: Counts of writes, rows, failed writes and seconds spent writing
+    '''
+    stats = {'writes': 0, 'rows': 0, 'failed_writes': 0, 'write_s': 0.0}
+    remaining = set(range(workers))
+    while remaining:
+        try:
+            worker, df, table, dataset, kwargs = batches.get(timeout=1)
+        except queue.Empty:
+            if alive is not None and not alive():
+                if logger:
+                    logger.warning(f"Workers {sorted(remaining)} stopped without finishing")
+                break
+            continue
+        if df is None:
+            remaining.discard(worker)
+            continue
+        start = time.perf_counter()
+        error = None
+        try:
+            sink.write(df, table, dataset, **kwargs)
+            stats['writes'] += 1
+            stats['rows'] += len(df)
+        except Exception as e:
+            stats['failed_writes'] += 1
+            error = repr(e)
+            if logger:
+                logger.error(f"Write of {len(df)} rows from worker {worker} to {dataset}.{table} failed: {e}")
+        stats['write_s'] += time.perf_counter() - start
+        acks[worker].put(error)
+    stats['write_s'] = round(stats['write_s'], 2)
+    return stats
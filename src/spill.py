@@ -0,0 +1,142 @@
+import os
+import shutil
+import tempfile
+import weakref
+from typing import Iterator
+
+import pandas as pd
+
+
+class SpillFrame:
+    '''
+    A result collected batch by batch that only keeps `memory_limit` bytes in memory. Batches are held in RAM until
+    they would take more than the limit, and are then written to Parquet files in a temporary folder. Batches with
+    object columns that hold anything but strings (e.g. the address lists in company_data) are pickled instead, since
+    Parquet would give them back as numpy arrays and dicts with added keys: a batch reads back the same whether it
+    was spilled or not. `__iter__` reads the batches back one at a time in the order they were added, `to_pandas`
+    builds one DataFrame of them all, so it needs the whole result in memory.
+    The folder is removed by `close`, or when the SpillFrame is garbage collected.
+    '''
+
+    def __init__(self, memory_limit: int = 256 * 2 ** 20, spill_dir: str = None, logger=None):
+        '''
+        :param memory_limit: Bytes of batches kept in memory before they are spilled. 0 spills every batch
+        :param spill_dir: Folder the temporary folder is made in. The system temp folder if None
+        :param logger: Optional logger
+        '''
+        self.memory_limit = memory_limit
+        self.spill_dir = spill_dir
+        self.logger = logger
+        # (sti, None) for batcher på disk og (None, df) for batcher i minnet, i den rekkefølgen de kom
+        self._batches = []
+        self._memory = 0
+        self._dir = None
+        self._finalizer = None
+        self.rows = 0
+        self.counters = {'batches': 0, 'spilled': 0, 'spilled_bytes': 0}
+
+    @property
+    def path(self) -> str | None:
+        '''
+        The folder with the spilled batches, or None if nothing has been spilled.
+        '''
+        return self._dir
+
+    @property
+    def paths(self) -> list[str]:
+        '''
+        The spilled Parquet files, e.g. for reading them with DuckDB or pyarrow.dataset without going through pandas.
+        Pickled batches are not included; iterate the SpillFrame to get every batch.
+        '''
+        return [path for path, _ in self._batches if path is not None and path.endswith('.parquet')]
+
+    def append(self, df: pd.DataFrame | None):
+        '''
+        Adds a batch. Spills the batches in memory if it puts them over `memory_limit`.
+        '''
+        if df is None or df.empty:
+            return
+        self._batches.append((None, df))
+        self._memory += int(df.memory_usage(index=False, deep=True).sum())
+        self.rows += len(df)
+        self.counters['batches'] += 1
+        if self._memory > self.memory_limit:
+            self.spill()
+
+    def spill(self):
+        '''
+        Writes every batch held in memory to disk.
+        '''
+        if self._dir is None:
+            self._dir = tempfile.mkdtemp(prefix='spill_', dir=self.spill_dir)
+            self._finalizer = weakref.finalize(self, shutil.rmtree, self._dir, True)
+        for i, (path, df) in enumerate(self._batches):
+            if df is None:
+                continue
+            path = os.path.join(self._dir, f'part-{i:06d}.parquet')
+            try:
+                if not self._parquet_safe(df):
+                    raise TypeError('object columns with values other than strings')
+                df.to_parquet(path, index=False)
+            except (TypeError, ValueError, ImportError) as e:
+                # Lister, dict-er og blandede typer (f.eks. rå json før casting) ville ikke kommet likt tilbake
+                path = path.replace('.parquet', '.pkl')
+                if self.logger:
+                    self.logger.debug(f"Spilling batch {i} with pickle instead of Parquet: {e}")
+                df.to_pickle(path)
+            self._batches[i] = (path, None)
+            self.counters['spilled'] += 1
+            self.counters['spilled_bytes'] += os.path.getsize(path)
+        if self.logger and self._memory:
+            self.logger.debug(f"Spilled {self._memory / 1e6:.1f} MB to {self._dir} | {self}")
+        self._memory = 0
+
+    @staticmethod
+    def _parquet_safe(df: pd.DataFrame) -> bool:
+        # Strenger og skalarer med egen dtype kommer likt tilbake fra Parquet, andre objekter gjør ikke det
+        return all(pd.api.types.infer_dtype(df[col], skipna=True) in ('string', 'empty')
+                   for col in df.columns if df[col].dtype == object)
+
+    @staticmethod
+    def _read(path: str) -> pd.DataFrame:
+        return pd.read_pickle(path) if path.endswith('.pkl') else pd.read_parquet(path)
+
+    def __iter__(self) -> Iterator[pd.DataFrame]:
+        for path, df in list(self._batches):
+            yield df if df is not None else self._read(path)
+
+    def to_pandas(self) -> pd.DataFrame:
+        '''
+        All batches as one DataFrame. This is the only call that needs the whole result in memory, so it is not
+        bounded by `memory_limit`.
+        '''
+        frames = list(self)
+        if not frames:
+            return pd.DataFrame()
+        return pd.concat(frames, ignore_index=True)
+
+    def __len__(self) -> int:
+        return self.rows
+
+    def close(self):
+        '''
+        Drops the batches and removes the spilled files.
+        '''
+        self._batches = []
+        self._memory = 0
+        if self._finalizer is not None:
+            self._finalizer()
+        self._dir = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def stats(self) -> dict:
+        return {'rows': self.rows, 'in_memory_bytes': self._memory, **self.counters}
+
+    def __str__(self):
+        return (f"{self.rows} rows | {self.counters['batches']} batches | {self.counters['spilled']} spilled "
+                f"({self.counters['spilled_bytes'] / 1e6:.1f} MB on disk) | {self._memory / 1e6:.1f} MB in memory")
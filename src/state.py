@@ -0,0 +1,29 @@
+import json
+import os
+
+
+def read_state(path: str, default: dict = None) -> dict:
+    '''
+    Reads a small json state file (checkpoints, high-water marks).
+    :param path: Path to the file
+    :param default: Returned if the file does not exist
+    :return: The stored state
+    '''
+    if not path or not os.path.exists(path):
+        return dict(default or {})
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def write_state(path: str, state: dict) -> None:
+    '''
+    Writes a json state file atomically, so an interrupted run never leaves a half written checkpoint.
+    :param path: Path to the file
+    :param state: Json serialisable dict
+    '''
+    folder = os.path.dirname(os.path.abspath(path))
+    os.makedirs(folder, exist_ok=True)
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f, default=str)
+    os.replace(tmp_path, path)